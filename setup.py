@@ -12,6 +12,9 @@ setup(
     entry_points={
         "console_scripts": [
             'dc-test-exec=dc_test_exec.main:cli'
+        ],
+        "pytest11": [
+            'dc_test_exec=dc_test_exec.pytest_plugin'
         ]
     },
     install_requires=[
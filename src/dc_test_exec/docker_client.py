@@ -0,0 +1,12 @@
+import docker
+from docker.constants import DEFAULT_MAX_POOL_SIZE
+
+
+def get_pool_size(service_count: int) -> int:
+    # each service may hold a log stream and a stats stream open while it is probed or started
+    return max(DEFAULT_MAX_POOL_SIZE, 2 * service_count + 4)
+
+
+def create_docker_client(service_count: int = 0) -> docker.DockerClient:
+    # DOCKER_HOST, DOCKER_TLS_VERIFY and DOCKER_CERT_PATH are read by from_env
+    return docker.from_env(max_pool_size=get_pool_size(service_count))
@@ -1,19 +1,38 @@
+# pylint: disable=too-many-lines
+import copy
+import hashlib
 import http
+import io
 import json
 import os
+import re
 import ssl
 import sys
+import tarfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Tuple, Callable
 from pathlib import Path
 from os.path import exists
 
+import click
 import deepdiff
-import docker
 import yaml
 
-from docker.errors import NotFound
+from docker.errors import NotFound, ContainerError
+
+from dc_test_exec.docker_client import create_docker_client
+from dc_test_exec.ephemeral_volumes import apply_ephemeral_volumes, parse_df_output
+from dc_test_exec.file_watcher import FileWatcher
+from dc_test_exec.image_builds import get_build_spec, get_build_tag, get_build_command
+from dc_test_exec.log_capture import LogCapture
+from dc_test_exec.one_shot_cache import OneShotCache, hash_paths
+from dc_test_exec.reaper import apply_run_labels, get_run_labels, get_default_run_id
+from dc_test_exec.resource_stats import ResourceSampler, transform_resource_stats_to_log
+from dc_test_exec.timing_history import TimingHistory
 
 
 class ServiceStatus(Enum):
@@ -25,6 +44,16 @@ class ServiceStatus(Enum):
     EXECUTED_ERROR = 6
 
 
+# statuses that satisfy each depends_on condition, None being the short syntax
+DEPENDENCY_CONDITIONS = {
+    None: [ServiceStatus.READY, ServiceStatus.EXECUTED_SUCCESSFULLY],
+    'service_started': [ServiceStatus.NOT_READY, ServiceStatus.READY, ServiceStatus.EXECUTED_SUCCESSFULLY,
+                        ServiceStatus.EXECUTED_ERROR],
+    'service_healthy': [ServiceStatus.READY],
+    'service_completed_successfully': [ServiceStatus.EXECUTED_SUCCESSFULLY]
+}
+
+
 class BaseContainerService:
 
     def get_service_status(self, service_name: str) -> ServiceStatus:
@@ -33,20 +62,65 @@ class BaseContainerService:
     def start_service(self, service_name: str) -> None:
         pass
 
-    def run_exec_container(self) -> int:
+    def run_exec_container(self, collect: list[Tuple[str, str]] = None) -> int:
         pass
 
     def restart(self, service_name: str) -> None:
         pass
 
-    def run_one_shot_service(self, one_shot_service_name):
+    def run_one_shot_service(self, one_shot_service_name, collect: list[Tuple[str, str]] = None,
+                             buffer_logs: bool = False):
+        pass
+
+    def get_not_ready_cause(self, service_name: str) -> str | None:
+        pass
+
+    def snapshot(self, snapshot_dir: Path, as_image: bool) -> str:
+        pass
+
+    def restore_snapshot(self, snapshot_dir: Path) -> bool:
+        pass
+
+    def get_image_digest(self, service_name: str) -> str | None:
+        pass
+
+    def defer_readiness_check(self, service_name: str, until: float) -> None:
+        pass
+
+    def is_one_shot_cached(self, service_name: str) -> bool:
+        pass
+
+    def cache_one_shot(self, service_name: str) -> None:
+        pass
+
+    def get_captured_logs(self, service_name: str, lines: int = None) -> list[str]:
+        pass
+
+    def get_failed_starts(self) -> set[str]:
+        pass
+
+    def retry_service(self, service_name: str) -> None:
+        pass
+
+    def get_resource_stats(self) -> dict | None:
+        pass
+
+    def reload_compose_file(self, compose_file: dict) -> None:
+        pass
+
+    def get_tmpfs_usage(self) -> dict | None:
+        pass
+
+    def build_images(self) -> dict:
         pass
 
 
-# pylint: disable=too-few-public-methods
 class BaseReadinessCheck:
 
-    def is_ready(self, service_name: str, service_ip: str) -> bool:
+    def is_ready(self, service_name: str, service_ip: str, container_name: str = None) -> bool:
+        pass
+
+    def get_not_ready_cause(self, service_name: str) -> str | None:
         pass
 
 
@@ -55,39 +129,109 @@ class ComposeReadinessCheck:
     def __init__(self, health_checks: list[BaseReadinessCheck]):
         self._health_checks = health_checks
 
-    def is_ready(self, service_name: str, service_ip: str) -> bool:
+    def is_ready(self, service_name: str, service_ip: str, container_name: str = None) -> bool:
         for health_check in self._health_checks:
-            if not health_check.is_ready(service_name, service_ip):
+            if not health_check.is_ready(service_name, service_ip, container_name):
                 return False
         return True
 
+    def get_not_ready_cause(self, service_name: str) -> str | None:
+        for health_check in self._health_checks:
+            cause = health_check.get_not_ready_cause(service_name)
+            if cause:
+                return cause
+        return None
+
 
+# pylint: disable=too-many-public-methods,too-many-instance-attributes
 class Services:
 
     def __init__(self, compose_file_path: Path,
-                 container_service: BaseContainerService):
+                 container_service: BaseContainerService, **kwargs):
         self.compose_file = yaml.safe_load(compose_file_path.read_text())
         self.container_service = container_service
+        self.max_starting = kwargs.get('max_starting', None)
+        self.timing_history = kwargs.get('timing_history', None)
+        self.ready_timeout = kwargs.get('ready_timeout', None)
+        self._image_digests = {}
+        self._start_priorities = None
+        self._expected_timings = {}
+        self.start_time = None
+        self.timeline = {}
+        self.skipped_services = set()
+        self.scheduled_services = None
+        self.last_services_status = None
+        self.start_attempts = {}
+        self.given_up_services = set()
+        self._start_failed_at = {}
+
+    def get_dependencies(self, service_name: str) -> list[str]:
+        return list(self.compose_file['services'][service_name].get('depends_on', []))
 
-    def get_services_status(self) -> dict:
+    # pylint: disable=broad-exception-raised
+    def get_dependency_conditions(self, service_name: str) -> dict:
+        depends_on = self.compose_file['services'][service_name].get('depends_on', [])
+        if isinstance(depends_on, list):
+            return {dependency_name: None for dependency_name in depends_on}
         result = {}
+        for dependency_name, dependency in depends_on.items():
+            condition = (dependency or {}).get('condition', 'service_started')
+            if condition not in DEPENDENCY_CONDITIONS:
+                raise Exception(f'unknown depends_on condition {condition} for {service_name} -> {dependency_name}')
+            result[dependency_name] = condition
+        return result
+
+    def _record_status(self, service_name: str, status: ServiceStatus) -> None:
+        if service_name not in self.timeline:
+            return
+        timeline = self.timeline[service_name]
+        if status in [ServiceStatus.NOT_READY, ServiceStatus.READY, ServiceStatus.EXECUTED_SUCCESSFULLY,
+                      ServiceStatus.EXECUTED_ERROR] and 'running' not in timeline:
+            timeline['running'] = time.time()
+        if status in [ServiceStatus.READY, ServiceStatus.EXECUTED_SUCCESSFULLY,
+                      ServiceStatus.EXECUTED_ERROR] and 'ready' not in timeline:
+            timeline['ready'] = time.time()
+
+    def _get_service_status(self, service_name: str) -> ServiceStatus:
+        if service_name in self.skipped_services:
+            return ServiceStatus.EXECUTED_SUCCESSFULLY
+        return self.container_service.get_service_status(service_name)
+
+    def get_services_status(self) -> dict:
+        statuses = {}
         for service_name in self.compose_file['services']:
+            if not self.is_exec_service(service_name):
+                statuses[service_name] = self._get_service_status(service_name)
+
+        result = {}
+        for service_name, status in statuses.items():
             service = self.compose_file['services'][service_name]
-            if self.is_exec_service(service_name):
-                continue
-            service_status = {
-                'status': self.container_service.get_service_status(service_name)}
+            service_status = {'status': status}
+            if service_status['status'] == ServiceStatus.NOT_READY:
+                cause = self.container_service.get_not_ready_cause(service_name)
+                if cause:
+                    service_status['error'] = cause
+            self._record_status(service_name, service_status['status'])
             if 'depends_on' in service:
                 dependency_status = {}
                 for dependency_name in service['depends_on']:
-                    dependency_status[dependency_name] = self.container_service.get_service_status(dependency_name)
+                    dependency_status[dependency_name] = statuses[dependency_name] if dependency_name in statuses \
+                        else self._get_service_status(dependency_name)
                 service_status['dependencies'] = dependency_status
             result[service_name] = service_status
+        self.last_services_status = result
         return result
 
     def is_exec_service(self, service_name: str) -> bool:
         return 'x-exec-container' in self.compose_file['services'][service_name]
 
+    def is_one_shot_service(self, service_name: str) -> bool:
+        return 'x-one-shot' in self.compose_file['services'][service_name]
+
+    def get_one_shot_services(self) -> list[str]:
+        return [service_name for service_name in self.compose_file['services']
+                if self.is_one_shot_service(service_name)]
+
     def get_services_without_dependency(self) -> list[str]:
         result = []
         for service_name in self.compose_file['services']:
@@ -108,8 +252,7 @@ class Services:
                 result.append(service_name)
         return result
 
-    # pylint: disable=broad-exception-raised
-    def check_all_dependents_ready(self, service_name: str) -> bool:
+    def check_all_dependents_ready(self, service_name: str, services_status: dict = None) -> bool:
         service = self.compose_file['services'][service_name]
         if self.is_exec_service(service_name):
             raise Exception(
@@ -117,19 +260,25 @@ class Services:
         if 'depends_on' not in service:
             raise Exception("trying to check dependencies service without dependencies.")
 
-        for dependency_name in service['depends_on']:
-            if self.container_service.get_service_status(dependency_name) not in \
-                    [ServiceStatus.READY, ServiceStatus.EXECUTED_SUCCESSFULLY]:
+        for dependency_name, condition in self.get_dependency_conditions(service_name).items():
+            if services_status and dependency_name in services_status:
+                dependency_status = services_status[dependency_name]['status']
+            else:
+                dependency_status = self._get_service_status(dependency_name)
+            if dependency_status not in DEPENDENCY_CONDITIONS[condition]:
                 return False
 
         return True
 
-    def get_services_ready_to_start(self) -> list[str] | None:
+    def get_services_ready_to_start(self, services_status: dict = None) -> list[str] | None:
         result = []
-        services_status = self.get_services_status()
+        if services_status is None:
+            services_status = self.get_services_status()
 
         all_started = True
-        for service in services_status.values():
+        for service_name, service in services_status.items():
+            if self.scheduled_services is not None and service_name not in self.scheduled_services:
+                continue
             all_started = all_started and (
                     service['status'] == ServiceStatus.READY or
                     service['status'] == ServiceStatus.EXECUTED_SUCCESSFULLY or
@@ -140,34 +289,201 @@ class Services:
 
         for service_name in self.get_services_with_dependency():
             if services_status[service_name]['status'] == ServiceStatus.NOT_STARTED and \
-                    self.check_all_dependents_ready(service_name):
+                    self.check_all_dependents_ready(service_name, services_status):
                 result.append(service_name)
 
         for service_name in self.get_services_without_dependency():
             if services_status[service_name]['status'] == ServiceStatus.NOT_STARTED:
                 result.append(service_name)
 
-        return result
+        if self.scheduled_services is not None:
+            result = [service_name for service_name in result if service_name in self.scheduled_services]
+        priorities = self.get_start_priorities()
+        return sorted(result, key=lambda service_name: -priorities[service_name])
+
+    @staticmethod
+    def get_until_targets(until: str | list[str] = None) -> list[str]:
+        return [until] if isinstance(until, str) else list(until or [])
 
-    def start_all_available_services(self, until: str = None) -> bool:
+    def get_unknown_services(self, service_names: list[str]) -> list[str]:
+        return [service_name for service_name in service_names
+                if service_name not in self.compose_file['services'] or self.is_exec_service(service_name)]
+
+    def start_all_available_services(self, until: str | list[str] = None) -> bool:
 
         service_status = self.get_services_status()
-        if until is not None and until in service_status and \
-                (service_status[until]['status'] == ServiceStatus.READY or
-                 service_status[until]['status'] == ServiceStatus.EXECUTED_SUCCESSFULLY or
-                 service_status[until]['status'] == ServiceStatus.EXECUTED_ERROR):
+        targets = self.get_until_targets(until)
+        if targets and all(service_status[target]['status'] in [ServiceStatus.READY,
+                                                                ServiceStatus.EXECUTED_SUCCESSFULLY,
+                                                                ServiceStatus.EXECUTED_ERROR]
+                           for target in targets):
+            return False
+
+        if self.given_up_services and not any(
+                self._can_progress(service_name, service_status) for service_name in service_status
+                if self.scheduled_services is None or service_name in self.scheduled_services):
             return False
 
-        services = self.get_services_ready_to_start()
+        services = self.get_services_ready_to_start(service_status)
 
         if services is None:
             return False
 
+        failed_starts = self.container_service.get_failed_starts() or set()
+        if self.max_starting is not None:
+            services = self._admit_services(services, service_status, failed_starts)
+
         for service_name in services:
-            self.container_service.start_service(service_name)
+            if service_name in failed_starts:
+                if not self._is_retry_due(service_name):
+                    continue
+                self.container_service.retry_service(service_name)
+                self.timeline[service_name] = {'started': time.time()}
+            else:
+                self.timeline.setdefault(service_name, {'started': time.time()})
+                self.container_service.start_service(service_name)
+            expected = self.get_expected_timings(service_name)
+            if expected:
+                # probe from shortly before the historical ready time instead of right away
+                self.container_service.defer_readiness_check(
+                    service_name, self.timeline[service_name]['started'] + expected['to_ready'] * 0.8)
+
+        return True
 
+    def _can_progress(self, service_name: str, services_status: dict) -> bool:
+        if service_name in self.given_up_services:
+            return False
+        status = services_status[service_name]['status']
+        if status == ServiceStatus.NOT_READY:
+            return True
+        if status != ServiceStatus.NOT_STARTED:
+            return False
+        # a service waiting on a given up dependency will never be started
+        return not any(dependency_name in self.given_up_services
+                       for dependency_name in self.get_dependencies_closure([service_name]))
+
+    def get_start_retries(self, service_name: str) -> Tuple[int, float]:
+        service = self.compose_file['services'][service_name]
+        return int(service.get('x-start-retries', 0)), float(service.get('x-start-backoff', 1))
+
+    def _is_retry_due(self, service_name: str) -> bool:
+        if service_name not in self.timeline:
+            # left behind by a previous run, not a failure of this one
+            return True
+        attempts = self.start_attempts.get(service_name, 0)
+        retries, backoff = self.get_start_retries(service_name)
+        if attempts >= retries:
+            self.given_up_services.add(service_name)
+            return False
+        failed_at = self._start_failed_at.setdefault(service_name, time.time())
+        if time.time() - failed_at < backoff * 2 ** attempts:
+            return False
+        self.start_attempts[service_name] = attempts + 1
+        self._start_failed_at.pop(service_name)
         return True
 
+    def _get_image_digest(self, service_name: str) -> str | None:
+        # an image that is not pulled or built yet has no digest, it is looked up again once it is
+        if self._image_digests.get(service_name) is None:
+            self._image_digests[service_name] = self.container_service.get_image_digest(service_name)
+        return self._image_digests[service_name]
+
+    def get_expected_timings(self, service_name: str) -> dict | None:
+        if self.timing_history is None:
+            return None
+        if service_name not in self._expected_timings:
+            image_digest = self._get_image_digest(service_name)
+            self._expected_timings[service_name] = None if image_digest is None else \
+                self.timing_history.get_expected(service_name, image_digest)
+        return self._expected_timings[service_name]
+
+    def get_expected_start_seconds(self, service_name: str) -> float:
+        expected = self.get_expected_timings(service_name)
+        if expected:
+            return expected['to_ready']
+        return float(self.compose_file['services'][service_name].get('x-expected-start-seconds', 1.0))
+
+    def get_startup_eta(self) -> float | None:
+        if self.timing_history is None:
+            return None
+        pending = [service_name for service_name, service_status in self.get_services_status().items()
+                   if service_status['status'] == ServiceStatus.NOT_STARTED and
+                   (self.scheduled_services is None or service_name in self.scheduled_services)]
+        # without history the priorities are the 1s defaults, not an estimate
+        if not any(self.get_expected_timings(service_name) for service_name in pending):
+            return None
+        priorities = self.get_start_priorities()
+        return max(priorities[service_name] for service_name in pending)
+
+    def record_timings(self) -> None:
+        if self.timing_history is None:
+            return
+        for service_name, timing in self._get_measured_services().items():
+            # the container is running now, its image is the one that was measured
+            image_digest = self.container_service.get_image_digest(service_name)
+            if image_digest is not None:
+                self.timing_history.record(service_name, image_digest, timing['running'] - timing['started'],
+                                           timing['ready'] - timing['started'])
+
+    # expected time from starting a service until its longest chain of dependents is ready
+    def get_start_priorities(self) -> dict:
+        # every tick sorts by them, the history behind them only changes between starts
+        if self._start_priorities is not None:
+            return self._start_priorities
+        self.check_dependency_cycles()
+        dependents = {service_name: [] for service_name in self.compose_file['services']
+                      if not self.is_exec_service(service_name)}
+        for service_name in dependents:
+            for dependency_name in self.get_dependencies(service_name):
+                if dependency_name in dependents:
+                    dependents[dependency_name].append(service_name)
+
+        result = {}
+
+        def get_priority(service_name: str) -> float:
+            if service_name not in result:
+                result[service_name] = self.get_expected_start_seconds(service_name) + \
+                    max((get_priority(dependent_name) for dependent_name in dependents[service_name]), default=0.0)
+            return result[service_name]
+
+        for service_name in dependents:
+            get_priority(service_name)
+        self._start_priorities = result
+        return result
+
+    def get_start_weight(self, service_name: str) -> float:
+        service = self.compose_file['services'][service_name]
+        if 'x-start-weight' in service:
+            return float(service['x-start-weight'])
+        resources = service.get('deploy', {}).get('resources', {})
+        for section in ['reservations', 'limits']:
+            if 'cpus' in resources.get(section, {}):
+                return float(resources[section]['cpus'])
+        return 1.0
+
+    def _is_starting(self, service_name: str, services_status: dict, failed_starts: set[str]) -> bool:
+        status = services_status[service_name]['status']
+        if status == ServiceStatus.NOT_READY:
+            return True
+        # launched but the creator has not brought the container up yet, unless it exited and awaits a retry
+        return status == ServiceStatus.NOT_STARTED and service_name in self.timeline and \
+            'running' not in self.timeline[service_name] and \
+            service_name not in failed_starts
+
+    def _admit_services(self, services: list[str], services_status: dict, failed_starts: set[str]) -> list[str]:
+        starting_weight = sum(self.get_start_weight(service_name) for service_name in services_status
+                              if self._is_starting(service_name, services_status, failed_starts))
+        result = []
+        for service_name in services:
+            if self._is_starting(service_name, services_status, failed_starts):
+                continue
+            weight = self.get_start_weight(service_name)
+            if starting_weight > 0 and starting_weight + weight > self.max_starting:
+                continue
+            starting_weight += weight
+            result.append(service_name)
+        return result
+
     @staticmethod
     def transform_status_to_log(status: dict) -> list[str]:
         result = []
@@ -182,46 +498,400 @@ class Services:
 
         return result
 
+    # pylint: disable=broad-exception-raised
     def start(self, verification_step_millis: int, presentation_step_millis: int,
-              presentation: Callable[[list[str]], None], until: str = None) -> int:
-
-        presentation(
-            Services.transform_status_to_log(
-                self.get_services_status()))
+              presentation: Callable[[dict], None], until: str | list[str] = None) -> bool:
+        targets = self.get_until_targets(until)
+        unknown = self.get_unknown_services(targets)
+        if unknown:
+            raise Exception(f'unknown services to start until : {", ".join(unknown)}')
+        scheduled_services = self.scheduled_services
+        if targets:
+            # the closure does not change during a start, it is only computed once
+            self.scheduled_services = [service_name for service_name in self.get_dependencies_closure(targets)
+                                       if scheduled_services is None or service_name in scheduled_services]
+        try:
+            return self._start(verification_step_millis, presentation_step_millis, presentation, targets)
+        finally:
+            self.scheduled_services = scheduled_services
+
+    def _start(self, verification_step_millis: int, presentation_step_millis: int,
+               presentation: Callable[[dict], None], targets: list[str]) -> bool:
+
+        self.start_time = time.time()
+        self.timeline = {}
+        self.start_attempts = {}
+        self.given_up_services = set()
+        self._start_failed_at = {}
+        self._start_priorities = None
+        self._expected_timings = {}
+        presentation(self.get_services_status())
         last_presentation = time.time()
+        completed = True
         while True:
             last_verification = time.time()
-            if not self.start_all_available_services(until):
-                presentation(
-                    Services.transform_status_to_log(
-                        self.get_services_status()))
+            if not self.start_all_available_services(targets):
+                break
+            if self.ready_timeout is not None and time.time() - self.start_time > self.ready_timeout:
+                completed = False
                 break
             if (time.time() - last_presentation) * \
                     1_000 > presentation_step_millis:
-                presentation(
-                    Services.transform_status_to_log(
-                        self.get_services_status()))
+                presentation(self.last_services_status)
                 last_presentation = time.time()
-            if (time.time() - last_verification) * \
-                    1_000 < verification_step_millis:
-                time.sleep(verification_step_millis // 1_000)
-        presentation(
-            Services.transform_status_to_log(
-                self.get_services_status()))
+            elapsed_millis = (time.time() - last_verification) * 1_000
+            if elapsed_millis < verification_step_millis:
+                time.sleep((verification_step_millis - elapsed_millis) / 1_000)
+        presentation(self.get_services_status())
+        self.record_timings()
+        return completed and not self.given_up_services
+
+    def get_failed_services(self) -> list[str]:
+        return [service_name for service_name, service_status in (self.last_services_status or {}).items()
+                if service_status['status'] in [ServiceStatus.NOT_READY, ServiceStatus.INVALID,
+                                                ServiceStatus.EXECUTED_ERROR] or
+                service_name in self.given_up_services]
+
+    def _get_measured_services(self) -> dict:
+        result = {}
+        for service_name, timeline in self.timeline.items():
+            if 'ready' in timeline:
+                result[service_name] = {
+                    'started': timeline['started'] - self.start_time,
+                    'running': timeline['running'] - self.start_time,
+                    'ready': timeline['ready'] - self.start_time
+                }
+        return result
+
+    def get_critical_path_report(self) -> dict | None:
+        measured = self._get_measured_services()
+        if not measured:
+            return None
+
+        dependents = {service_name: [] for service_name in measured}
+        for service_name in measured:
+            for dependency_name in self.get_dependencies(service_name):
+                if dependency_name in measured:
+                    dependents[dependency_name].append(service_name)
+
+        total = max(timing['ready'] for timing in measured.values())
+        critical_path = [max(measured, key=lambda name: measured[name]['ready'])]
+        while True:
+            dependencies = [name for name in self.get_dependencies(critical_path[0]) if name in measured]
+            if not dependencies:
+                break
+            critical_path.insert(0, max(dependencies, key=lambda name: measured[name]['ready']))
+
+        latest_ready = {}
+
+        def get_latest_ready(service_name: str) -> float:
+            if service_name not in latest_ready:
+                latest_ready[service_name] = min(
+                    [total] + [get_latest_ready(dependent) -
+                               (measured[dependent]['ready'] - measured[dependent]['started'])
+                               for dependent in dependents[service_name]])
+            return latest_ready[service_name]
+
+        waited_on_sibling = []
+        for service_name in measured:
+            dependencies = [name for name in self.get_dependencies(service_name) if name in measured]
+            if len(dependencies) < 2:
+                continue
+            slowest = max(dependencies, key=lambda name: measured[name]['ready'])
+            for dependency_name in dependencies:
+                waited = measured[slowest]['ready'] - measured[dependency_name]['ready']
+                if waited > 0:
+                    waited_on_sibling.append({'service': dependency_name, 'dependent': service_name,
+                                              'waited_for': slowest, 'seconds': round(waited, 3)})
+
+        return {
+            'total_seconds': round(total, 3),
+            'critical_path': [{
+                'service': service_name,
+                'time_to_running': round(measured[service_name]['running'] - measured[service_name]['started'], 3),
+                'time_to_ready': round(measured[service_name]['ready'] - measured[service_name]['started'], 3)
+            } for service_name in critical_path],
+            'slack': {service_name: round(max(0.0, get_latest_ready(service_name) - timing['ready']), 3)
+                      for service_name, timing in measured.items() if service_name not in critical_path},
+            'waited_on_sibling': waited_on_sibling
+        }
+
+    @staticmethod
+    def transform_critical_path_to_log(report: dict) -> list[str]:
+        result = [f'startup time : {report["total_seconds"]}s', 'critical path :']
+        for step in report['critical_path']:
+            result.append(f'    -> {step["service"]} : running {step["time_to_running"]}s, '
+                          f'ready {step["time_to_ready"]}s')
+        if report['slack']:
+            result.append('slack :')
+            for service_name, slack in report['slack'].items():
+                result.append(f'    {service_name} : {slack}s')
+        if report['waited_on_sibling']:
+            result.append('waited on slower sibling :')
+            for wait in report['waited_on_sibling']:
+                result.append(f'    {wait["service"]} : {wait["seconds"]}s for {wait["waited_for"]} '
+                              f'(needed by {wait["dependent"]})')
+        return result
+
+    def get_dependency_cycle(self) -> list[str] | None:
+        visited = set()
+        path = []
+
+        def find_cycle(service_name: str) -> list[str] | None:
+            if service_name in path:
+                return path[path.index(service_name):] + [service_name]
+            if service_name in visited:
+                return None
+            visited.add(service_name)
+            path.append(service_name)
+            for dependency_name in self.get_dependencies(service_name):
+                cycle = find_cycle(dependency_name)
+                if cycle:
+                    return cycle
+            path.pop()
+            return None
+
+        for service_name in self.compose_file['services']:
+            cycle = find_cycle(service_name)
+            if cycle:
+                return cycle
+        return None
+
+    def check_dependency_cycles(self) -> None:
+        cycle = self.get_dependency_cycle()
+        if cycle:
+            # a usage error in the compose file, the cli reports it without a traceback
+            raise click.ClickException(f'dependency cycle : {" -> ".join(cycle)}')
+
+    def get_startup_waves(self) -> list[list[str]]:
+        self.check_dependency_cycles()
+        levels = {}
 
-    def run_exec_container(self) -> int:
-        return self.container_service.run_exec_container()
+        def get_level(service_name: str) -> int:
+            if service_name not in levels:
+                levels[service_name] = max((get_level(dependency_name) + 1
+                                            for dependency_name in self.get_dependencies(service_name)), default=0)
+            return levels[service_name]
 
-    def status(self, presentation: Callable[[list[str]], None]):
-        presentation(
-            Services.transform_status_to_log(
-                self.get_services_status()))
+        waves = []
+        for service_name in self.compose_file['services']:
+            if self.is_exec_service(service_name):
+                continue
+            level = get_level(service_name)
+            waves.extend([] for _ in range(level + 1 - len(waves)))
+            waves[level].append(service_name)
+        return waves
+
+    def get_plan(self) -> dict:
+        waves = self.get_startup_waves()
+        return {
+            'waves': waves,
+            'depth': len(waves),
+            'max_parallelism': max((len(wave) for wave in waves), default=0),
+            'one_shot_services': self.get_one_shot_services(),
+            'exec_services': [service_name for service_name in self.compose_file['services']
+                              if self.is_exec_service(service_name)]
+        }
+
+    @staticmethod
+    def transform_plan_to_log(plan: dict) -> list[str]:
+        result = [f'startup waves : {plan["depth"]}, max parallelism : {plan["max_parallelism"]}']
+        for level, wave in enumerate(plan['waves']):
+            result.append(f'    {level} ({len(wave)}) : {", ".join(wave)}')
+        result.append(f'one-shot services : {", ".join(plan["one_shot_services"])}')
+        result.append(f'exec services : {", ".join(plan["exec_services"])}')
+        return result
+
+    def to_dot(self) -> str:
+        result = ['digraph services {', '    rankdir=LR;']
+        for service_name in self.compose_file['services']:
+            if self.is_exec_service(service_name):
+                shape = 'doublecircle'
+            elif self.is_one_shot_service(service_name):
+                shape = 'box'
+            else:
+                shape = 'ellipse'
+            result.append(f'    "{service_name}" [shape={shape}];')
+        for service_name in self.compose_file['services']:
+            for dependency_name, condition in self.get_dependency_conditions(service_name).items():
+                label = f' [label="{condition}"]' if condition else ''
+                result.append(f'    "{dependency_name}" -> "{service_name}"{label};')
+        result.append('}')
+        return '\n'.join(result) + '\n'
+
+    def run_exec_container(self, collect: list[Tuple[str, str]] = None) -> int:
+        return self.container_service.run_exec_container(collect)
+
+    def status(self, presentation: Callable[[dict], None]):
+        presentation(self.get_services_status())
 
     def restart(self, service_name) -> str:
         return self.container_service.restart(service_name)
 
-    def run_one_shot_service(self, one_shot_service_name) -> int:
-        return self.container_service.run_one_shot_service(one_shot_service_name)
+    def get_dependencies_closure(self, service_names: list[str]) -> list[str]:
+        result = list(service_names)
+        pending = list(service_names)
+        while pending:
+            for dependency_name in self.get_dependencies(pending.pop(0)):
+                if dependency_name not in result:
+                    result.append(dependency_name)
+                    pending.append(dependency_name)
+        return result
+
+    def get_dependents_closure(self, service_name: str) -> list[str]:
+        result = [service_name]
+        pending = [service_name]
+        while pending:
+            dependent_name = pending.pop(0)
+            for candidate_name in self.compose_file['services']:
+                if candidate_name not in result and not self.is_exec_service(candidate_name) and \
+                        dependent_name in self.get_dependencies(candidate_name):
+                    result.append(candidate_name)
+                    pending.append(candidate_name)
+        return result
+
+    def restart_cascade(self, service_name: str, verification_step_millis: int, presentation_step_millis: int,
+                        presentation: Callable[[dict], None]) -> str | None:
+        if service_name not in self.compose_file['services']:
+            return f'serice {service_name} not found!'
+        self.recreate([service_name], verification_step_millis, presentation_step_millis, presentation)
+        return None
+
+    def get_changed_services(self, compose_file: dict) -> list[str]:
+        return [service_name for service_name, service in compose_file['services'].items()
+                if self.compose_file['services'].get(service_name) != service]
+
+    def apply_compose_file(self, compose_file: dict, changed_variables: list[str], verification_step_millis: int,
+                           presentation_step_millis: int,
+                           presentation: Callable[[dict], None]) -> Tuple[list[str], list[str]]:
+        changed = self.get_changed_services(compose_file)
+        removed = [service_name for service_name in self.compose_file['services']
+                   if service_name not in compose_file['services']]
+        # dependents of a removed service are only known from the definition that still has it
+        for service_name in removed:
+            changed.extend(dependent_name for dependent_name in self.get_dependents_closure(service_name)
+                           if dependent_name not in changed and dependent_name in compose_file['services'])
+            self.container_service.clear(service_name)
+        self.reload(compose_file)
+        changed.extend(service_name for service_name in self.get_services_using_variables(changed_variables)
+                       if service_name not in changed)
+        changed = [service_name for service_name in changed if not self.is_exec_service(service_name)]
+        # recreate takes the dependents closure of every changed service
+        return self.recreate(changed, verification_step_millis, presentation_step_millis, presentation), removed
+
+    def get_services_using_variables(self, variable_names: list[str]) -> list[str]:
+        if not variable_names:
+            return []
+        pattern = re.compile(r'\$\{?(' + '|'.join(re.escape(name) for name in variable_names) + r')\b')
+        return [service_name for service_name, service in self.compose_file['services'].items()
+                if pattern.search(yaml.safe_dump(service))]
+
+    def reload(self, compose_file: dict) -> None:
+        self.compose_file = compose_file
+        self._image_digests = {}
+        self._start_priorities = None
+        self._expected_timings = {}
+        # the container service adds labels, tmpfs mounts and built images, the next reload compares with the original
+        self.container_service.reload_compose_file(copy.deepcopy(compose_file))
+
+    def recreate(self, service_names: list[str], verification_step_millis: int, presentation_step_millis: int,
+                 presentation: Callable[[dict], None]) -> list[str]:
+        closure = []
+        for service_name in service_names:
+            closure.extend(dependent_name for dependent_name in self.get_dependents_closure(service_name)
+                           if dependent_name not in closure)
+        if not closure:
+            return closure
+        with ThreadPoolExecutor(max_workers=len(closure)) as executor:
+            list(executor.map(self.container_service.clear, closure))
+        self.scheduled_services = closure
+        try:
+            self.start(verification_step_millis, presentation_step_millis, presentation)
+        finally:
+            self.scheduled_services = None
+        return closure
+
+    def run_one_shot_service(self, one_shot_service_name, collect: list[Tuple[str, str]] = None,
+                             buffer_logs: bool = False) -> int:
+        return self.container_service.run_one_shot_service(one_shot_service_name, collect, buffer_logs)
+
+    # pylint: disable=broad-exception-raised
+    def get_one_shot_waves(self, one_shot_service_names: list[str]) -> list[list[str]]:
+        waves = []
+        pending = list(one_shot_service_names)
+        while pending:
+            # one-shots that depend on other requested one-shots wait for them, the others run at the same time
+            wave = [service_name for service_name in pending
+                    if not any(dependency_name in pending for dependency_name in self.get_dependencies(service_name))]
+            if not wave:
+                raise Exception(f'dependency cycle between one-shot services {", ".join(pending)}')
+            waves.append(wave)
+            pending = [service_name for service_name in pending if service_name not in wave]
+        return waves
+
+    def start_one_shot_dependencies(self, one_shot_service_names: list[str],
+                                    presentation: Callable[[dict], None] = None) -> list[str]:
+        # one-shots run with --no-deps, parallel ones would otherwise race to create a shared dependency
+        dependencies = [service_name for service_name in self.get_dependencies_closure(one_shot_service_names)
+                        if service_name not in one_shot_service_names and not self.is_exec_service(service_name)]
+        if not dependencies:
+            return dependencies
+        self.apply_one_shot_cache()
+        self.scheduled_services = dependencies
+        try:
+            completed = self.start(100, 1000, presentation or (lambda _: None))
+        finally:
+            self.scheduled_services = None
+        self.store_one_shot_cache()
+        failed = [service_name for service_name in dependencies
+                  if service_name in self.given_up_services or
+                  self.last_services_status[service_name]['status'] not in [ServiceStatus.READY,
+                                                                           ServiceStatus.EXECUTED_SUCCESSFULLY]]
+        if not completed or failed:
+            raise Exception(f'dependencies of the one-shot services not started: {", ".join(failed)}')
+        return dependencies
+
+    def run_one_shot_services(self, one_shot_service_names: list[str], collect: list[Tuple[str, str]] = None,
+                              presentation: Callable[[dict], None] = None) -> dict:
+        waves = self.get_one_shot_waves(one_shot_service_names)
+        self.start_one_shot_dependencies(one_shot_service_names, presentation)
+        result = {}
+        for wave in waves:
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                # logs of one-shots running at the same time are printed whole, one after the other
+                exit_codes = executor.map(
+                    lambda service_name, buffer_logs=len(wave) > 1: self.run_one_shot_service(service_name, collect,
+                                                                                              buffer_logs), wave)
+                result.update(zip(wave, exit_codes))
+            if any(result[service_name] != 0 for service_name in wave):
+                break
+        return result
+
+    def apply_one_shot_cache(self) -> list[str]:
+        cached = [service_name for service_name in self.get_one_shot_services()
+                  if service_name not in self.skipped_services and
+                  self.container_service.is_one_shot_cached(service_name)]
+        self.skipped_services.update(cached)
+        return cached
+
+    def store_one_shot_cache(self) -> None:
+        for service_name in self.get_one_shot_services():
+            if service_name not in self.skipped_services and \
+                    self._get_service_status(service_name) == ServiceStatus.EXECUTED_SUCCESSFULLY:
+                self.container_service.cache_one_shot(service_name)
+
+    def snapshot(self, snapshot_dir: Path, as_image: bool) -> str:
+        for service_name in self.get_one_shot_services():
+            if self._get_service_status(service_name) != ServiceStatus.EXECUTED_SUCCESSFULLY:
+                raise Exception(f'one-shot service {service_name} has not executed successfully, '
+                                f'stack is not seeded.')
+        return self.container_service.snapshot(snapshot_dir, as_image)
+
+    def restore_snapshot(self, snapshot_dir: Path) -> bool:
+        if not self.container_service.restore_snapshot(snapshot_dir):
+            return False
+        self.skipped_services.update(self.get_one_shot_services())
+        return True
 
     def clear(self, services, unless):
 
@@ -243,15 +913,102 @@ class Services:
         return self.container_service.clear_all()
 
 
+class ServiceIpRegistry:
+
+    def __init__(self, env_file_path: str = None, hosts_file_path: str = None):
+        self.env_file_path = env_file_path
+        self.hosts_file_path = hosts_file_path
+        self.loaded = False
+        self._ips = {}
+        self._replica_ips = {}
+        self._args = None
+
+    def register(self, service_name: str, ip_address: str) -> None:
+        if self._ips.get(service_name) == ip_address:
+            return
+        self._ips[service_name] = ip_address
+        self._changed()
+
+    def register_replicas(self, service_name: str, ip_addresses: list[str]) -> None:
+        if self._replica_ips.get(service_name) == ip_addresses:
+            return
+        self._replica_ips[service_name] = ip_addresses
+        self._changed()
+
+    def remove(self, service_name: str) -> None:
+        if self._ips.pop(service_name, None) is not None or self._replica_ips.pop(service_name, None) is not None:
+            self._changed()
+
+    def get_ip(self, service_name: str) -> str | None:
+        if service_name in self._replica_ips:
+            return next(iter(self._replica_ips[service_name]), None)
+        return self._ips.get(service_name)
+
+    def get_environment(self) -> dict:
+        result = {service_name.upper() + '_IP': ip_address for service_name, ip_address in self._ips.items()}
+        for service_name, ip_addresses in self._replica_ips.items():
+            if ip_addresses:
+                result[service_name.upper() + '_IP'] = ip_addresses[0]
+            result[service_name.upper() + '_IPS'] = ','.join(ip_addresses)
+        return result
+
+    def get_args(self) -> str:
+        if self._args is None:
+            self._args = ''.join(f'{env_key}={env_value} ' for env_key, env_value in self.get_environment().items())
+        return self._args
+
+    def _changed(self) -> None:
+        self._args = None
+        # files are rewritten in place so bind mounts of them keep seeing the current content
+        if self.env_file_path:
+            with open(self.env_file_path, 'w', encoding='utf-8') as env_file:
+                env_file.writelines(f'{env_key}={env_value}\n'
+                                    for env_key, env_value in self.get_environment().items())
+        if self.hosts_file_path:
+            with open(self.hosts_file_path, 'w', encoding='utf-8') as hosts_file:
+                hosts_file.writelines(f'{ip_address} {service_name}\n'
+                                      for service_name, ip_address in self._ips.items())
+                hosts_file.writelines(f'{ip_address} {service_name}\n'
+                                      for service_name, ip_addresses in self._replica_ips.items()
+                                      for ip_address in ip_addresses)
+
+
+# pylint: disable=too-many-instance-attributes
 class ContainerService(BaseContainerService):
 
     def __init__(self, compose_file_path: Path, **kwargs):
-        self.docker_client = docker.from_env()
         self.compose_file_path = compose_file_path
-        self.compose_file = yaml.safe_load(compose_file_path.read_text())
+        # the definition as written, the launch one gets labels, tmpfs mounts and built images
+        self.source_compose_file = yaml.safe_load(compose_file_path.read_text())
+        self.compose_file = copy.deepcopy(self.source_compose_file)
+        # a client passed in is shared with other stacks, so it is left open for its owner to close
+        self._owns_docker_client = kwargs.get('docker_client', None) is None
+        self.docker_client = kwargs.get('docker_client', None) or \
+            create_docker_client(len(self.compose_file['services']))
         self.env_file = kwargs.get('env_file', None)
         self.environment = kwargs.get('environment', {})
         self.compose_file_path_host = kwargs.get('compose_file_path_host', compose_file_path)
+        self.tmpfs_data = kwargs.get('tmpfs_data', False)
+        self.tmpfs_size = kwargs.get('tmpfs_size', '256m')
+        self.max_parallel_builds = kwargs.get('max_parallel_builds', 4)
+        self.print_function = kwargs.get('print_function', print)
+        self._print_lock = threading.Lock()
+        self.run_id = kwargs.get('run_id', None) or \
+            get_default_run_id(str(Path(self.compose_file_path_host).absolute()), self._get_project_name())
+        self.run_labels = get_run_labels(self.run_id)
+        self.built_images = {}
+        self._launch_compose_file_name = None
+        self._launch_compose_file_lock = threading.Lock()
+        self.tmpfs_volumes = self._apply_ephemeral_volumes(self.compose_file)
+        self.liveness_recheck_seconds = kwargs.get('liveness_recheck_seconds', None)
+        self.stack_suffix = kwargs.get('stack_suffix', '')
+        self._ready_containers = {}
+        self._deferred_readiness_checks = {}
+        self.one_shot_cache = OneShotCache(kwargs['one_shot_cache']) if kwargs.get('one_shot_cache') else None
+        self.log_capture = LogCapture(kwargs['capture_logs']) if kwargs.get('capture_logs') else None
+        self.sample_resources = kwargs.get('sample_resources', False)
+        self.resource_stats = None
+        self.ip_registry = ServiceIpRegistry(kwargs.get('ips_env_file', None), kwargs.get('ips_hosts_file', None))
         if 'readiness_check' in kwargs:
             self.readiness_check = kwargs.get('readiness_check')
         else:
@@ -259,7 +1016,8 @@ class ContainerService(BaseContainerService):
                                                           HealthReadinessCheck(self.docker_client, self.compose_file)])
 
     def __del__(self):
-        self.docker_client.close()
+        if self._owns_docker_client:
+            self.docker_client.close()
 
     # pylint: disable=broad-exception-raised
     def _get_container_ip(self, container):
@@ -276,74 +1034,202 @@ class ContainerService(BaseContainerService):
     # pylint: disable=too-many-return-statements
     def get_service_status(self, service_name: str) -> ServiceStatus:
 
+        if self.get_replicas(service_name) > 1:
+            return self._get_replicated_service_status(service_name)
         try:
-            container = self.docker_client.containers.get(service_name)
+            container = self.docker_client.containers.get(self.get_container_name(service_name))
+            if self.log_capture and container.status in ['running', 'exited']:
+                self.log_capture.follow(service_name, container)
             if container.status == 'exited':
+                self._ready_containers.pop(service_name, None)
+                self.ip_registry.remove(service_name)
                 if 'x-one-shot' in self.compose_file['services'][service_name]:
                     if container.attrs['State']['ExitCode'] == 0:
                         return ServiceStatus.EXECUTED_SUCCESSFULLY
                     return ServiceStatus.EXECUTED_ERROR
                 return ServiceStatus.NOT_STARTED
             if container.status in ['running']:
+                if self._is_ready_memoized(service_name, container):
+                    return ServiceStatus.READY
+                # registered before a deferred probe returns, dependents on service_started need the ip already
                 self.attach_network(container)
-                if self.readiness_check.is_ready(service_name, self._get_container_ip(container)):
+                self.ip_registry.register(service_name, self._get_container_ip(container))
+                if time.time() < self._deferred_readiness_checks.get(service_name, 0):
+                    return ServiceStatus.NOT_READY
+                if self.readiness_check.is_ready(service_name, self.ip_registry.get_ip(service_name), container.name):
+                    self._ready_containers[service_name] = (self._get_readiness_key(container), time.time())
                     return ServiceStatus.READY
+                self._ready_containers.pop(service_name, None)
                 return ServiceStatus.NOT_READY
+            self._ready_containers.pop(service_name, None)
             return ServiceStatus.INVALID
         except NotFound:
+            self._ready_containers.pop(service_name, None)
+            self.ip_registry.remove(service_name)
             return ServiceStatus.NOT_STARTED
 
+    def get_container_name(self, service_name: str) -> str:
+        return f'{service_name}{self.stack_suffix}'
+
+    def _get_service_name(self, container_name: str) -> str | None:
+        if not container_name.endswith(self.stack_suffix):
+            return None
+        service_name = container_name[:len(container_name) - len(self.stack_suffix)]
+        return service_name if service_name in self.compose_file['services'] else None
+
+    def _get_creator_name(self, service_name: str) -> str:
+        return f'{self.get_container_name(service_name)}_creator'
+
+    def get_replicas(self, service_name: str) -> int:
+        service = self.compose_file['services'][service_name]
+        return int(service.get('scale', service.get('deploy', {}).get('replicas', 1)))
+
+    def get_ready_replicas(self, service_name: str) -> int:
+        return int(self.compose_file['services'][service_name].get('x-ready-replicas',
+                                                                   self.get_replicas(service_name)))
+
+    def _get_replica_containers(self, service_name: str) -> list:
+        # replicas get generated names, so they are found by the labels compose puts on them
+        containers = self.docker_client.containers.list(all=True, filters={'label': [
+            f'com.docker.compose.project={self._get_project_name()}',
+            f'com.docker.compose.service={service_name}']})
+        return self._sort_replicas(containers)
+
+    @staticmethod
+    def _sort_replicas(containers: list) -> list:
+        # the listing order is arbitrary, the first replica's ip is the one the service ip stands for
+        return sorted(containers, key=lambda container: (
+            int(container.labels.get('com.docker.compose.container-number', 0)), container.name))
+
+    def _get_replicated_service_status(self, service_name: str) -> ServiceStatus:
+        containers = self._get_replica_containers(service_name)
+        running = [container for container in containers if container.status == 'running']
+        if self.log_capture:
+            for container in containers:
+                self.log_capture.follow(service_name, container, container.name)
+        if not running:
+            self.ip_registry.remove(service_name)
+            if all(container.status == 'exited' for container in containers):
+                return ServiceStatus.NOT_STARTED
+            return ServiceStatus.INVALID
+        for container in running:
+            self.attach_network(container)
+        self.ip_registry.register_replicas(service_name, [self._get_container_ip(container) for container in running])
+        if time.time() < self._deferred_readiness_checks.get(service_name, 0):
+            return ServiceStatus.NOT_READY
+        with ThreadPoolExecutor(max_workers=len(running)) as executor:
+            ready = list(executor.map(lambda container: self._is_replica_ready(service_name, container), running))
+        if sum(ready) >= self.get_ready_replicas(service_name):
+            return ServiceStatus.READY
+        return ServiceStatus.NOT_READY
+
+    def _is_replica_ready(self, service_name: str, container) -> bool:
+        if self._is_ready_memoized(container.name, container):
+            return True
+        if self.readiness_check.is_ready(service_name, self._get_container_ip(container), container.name):
+            self._ready_containers[container.name] = (self._get_readiness_key(container), time.time())
+            return True
+        self._ready_containers.pop(container.name, None)
+        return False
+
+    @staticmethod
+    def _get_readiness_key(container) -> tuple:
+        # a restarted container keeps its id but gets a new start time
+        return container.id, container.attrs['State']['StartedAt']
+
+    def _is_ready_memoized(self, service_name: str, container) -> bool:
+        if service_name not in self._ready_containers:
+            return False
+        readiness_key, checked_at = self._ready_containers[service_name]
+        if readiness_key != self._get_readiness_key(container):
+            return False
+        return self.liveness_recheck_seconds is None or time.time() - checked_at < self.liveness_recheck_seconds
+
+    def get_not_ready_cause(self, service_name: str) -> str | None:
+        return self.readiness_check.get_not_ready_cause(service_name)
+
+    def defer_readiness_check(self, service_name: str, until: float) -> None:
+        self._deferred_readiness_checks[service_name] = until
+
+    def get_image_digest(self, service_name: str) -> str | None:
+        try:
+            return self.docker_client.containers.get(self.get_container_name(service_name)).attrs['Image']
+        except NotFound:
+            pass
+        if 'image' not in self.compose_file['services'][service_name]:
+            return None
+        try:
+            return self.docker_client.images.get(self.compose_file['services'][service_name]['image']).id
+        except NotFound:
+            return None
+
     def get_services_ips(self):
-        result = {}
-        for service_name in self.compose_file['services']:
-            try:
-                container = self.docker_client.containers.get(f'{service_name}')
-                result[service_name.upper() + '_IP'] = self._get_container_ip(container)
-            except NotFound:
-                pass
-        return result
+        if not self.ip_registry.loaded:
+            replica_ips = {}
+            for container in self._sort_replicas(self.docker_client.containers.list()):
+                service_name = container.labels.get('com.docker.compose.service')
+                # other projects and pool stacks run services with the same names
+                if service_name in self.compose_file['services'] and self.get_replicas(service_name) > 1 and \
+                        container.labels.get('com.docker.compose.project') == self._get_project_name():
+                    replica_ips.setdefault(service_name, []).append(self._get_container_ip(container))
+                elif self._get_service_name(container.name):
+                    self.ip_registry.register(self._get_service_name(container.name), self._get_container_ip(container))
+            for service_name, ip_addresses in replica_ips.items():
+                self.ip_registry.register_replicas(service_name, ip_addresses)
+            self.ip_registry.loaded = True
+        return self.ip_registry.get_environment()
+
+    def _get_launch_environment(self) -> dict:
+        env = {**dict(self.environment), **dict(self.get_services_ips())}
+        env['ARGS'] = self.ip_registry.get_args()
+        if 'EXTRA_ARGS' in env:
+            env['ARGS'] += ' ' + env['EXTRA_ARGS']
+        return env
+
+    def _get_compose_volumes(self) -> Tuple[dict, str]:
+        env_file_cli = ''
+        volumes = {
+            str(self._get_launch_compose_file_path_host().absolute()): {
+                'bind': '/opt/docker-compose.yml',
+                'mode': 'ro'
+            },
+            '/var/run/docker.sock': {
+                'bind': '/var/run/docker.sock'
+            }
+        }
+        if self.env_file:
+            volumes[self.env_file] = {
+                'bind': '/opt/env',
+                'mode': 'ro'
+            }
+            env_file_cli = '--env-file=/opt/env'
+        return volumes, env_file_cli
 
     def start_service(self, service_name: str) -> None:
 
         try:
-            self.docker_client.containers.get(f'{service_name}_creator')
+            self.docker_client.containers.get(self._get_creator_name(service_name))
             return
         except NotFound:
-            env = {**dict(self.environment), **dict(self.get_services_ips())}
-            env['ARGS'] = self.environment_to_docker_env(self.get_services_ips())
-            if 'EXTRA_ARGS' in env:
-                env['ARGS'] += env['ARGS'] + ' ' + env['EXTRA_ARGS']
-            env_file_cli = ''
-            volumes = {
-                str(self.compose_file_path_host.absolute()): {
-                    'bind': '/opt/docker-compose.yml',
-                    'mode': 'ro'
-                },
-                '/var/run/docker.sock': {
-                    'bind': '/var/run/docker.sock'
-                }
-            }
-            if self.env_file:
-                volumes[self.env_file] = {
-                    'bind': '/opt/env',
-                    'mode': 'ro'
-                }
-                env_file_cli = '--env-file=/opt/env'
+            env = self._get_launch_environment()
+            volumes, env_file_cli = self._get_compose_volumes()
             self.docker_client.containers.run(
                 'docker:23.0.1-cli-alpine3.17',
-                f'compose -f /opt/docker-compose.yml {env_file_cli} up {service_name}',
-                name=f'{service_name}_creator',
+                f'compose -f /opt/docker-compose.yml {env_file_cli} up --no-deps {service_name}',
+                name=self._get_creator_name(service_name),
                 volumes=volumes,
-                # remove=True,
-                environment=self.environment,
+                # kept after exiting, an exited creator is how a failed start is detected; reap removes it
+                environment=env,
+                labels=self.run_labels,
                 detach=True
             )
 
     def restart(self, service_name: str) -> (None | str):
         try:
-            container = self.docker_client.containers.get(service_name)
+            container = self.docker_client.containers.get(self.get_container_name(service_name))
             container.stop()
             container.remove(force=True)
+            self.ip_registry.remove(service_name)
             self.start_service(service_name)
             return None
         except NotFound:
@@ -362,107 +1248,279 @@ class ContainerService(BaseContainerService):
 
         return result
 
-    def run_exec_container(self) -> int:
+    def run_exec_container(self, collect: list[Tuple[str, str]] = None) -> int:
         try:
-            container = self.docker_client.containers.get(self._get_exec_container_name())
+            container = self.docker_client.containers.get(self.get_container_name(self._get_exec_container_name()))
             container.stop()
             container.remove()
         except NotFound:
             pass
-        env = {**dict(self.environment), **dict(self.get_services_ips())}
-        env['ARGS'] = self.environment_to_docker_env(self.get_services_ips())
-        if 'EXTRA_ARGS' in env:
-            env['ARGS'] += env['ARGS'] + ' ' + env['EXTRA_ARGS']
-        env_file_cli = ''
-        volumes = {
-            str(self.compose_file_path_host.absolute()): {
-                'bind': '/opt/docker-compose.yml',
-                'mode': 'ro'
-            },
-            '/var/run/docker.sock': {
-                'bind': '/var/run/docker.sock'
-            }
-        }
-        if self.env_file:
-            volumes[self.env_file] = {
-                'bind': '/opt/env',
-                'mode': 'ro'
-            }
-            env_file_cli = '--env-file=/opt/env'
+        env = self._get_launch_environment()
+        volumes, env_file_cli = self._get_compose_volumes()
         self.docker_client.containers.run(
             'docker:23.0.1-cli-alpine3.17',
-            f'compose -f /opt/docker-compose.yml {env_file_cli} up -d {self._get_exec_container_name()}',
+            f'compose -f /opt/docker-compose.yml {env_file_cli} up -d --no-deps {self._get_exec_container_name()}',
             volumes=volumes,
-            environment=env
+            environment=env,
+            labels=self.run_labels
         )
-        container = self.docker_client.containers.get(self._get_exec_container_name())
-        logs = container.logs(stream=True)
-        for log in logs:
-            print(log.decode('utf-8'), end='')
+        container = self.docker_client.containers.get(self.get_container_name(self._get_exec_container_name()))
+        sampler = self._sample_services() if self.sample_resources else None
+        self._print_logs(self._get_exec_container_name(), container)
+        if sampler:
+            self.resource_stats = sampler.stop()
         container.reload()
+        self.collect(container, collect)
         return container.attrs['State']['ExitCode']
 
+    def _print_logs(self, service_name: str, container) -> None:
+        logs = container.logs(stream=True)
+        for log in logs:
+            if self.log_capture:
+                self.log_capture.write(service_name, log)
+            else:
+                print(log.decode('utf-8'), end='')
+
+    def _sample_services(self) -> ResourceSampler:
+        sampler = ResourceSampler()
+        for container in self.docker_client.containers.list():
+            service_name = self._get_service_name(container.name)
+            if service_name and 'x-exec-container' not in self.compose_file['services'][service_name]:
+                sampler.sample(service_name, container)
+        return sampler
+
+    def get_resource_stats(self) -> dict | None:
+        return self.resource_stats
+
+    def _get_generated_compose_file_name(self, content: str) -> str:
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+        return os.path.join('.dc-test-exec', f'{self.compose_file_path.stem}.{digest}.generated.yml')
+
+    def _get_launch_compose_file_path_host(self) -> Path:
+        # written only by the commands that launch containers, and only once per definition
+        with self._launch_compose_file_lock:
+            if self._launch_compose_file_name is None:
+                self._use_built_images()
+                self._launch_compose_file_name = self._write_generated_compose_file(self.compose_file)
+            return Path(self.compose_file_path_host).parent / self._launch_compose_file_name
+
+    def _write_generated_compose_file(self, compose_file: dict) -> str:
+        # creators read the compose file from the host, so the rewritten one goes to a file next to it. the name
+        # follows the content, so a concurrent command with another definition never rewrites a file in use
+        content = yaml.safe_dump(compose_file, sort_keys=False)
+        generated_file_name = self._get_generated_compose_file_name(content)
+        generated_path = self.compose_file_path.parent / generated_file_name
+        if generated_path.exists():
+            return generated_file_name
+        generated_path.parent.mkdir(parents=True, exist_ok=True)
+        gitignore_path = generated_path.parent / '.gitignore'
+        if not gitignore_path.exists():
+            gitignore_path.write_text('*\n', encoding='utf-8')
+        temporary_path = generated_path.with_name(f'{generated_path.name}.{os.getpid()}.tmp')
+        temporary_path.write_text(content, encoding='utf-8')
+        os.replace(temporary_path, generated_path)
+        return generated_file_name
+
+    def _apply_ephemeral_volumes(self, compose_file: dict) -> dict:
+        tmpfs_volumes = apply_ephemeral_volumes(compose_file, self.tmpfs_data, self.tmpfs_size)
+        # every container and network compose creates carries the run labels, so reap can find them
+        apply_run_labels(compose_file, self.run_labels)
+        self._launch_compose_file_name = None
+        return tmpfs_volumes
+
+    # pylint: disable=broad-exception-raised
+    def _build_image(self, service_name: str, build_spec: dict, tag: str) -> None:
+        context_host = Path(self.compose_file_path_host).parent / build_spec['context']
+        try:
+            self.docker_client.containers.run(
+                'docker:23.0.1-cli-alpine3.17',
+                get_build_command(tag, build_spec),
+                volumes={
+                    str(context_host.absolute()): {'bind': '/build', 'mode': 'ro'},
+                    '/var/run/docker.sock': {'bind': '/var/run/docker.sock'}
+                },
+                # buildkit keeps its cache in the daemon, so every build shares it
+                environment={'DOCKER_BUILDKIT': '1'},
+                labels=self.run_labels,
+                remove=True
+            )
+        except ContainerError as error:
+            raise Exception(f'build of service {service_name} failed: '
+                            f'{error.stderr.decode("utf-8", errors="replace") if error.stderr else error}') from error
+
+    def _get_builds(self) -> dict:
+        builds = {}
+        for service_name, service in self.compose_file['services'].items():
+            build_spec = get_build_spec(service)
+            if build_spec:
+                tag = get_build_tag(service_name, build_spec, self.compose_file_path.parent / build_spec['context'])
+                builds[service_name] = (build_spec, tag)
+        return builds
+
+    def _use_built_image(self, service_name: str, tag: str) -> None:
+        self.compose_file['services'][service_name].pop('build')
+        self.compose_file['services'][service_name]['image'] = tag
+        self.built_images[service_name] = tag
+
+    def _use_built_images(self) -> None:
+        # commands other than start find the images it built by the hash of their build context
+        for service_name, (_, tag) in self._get_builds().items():
+            try:
+                self.docker_client.images.get(tag)
+            except NotFound:
+                continue
+            self._use_built_image(service_name, tag)
+
+    def build_images(self) -> dict:
+        builds = self._get_builds()
+        if not builds:
+            return {}
+        result = {}
+        pending = {}
+        for service_name, (build_spec, tag) in builds.items():
+            try:
+                self.docker_client.images.get(tag)
+                result[service_name] = {'image': tag, 'cached': True}
+            except NotFound:
+                pending[service_name] = (build_spec, tag)
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel_builds, len(pending))) as executor:
+                list(executor.map(lambda item: self._build_image(item[0], *item[1]), pending.items()))
+            result.update({service_name: {'image': tag, 'cached': False}
+                           for service_name, (_, tag) in pending.items()})
+        for service_name, (_, tag) in builds.items():
+            self._use_built_image(service_name, tag)
+        self._launch_compose_file_name = None
+        return result
+
+    def get_tmpfs_usage(self) -> dict | None:
+        result = {}
+        for service_name, targets in self.tmpfs_volumes.items():
+            try:
+                container = self.docker_client.containers.get(self.get_container_name(service_name))
+            except NotFound:
+                continue
+            if container.status != 'running':
+                continue
+            for target in targets:
+                exit_code, output = container.exec_run(['df', '-k', target])
+                usage = parse_df_output(output.decode('utf-8', errors='replace')) if exit_code == 0 else None
+                if usage:
+                    result.setdefault(service_name, {})[target] = usage
+        return result
+
+    def reload_compose_file(self, compose_file: dict) -> None:
+        self.source_compose_file = copy.deepcopy(compose_file)
+        self.tmpfs_volumes = self._apply_ephemeral_volumes(compose_file)
+        # updated in place, the readiness checks hold a reference to the same dict
+        self.compose_file.clear()
+        self.compose_file.update(compose_file)
+        if self.built_images:
+            self.built_images = {}
+            self.build_images()
+
+    def get_captured_logs(self, service_name: str, lines: int = None) -> list[str]:
+        return self.log_capture.tail(service_name, lines) if self.log_capture else []
+
+    def collect(self, container, collect: list[Tuple[str, str]] = None) -> None:
+        for container_path, host_dir in collect or []:
+            try:
+                bits, _ = container.get_archive(container_path)
+            except NotFound:
+                # a failed run often did not write its reports, the exit code still has to reach the caller
+                self.print_function(f'nothing collected from {container.name}:{container_path}, path not found')
+                continue
+            extract_archive(bits, host_dir)
+
     def _stop_service(self, service_name: str) -> None:
         try:
-            container = self.docker_client.containers.get(service_name)
+            container = self.docker_client.containers.get(self.get_container_name(service_name))
             container.stop()
         except NotFound:
             pass
 
-    def run_one_shot_service(self, one_shot_service_name) -> int:
+    def run_one_shot_service(self, one_shot_service_name, collect: list[Tuple[str, str]] = None,
+                             buffer_logs: bool = False) -> int:
         try:
-            container = self.docker_client.containers.get(one_shot_service_name)
+            container = self.docker_client.containers.get(self.get_container_name(one_shot_service_name))
             if container.status == 'exited':
+                self.collect(container, collect)
                 return container.attrs['State']['ExitCode']
             raise Exception(f'container for service {one_shot_service_name} is in invalid state '
                             f'${container.attrs["State"]["ExitCode"]}')
         except NotFound:
             pass
-        env = {**dict(self.environment), **dict(self.get_services_ips())}
-        env['ARGS'] = self.environment_to_docker_env(self.get_services_ips())
-        if 'EXTRA_ARGS' in env:
-            env['ARGS'] += env['ARGS'] + ' ' + env['EXTRA_ARGS']
-        env_file_cli = ''
-        volumes = {
-            str(self.compose_file_path_host.absolute()): {
-                'bind': '/opt/docker-compose.yml',
-                'mode': 'ro'
-            },
-            '/var/run/docker.sock': {
-                'bind': '/var/run/docker.sock'
-            }
-        }
-        if self.env_file:
-            volumes[self.env_file] = {
-                'bind': '/opt/env',
-                'mode': 'ro'
-            }
-            env_file_cli = '--env-file=/opt/env'
+        if self.is_one_shot_cached(one_shot_service_name):
+            self.print_function(f'one-shot service {one_shot_service_name} inputs unchanged, skipping')
+            return 0
+        env = self._get_launch_environment()
+        volumes, env_file_cli = self._get_compose_volumes()
         self.docker_client.containers.run(
             'docker:23.0.1-cli-alpine3.17',
-            f'compose -f /opt/docker-compose.yml {env_file_cli} up -d {self._get_exec_container_name()}',
+            f'compose -f /opt/docker-compose.yml {env_file_cli} up -d --no-deps {one_shot_service_name}',
             volumes=volumes,
-            environment=env
+            environment=env,
+            labels=self.run_labels
         )
-        print('   ************** logs ***************   ')
-        logs = container.logs(stream=True)
-        for log in logs:
-            print(log)
-        print('   *****************************   ')
-        return self.docker_client.containers.get(one_shot_service_name).attrs['State']['ExitCode']
+        container = self.docker_client.containers.get(self.get_container_name(one_shot_service_name))
+        if self.log_capture:
+            self._print_logs(one_shot_service_name, container)
+        elif buffer_logs:
+            logs = b''.join(container.logs(stream=True)).decode('utf-8', errors='replace')
+            with self._print_lock:
+                self.print_function(f'   ************** {one_shot_service_name} logs ***************   ')
+                self.print_function(logs.rstrip('\n'))
+                self.print_function('   *****************************   ')
+        else:
+            self.print_function('   ************** logs ***************   ')
+            self._print_logs(one_shot_service_name, container)
+            self.print_function('   *****************************   ')
+        container.reload()
+        self.collect(container, collect)
+        if container.attrs['State']['ExitCode'] == 0:
+            self.cache_one_shot(one_shot_service_name)
+        return container.attrs['State']['ExitCode']
+
+    def get_failed_starts(self) -> set[str]:
+        # compose up exits with the service, so an exited creator means the service died before becoming ready.
+        # one sparse listing per tick instead of a lookup per service, the full listing would inspect each container
+        result = set()
+        for container in self.docker_client.containers.list(all=True, sparse=True,
+                                                            filters={'name': '_creator', 'status': 'exited'}):
+            for container_name in container.attrs['Names']:
+                container_name = container_name.lstrip('/')
+                if container_name.endswith('_creator'):
+                    service_name = self._get_service_name(container_name[:-len('_creator')])
+                    if service_name is not None:
+                        result.add(service_name)
+        return result
+
+    def retry_service(self, service_name: str) -> None:
+        self._remove_service(service_name)
+        self.start_service(service_name)
 
     def clear(self, service_name):
         print(f'removing service {service_name}')
+        self._remove_service(service_name)
+
+    def _remove_service(self, service_name: str) -> None:
+        self._ready_containers.pop(service_name, None)
+        self._deferred_readiness_checks.pop(service_name, None)
+        self.ip_registry.remove(service_name)
         try:
-            container = self.docker_client.containers.get(service_name)
+            container = self.docker_client.containers.get(self.get_container_name(service_name))
             container.stop()
             container.reload()
             if container.status != 'removing':
                 container.remove()
         except NotFound:
             pass
+        if self.get_replicas(service_name) > 1:
+            for container in self._get_replica_containers(service_name):
+                self._ready_containers.pop(container.name, None)
+                container.remove(force=True)
         try:
-            container = self.docker_client.containers.get(f'{service_name}_creator')
+            container = self.docker_client.containers.get(self._get_creator_name(service_name))
             container.stop()
             container.reload()
             if container.status != 'removing':
@@ -474,6 +1532,178 @@ class ContainerService(BaseContainerService):
         for service_name in self.compose_file['services']:
             self.clear(service_name)
 
+    def _get_project_name(self) -> str:
+        if 'COMPOSE_PROJECT_NAME' in self.environment:
+            return self.environment['COMPOSE_PROJECT_NAME']
+        # creator containers run compose on /opt/docker-compose.yml, so the default project is the directory name
+        return self.compose_file.get('name', 'opt')
+
+    def _get_volume_name(self, volume_name: str) -> str:
+        volume = self.compose_file.get('volumes', {}).get(volume_name) or {}
+        if 'name' in volume:
+            return volume['name']
+        return f'{self._get_project_name()}_{volume_name}'
+
+    def _get_service_named_volumes(self, service_name: str, compose_file: dict = None) -> list[str]:
+        compose_file = compose_file or self.compose_file
+        volume_names = list(compose_file.get('volumes') or {})
+        result = []
+        for volume in compose_file['services'][service_name].get('volumes', []):
+            source = str(volume).split(':', maxsplit=1)[0] if isinstance(volume, str) else volume.get('source')
+            if source in volume_names:
+                result.append(source)
+        return result
+
+    def get_snapshot_fingerprint(self) -> str:
+        # run labels and tmpfs mounts depend on the command line, the snapshot only on what the user wrote
+        seeded_services = {}
+        for service_name, service in self.source_compose_file['services'].items():
+            if 'x-one-shot' in service or self._get_service_named_volumes(service_name, self.source_compose_file):
+                seeded_services[service_name] = service
+        content = yaml.safe_dump({'services': seeded_services,
+                                  'volumes': self.source_compose_file.get('volumes', {})}, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+    def get_one_shot_cache_key(self, service_name: str) -> str | None:
+        image_digest = self.get_image_digest(service_name)
+        if image_digest is None:
+            return None
+        service = self.compose_file['services'][service_name]
+        inputs = [Path(self.compose_file_path.parent, input_path)
+                  for input_path in (service.get('x-one-shot') or {}).get('inputs', [])]
+        content = yaml.safe_dump({
+            'image': image_digest,
+            'entrypoint': service.get('entrypoint'),
+            'command': service.get('command'),
+            'environment': service.get('environment'),
+            'inputs': hash_paths(inputs)
+        }, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _get_one_shot_volumes(self, service_name: str) -> dict | None:
+        # the one-shot's results live in its own volumes or in the volumes of the services it depends on
+        service_names = [service_name]
+        pending = [service_name]
+        while pending:
+            for dependency_name in self.compose_file['services'][pending.pop(0)].get('depends_on', []):
+                if dependency_name not in service_names:
+                    service_names.append(dependency_name)
+                    pending.append(dependency_name)
+        result = {}
+        for current_name in service_names:
+            for volume_name in self._get_service_named_volumes(current_name):
+                try:
+                    result[volume_name] = self.docker_client.volumes.get(
+                        self._get_volume_name(volume_name)).attrs['CreatedAt']
+                except NotFound:
+                    return None
+        return result
+
+    def _get_one_shot_cache_name(self, service_name: str) -> str:
+        return f'{self.compose_file_path.absolute()}:{self._get_project_name()}:{service_name}'
+
+    def is_one_shot_cached(self, service_name: str) -> bool:
+        if self.one_shot_cache is None:
+            return False
+        entry = self.one_shot_cache.get(self._get_one_shot_cache_name(service_name))
+        if entry is None or entry['key'] != self.get_one_shot_cache_key(service_name):
+            return False
+        volumes = self._get_one_shot_volumes(service_name)
+        return volumes is not None and entry['volumes'] == volumes
+
+    def cache_one_shot(self, service_name: str) -> None:
+        if self.one_shot_cache is None:
+            return
+        key = self.get_one_shot_cache_key(service_name)
+        volumes = self._get_one_shot_volumes(service_name)
+        if key is not None and volumes is not None:
+            self.one_shot_cache.put(self._get_one_shot_cache_name(service_name), key, volumes)
+
+    def _pause_volume_users(self, volume_name: str) -> list:
+        containers = self.docker_client.containers.list(filters={'volume': volume_name, 'status': 'running'})
+        for container in containers:
+            container.pause()
+        return containers
+
+    def snapshot(self, snapshot_dir: Path, as_image: bool) -> str:
+        fingerprint = self.get_snapshot_fingerprint()
+        volumes = {self._get_volume_name(volume_name): volume_name
+                   for volume_name in self.compose_file.get('volumes', {})}
+        paused = []
+        try:
+            for volume_name in volumes:
+                paused += self._pause_volume_users(volume_name)
+            if as_image:
+                helper = self.docker_client.containers.run(
+                    'docker:23.0.1-cli-alpine3.17',
+                    'sh -c "mkdir -p /snapshot && cp -a /volumes/. /snapshot/"',
+                    volumes={name: {'bind': f'/volumes/{volume_name}', 'mode': 'ro'}
+                             for name, volume_name in volumes.items()},
+                    labels=self.run_labels,
+                    detach=True)
+                helper.wait()
+                helper.commit(repository='dc-test-exec-snapshot', tag=fingerprint)
+                helper.remove()
+                return fingerprint
+            target_dir = Path(snapshot_dir, fingerprint)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            for name, volume_name in volumes.items():
+                helper = self.docker_client.containers.create(
+                    'docker:23.0.1-cli-alpine3.17',
+                    volumes={name: {'bind': '/volume', 'mode': 'ro'}}, labels=self.run_labels)
+                try:
+                    bits, _ = helper.get_archive('/volume')
+                    with open(Path(target_dir, f'{volume_name}.tar'), 'wb') as archive:
+                        for chunk in bits:
+                            archive.write(chunk)
+                finally:
+                    helper.remove()
+            return fingerprint
+        finally:
+            for container in paused:
+                container.unpause()
+
+    def _create_volume(self, volume_name: str):
+        name = self._get_volume_name(volume_name)
+        try:
+            return self.docker_client.volumes.get(name)
+        except NotFound:
+            return self.docker_client.volumes.create(name, labels={
+                'com.docker.compose.project': self._get_project_name(),
+                'com.docker.compose.volume': volume_name
+            })
+
+    def restore_snapshot(self, snapshot_dir: Path) -> bool:
+        fingerprint = self.get_snapshot_fingerprint()
+        source_dir = Path(snapshot_dir, fingerprint)
+        volume_names = list(self.compose_file.get('volumes', {}))
+        if source_dir.is_dir():
+            for volume_name in volume_names:
+                volume = self._create_volume(volume_name)
+                helper = self.docker_client.containers.create(
+                    'docker:23.0.1-cli-alpine3.17',
+                    volumes={volume.name: {'bind': '/volume'}}, labels=self.run_labels)
+                try:
+                    with open(Path(source_dir, f'{volume_name}.tar'), 'rb') as archive:
+                        helper.put_archive('/', archive)
+                finally:
+                    helper.remove()
+            return True
+        try:
+            self.docker_client.images.get(f'dc-test-exec-snapshot:{fingerprint}')
+        except NotFound:
+            return False
+        for volume_name in volume_names:
+            volume = self._create_volume(volume_name)
+            self.docker_client.containers.run(
+                f'dc-test-exec-snapshot:{fingerprint}',
+                # the image comes from the docker cli one, whose entrypoint would run a bare cp as docker cp
+                f'sh -c "cp -a /snapshot/{volume_name}/. /volume/"',
+                volumes={volume.name: {'bind': '/volume'}},
+                labels=self.run_labels,
+                remove=True)
+        return True
+
     def attach_network(self, container):
         if exists("/.dockerenv"):
             current_container = self.docker_client.containers.get(os.uname().nodename)
@@ -485,6 +1715,18 @@ class ContainerService(BaseContainerService):
                     network.connect(current_container)
 
 
+def read_env_file(env_file_path: str) -> dict:
+    result = {}
+    if not env_file_path or not exists(env_file_path):
+        return result
+    for line in Path(env_file_path).read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#') and '=' in line:
+            key, value = line.split('=', 1)
+            result[key.strip()] = value.strip()
+    return result
+
+
 def check(config: dict) -> Tuple[bool, any]:
     connection = None
     try:
@@ -520,80 +1762,305 @@ def check(config: dict) -> Tuple[bool, any]:
             connection.close()
 
 
+class ChunkStream(io.RawIOBase):
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def extract_archive(chunks, host_dir: str) -> None:
+    os.makedirs(host_dir, exist_ok=True)
+    extract_options = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    with tarfile.open(fileobj=ChunkStream(chunks), mode='r|') as archive:
+        for member in archive:
+            # get_archive wraps a directory in an entry named after it, the content goes straight to host_dir
+            root, _, relative_name = member.name.partition('/')
+            if not relative_name and member.isdir():
+                continue
+            member.name = relative_name or root
+            archive.extract(member, host_dir, **extract_options)
+
+
+class NotReadyCauses:
+
+    def __init__(self):
+        # replicas of a service are checked at the same time, each keeps its own cause
+        self._causes = {}
+        self._lock = threading.Lock()
+
+    def clear(self, service_name: str, container_name: str = None) -> None:
+        with self._lock:
+            self._causes.pop((service_name, container_name), None)
+
+    def set(self, service_name: str, container_name: str, cause: str) -> None:
+        with self._lock:
+            self._causes[(service_name, container_name)] = cause
+
+    def get(self, service_name: str) -> str | None:
+        with self._lock:
+            causes = [(container_name or '', cause) for (cause_service_name, container_name), cause
+                      in self._causes.items() if cause_service_name == service_name]
+        return min(causes)[1] if causes else None
+
+
 class HealthReadinessCheck(BaseReadinessCheck):
 
     def __init__(self, docker_client, compose_file):
         self.docker_client = docker_client
         self.compose_file = compose_file
-        self.api_client = docker.APIClient(base_url='unix://var/run/docker.sock')
+        self._not_ready_cause = NotReadyCauses()
 
-    def is_ready(self, service_name: str, service_ip: str) -> bool:
+    def is_ready(self, service_name: str, service_ip: str, container_name: str = None) -> bool:
+        self._not_ready_cause.clear(service_name, container_name)
         if 'x-container-readiness-check' not in self.compose_file['services'][service_name]:
             return True
-        info = self.api_client.inspect_container(service_name)
+        info = self.docker_client.api.inspect_container(container_name or service_name)
         if 'Health' in info['State']:
-            return info['State']['Health']['Status'] == 'healthy'
+            if info['State']['Health']['Status'] != 'healthy':
+                self._not_ready_cause.set(service_name, container_name,
+                                          f'health status {info["State"]["Health"]["Status"]}')
+                return False
         return True
 
+    def get_not_ready_cause(self, service_name: str) -> str | None:
+        return self._not_ready_cause.get(service_name)
+
 
 class HttpReadinessCheck(BaseReadinessCheck):
 
     def __init__(self, compose_file: dict, check_function=check):
-        self._not_ready_cause = None
+        self._not_ready_cause = NotReadyCauses()
         self.compose_file = compose_file
         self.check_function = check_function
 
-    def is_ready(self, service_name: str, service_ip: str) -> bool:
+    def is_ready(self, service_name: str, service_ip: str, container_name: str = None) -> bool:
+        self._not_ready_cause.clear(service_name, container_name)
         if 'x-http-readiness-checks' not in self.compose_file['services'][service_name]:
             return True
 
-        all_true = True
+        causes = []
         for config in self.compose_file['services'][service_name]['x-http-readiness-checks']:
-            config['service-ip'] = service_ip
-            all_true = all_true and self.check_function(config)[0]
+            # replicas of a service are probed concurrently, so the shared config is not written to
+            ready, cause = self.check_function({**config, 'service-ip': service_ip})
+            if not ready:
+                causes.append(f'{config["url"]}: {cause}')
+
+        if causes:
+            self._not_ready_cause.set(service_name, container_name, causes[0])
+        return not causes
+
+    def get_not_ready_cause(self, service_name: str) -> str | None:
+        return self._not_ready_cause.get(service_name)
+
+
+class BaseStatusPresenter:
+
+    def present(self, status: dict) -> None:
+        pass
+
+    def present_event(self, event: dict, message: str) -> None:
+        pass
+
+
+class TerminalStatusPresenter(BaseStatusPresenter):
+
+    def __init__(self, print_function: Callable[[str], None]):
+        self.print_function = print_function
+        self.last_lines_showed = []
+        self.max_line_size = 0
+
+    def _padded(self, line: str) -> str:
+        if len(line) > self.max_line_size:
+            self.max_line_size = len(line)
+        return line + " " * (self.max_line_size - len(line))
+
+    def present(self, status: dict) -> None:
+        lines_to_show = Services.transform_status_to_log(status)
+        if len(lines_to_show) != len(self.last_lines_showed):
+            if self.last_lines_showed:
+                self.print_function("\033[F" * (len(self.last_lines_showed) + 1))
+            for line in lines_to_show:
+                self.print_function(self._padded(line))
+        else:
+            for index, line in enumerate(lines_to_show):
+                if line == self.last_lines_showed[index]:
+                    continue
+                lines_up = len(lines_to_show) - index
+                self.print_function(f'\033[{lines_up}A\r\033[2K{self._padded(line)}' +
+                                    (f'\033[{lines_up - 1}B' if lines_up > 1 else ''))
+        self.last_lines_showed = lines_to_show
 
-        return all_true
+    def present_event(self, event: dict, message: str) -> None:
+        self.print_function(message)
+
+
+class JsonLinesStatusPresenter(BaseStatusPresenter):
+
+    def __init__(self, print_function: Callable[[str], None]):
+        self.print_function = print_function
+        self.last_status = {}
+
+    def present(self, status: dict) -> None:
+        for service_name, service_status in status.items():
+            old_status = self.last_status.get(service_name)
+            if old_status == service_status['status']:
+                continue
+            self._print_json({
+                'event': 'status',
+                'service': service_name,
+                'old_status': old_status.name if old_status else None,
+                'new_status': service_status['status'].name,
+                'error': service_status.get('error')
+            })
+            self.last_status[service_name] = service_status['status']
+
+    def present_event(self, event: dict, message: str) -> None:
+        self._print_json(event)
+
+    def _print_json(self, event: dict) -> None:
+        self.print_function(json.dumps({'timestamp': datetime.now(timezone.utc).isoformat(), **event}))
 
 
 class TestContainer:
 
     # pylint: disable=too-many-arguments
     def __init__(self, compose_file_path: str, environment: dict, env_file: str, silent: bool,
-                 print_function: Callable[[str], None]):
+                 print_function: Callable[[str], None], **kwargs):
 
         path = Path(compose_file_path)
+        self.compose_file_path = path
         self.env_file = env_file
-        self.services = Services(path, ContainerService(path, environment=environment, env_file=env_file))
+        self.services = Services(path, ContainerService(
+            path, environment=environment, env_file=env_file,
+            liveness_recheck_seconds=kwargs.get('liveness_recheck_seconds', None),
+            ips_env_file=kwargs.get('ips_env_file', None),
+            ips_hosts_file=kwargs.get('ips_hosts_file', None),
+            one_shot_cache=kwargs.get('one_shot_cache', None),
+            capture_logs=kwargs.get('capture_logs', None),
+            sample_resources=kwargs.get('stats_file', None) is not None,
+            stack_suffix=kwargs.get('stack_suffix', ''),
+            run_id=kwargs.get('run_id', None),
+            tmpfs_data=kwargs.get('tmpfs_data', False),
+            tmpfs_size=kwargs.get('tmpfs_size', '256m'),
+            max_parallel_builds=kwargs.get('max_parallel_builds', 4),
+            print_function=self._print,
+            docker_client=kwargs.get('docker_client', None)),
+            max_starting=kwargs.get('max_starting', None),
+            ready_timeout=kwargs.get('ready_timeout', None),
+            timing_history=TimingHistory(kwargs['history_db']) if kwargs.get('history_db') else None)
         self.print_function = print_function
-        self.last_lines_showed = 0
-        self.max_line_size = 0
         self.silent = silent
+        self.collect = kwargs.get('collect', None)
+        self.stats_file = kwargs.get('stats_file', None)
+        presenter_class = JsonLinesStatusPresenter if kwargs.get('output', 'terminal') == 'jsonl' \
+            else TerminalStatusPresenter
+        self.presenter = presenter_class(self._print)
+        # captured logs are the point of a silent run that failed, so they bypass --silent
+        self.failure_presenter = presenter_class(self.print_function)
 
     def _print(self, line: str):
         if not self.silent:
             self.print_function(line)
 
-    def _present_status(self, lines_to_show: list[str]):
-        if self.last_lines_showed > 0:
-            self._print("\033[F" * (self.last_lines_showed + 1))
-        for line in lines_to_show:
-            if len(line) > self.max_line_size:
-                self.max_line_size = len(line)
-            self._print(line + " " * (self.max_line_size - len(line)))
-        self.last_lines_showed = len(lines_to_show)
+    def _present_status(self, status: dict):
+        self.presenter.present(status)
+
+    def _dump_logs(self, service_names: list[str]):
+        for service_name in service_names:
+            lines = self.services.container_service.get_captured_logs(service_name)
+            if lines:
+                self.failure_presenter.present_event(
+                    {'event': 'logs', 'service': service_name, 'lines': lines},
+                    '\n'.join([f'   ************** {service_name} logs ***************   '] + lines))
 
     def start(self, verification_step_millis: int, presentation_step_millis: int,
-              run_exec_container: bool, until: str = None):
-        self.services.start(verification_step_millis, presentation_step_millis, self._present_status, until)
+              run_exec_container: bool, until: str | list[str] = None):
+        built = self.services.container_service.build_images()
+        if built:
+            self.presenter.present_event({'event': 'images-built', 'services': built},
+                                         'images built : ' + ', '.join(
+                                             f'{service_name}{" (cached)" if image["cached"] else ""}'
+                                             for service_name, image in built.items()))
+        cached = self.services.apply_one_shot_cache()
+        if cached:
+            self.presenter.present_event({'event': 'one-shot-cached', 'services': cached},
+                                         f'one-shot services with unchanged inputs skipped : {", ".join(cached)}')
+        eta = self.services.get_startup_eta()
+        if eta:
+            self.presenter.present_event({'event': 'eta', 'seconds': round(eta, 1)},
+                                         f'expected startup time : {round(eta, 1)}s')
+        completed = self.services.start(verification_step_millis, presentation_step_millis,
+                                        self._present_status, until)
+        self.services.store_one_shot_cache()
+        self._dump_logs(self.services.get_failed_services())
+
+        report = self.services.get_critical_path_report()
+        if report:
+            self.presenter.present_event({'event': 'critical-path', **report},
+                                         '\n'.join(Services.transform_critical_path_to_log(report)))
+
+        if not completed and self.services.given_up_services:
+            self.presenter.present_event({'event': 'start-failed', 'services': sorted(self.services.given_up_services)},
+                                         'services failed to start : '
+                                         f'{", ".join(sorted(self.services.given_up_services))}')
+            sys.exit(1)
+
+        if not completed:
+            self.presenter.present_event({'event': 'ready-timeout', 'services': self.services.get_failed_services()},
+                                         'services not ready in time : '
+                                         f'{", ".join(self.services.get_failed_services())}')
+            sys.exit(1)
 
         if run_exec_container:
             self.run_exec_container()
+        self._report_tmpfs_usage()
+
+    def watch(self, verification_step_millis: int, presentation_step_millis: int):
+        watcher = FileWatcher([str(self.compose_file_path)] + ([self.env_file] if self.env_file else []))
+        environment = read_env_file(self.env_file)
+        try:
+            while True:
+                watcher.wait_for_change()
+                try:
+                    compose_file = yaml.safe_load(self.compose_file_path.read_text(encoding='utf-8'))
+                except yaml.YAMLError as error:
+                    self.presenter.present_event({'event': 'watch-error', 'error': str(error)},
+                                                 f'compose file not reloaded : {error}')
+                    continue
+                new_environment = read_env_file(self.env_file)
+                recreated, removed = self.services.apply_compose_file(
+                    compose_file, [key for key in {**environment, **new_environment}
+                                   if environment.get(key) != new_environment.get(key)],
+                    verification_step_millis, presentation_step_millis, self._present_status)
+                environment = new_environment
+                self.presenter.present_event({'event': 'watch-reload', 'recreated': recreated, 'removed': removed},
+                                             f'recreated : {", ".join(recreated) or "none"}')
+        finally:
+            watcher.close()
 
     def status(self):
         self.services.status(self._present_status)
 
-    def restart(self, service_name: str):
-        message = self.services.restart(service_name)
+    def restart(self, service_name: str, cascade: bool = False):
+        if cascade:
+            message = self.services.restart_cascade(service_name, 100, 1000, self._present_status)
+        else:
+            message = self.services.restart(service_name)
         if message:
             self._print(message)
             sys.exit(1)
@@ -605,15 +2072,67 @@ class TestContainer:
             sys.exit(1)
 
     def run_exec_container(self):
-        exit_code = self.services.run_exec_container()
-        self._print(f'exec-container exit code ({exit_code})')
+        exit_code = self.services.run_exec_container(self.collect)
+        self._report_resource_stats()
+        self._report_tmpfs_usage()
+        if exit_code != 0:
+            self._dump_logs([service_name for service_name in self.services.compose_file['services']
+                             if self.services.is_exec_service(service_name)])
+        self.presenter.present_event({'event': 'exec-container-exit', 'exit_code': exit_code},
+                                     f'exec-container exit code ({exit_code})')
         sys.exit(exit_code)
 
+    def _report_resource_stats(self):
+        resource_stats = self.services.container_service.get_resource_stats()
+        if not resource_stats:
+            return
+        Path(self.stats_file).parent.mkdir(parents=True, exist_ok=True)
+        Path(self.stats_file).write_text(json.dumps(resource_stats, indent=2), encoding='utf-8')
+        self.presenter.present_event({'event': 'resource-stats', 'services': resource_stats},
+                                     '\n'.join(transform_resource_stats_to_log(resource_stats)))
+
+    def _report_tmpfs_usage(self):
+        tmpfs_usage = self.services.container_service.get_tmpfs_usage()
+        if not tmpfs_usage:
+            return
+        lines = ['tmpfs usage :']
+        for service_name, targets in tmpfs_usage.items():
+            for target, usage in targets.items():
+                lines.append(f'    {service_name} {target} : {usage["used_bytes"] // 1024 ** 2}MiB of '
+                             f'{usage["size_bytes"] // 1024 ** 2}MiB')
+        self.presenter.present_event({'event': 'tmpfs-usage', 'services': tmpfs_usage}, '\n'.join(lines))
+
     def run_one_shot_service(self, one_shot_service_name):
-        exit_code = self.services.run_one_shot_service(one_shot_service_name)
-        self._print(f'one-shot-exec exit code ({exit_code})')
+        exit_code = self.services.run_one_shot_services([one_shot_service_name], self.collect,
+                                                        self._present_status)[one_shot_service_name]
+        if exit_code != 0:
+            self._dump_logs([one_shot_service_name])
+        self.presenter.present_event({'event': 'one-shot-exit', 'service': one_shot_service_name,
+                                      'exit_code': exit_code}, f'one-shot-exec exit code ({exit_code})')
         sys.exit(exit_code)
 
+    def snapshot(self, snapshot_dir: str, as_image: bool):
+        fingerprint = self.services.snapshot(Path(snapshot_dir), as_image)
+        self.presenter.present_event({'event': 'snapshot', 'fingerprint': fingerprint},
+                                     f'snapshot created ({fingerprint})')
+
+    def restore_snapshot(self, snapshot_dir: str):
+        if self.services.restore_snapshot(Path(snapshot_dir)):
+            self.presenter.present_event({'event': 'snapshot-restored',
+                                          'skipped': self.services.get_one_shot_services()},
+                                         'snapshot restored, skipping one-shot services')
+        else:
+            self.presenter.present_event({'event': 'snapshot-missing'},
+                                         'no snapshot found, running one-shot services')
+
+    def run_one_shot_services(self, one_shot_service_names: list[str]):
+        exit_codes = self.services.run_one_shot_services(one_shot_service_names, self.collect, self._present_status)
+        self._dump_logs([service_name for service_name, exit_code in exit_codes.items() if exit_code != 0])
+        for service_name, exit_code in exit_codes.items():
+            self.presenter.present_event({'event': 'one-shot-exit', 'service': service_name, 'exit_code': exit_code},
+                                         f'one-shot-exec {service_name} exit code ({exit_code})')
+        sys.exit(next((exit_code for exit_code in exit_codes.values() if exit_code != 0), 0))
+
     def clear(self, services, unless):
         self.services.clear(services, unless)
 
@@ -0,0 +1,57 @@
+def _get_volume_target(volume, named_volumes: list[str]) -> str | None:
+    if isinstance(volume, str):
+        parts = volume.split(':')
+        if len(parts) == 1:
+            # anonymous volume
+            return parts[0]
+        return parts[1] if parts[0] in named_volumes else None
+    if volume.get('type', 'volume') != 'volume':
+        return None
+    if volume.get('source') and volume['source'] not in named_volumes:
+        return None
+    return volume.get('target')
+
+
+def _get_requested_sizes(spec, targets: list[str], default_size: str) -> dict:
+    if spec is True:
+        return {target: default_size for target in targets}
+    if isinstance(spec, dict):
+        return {target: size or default_size for target, size in spec.items()}
+    result = {}
+    for entry in spec or []:
+        if isinstance(entry, dict):
+            result[entry['target']] = entry.get('size', default_size)
+        else:
+            result[entry] = default_size
+    return result
+
+
+def apply_ephemeral_volumes(compose_file: dict, all_data_volumes: bool, default_size: str) -> dict:
+    named_volumes = list(compose_file.get('volumes') or {})
+    result = {}
+    for service_name, service in compose_file['services'].items():
+        spec = service.get('x-ephemeral-volumes', True if all_data_volumes else None)
+        if not spec:
+            continue
+        volumes = service.get('volumes', [])
+        targets = [_get_volume_target(volume, named_volumes) for volume in volumes]
+        sizes = _get_requested_sizes(spec, [target for target in targets if target], default_size)
+        if not sizes:
+            continue
+        service['volumes'] = [{'type': 'tmpfs', 'target': target, 'tmpfs': {'size': sizes[target]}}
+                              if target in sizes else volume for volume, target in zip(volumes, targets)]
+        service['volumes'].extend({'type': 'tmpfs', 'target': target, 'tmpfs': {'size': size}}
+                                  for target, size in sizes.items() if target not in targets)
+        result[service_name] = list(sizes)
+    return result
+
+
+def parse_df_output(output: str) -> dict | None:
+    # df -k prints a header and one line per file system: name, size, used, available, use%, mount point
+    lines = output.strip().splitlines()
+    if len(lines) < 2:
+        return None
+    fields = lines[-1].split()
+    if len(fields) < 6 or not fields[1].isdigit() or not fields[2].isdigit():
+        return None
+    return {'size_bytes': int(fields[1]) * 1024, 'used_bytes': int(fields[2]) * 1024}
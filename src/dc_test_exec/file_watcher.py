@@ -0,0 +1,84 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+# modify, attrib, close_write, moved_to, create and delete; editors often save by renaming a temporary file
+INOTIFY_MASK = 0x2 | 0x4 | 0x8 | 0x80 | 0x100 | 0x200
+
+
+class FileWatcher:
+
+    def __init__(self, paths: list[str], poll_seconds: float = 1.0, use_inotify: bool = True):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.poll_seconds = poll_seconds
+        self._fd = self._init_inotify() if use_inotify else None
+        self._signatures = self._get_signatures()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def _init_inotify(self) -> int | None:
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        # the directories are watched, a file replaced by rename would drop a watch on the file itself
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            if libc.inotify_add_watch(fd, directory.encode(), INOTIFY_MASK) < 0:
+                os.close(fd)
+                return None
+        return fd
+
+    def _get_signatures(self) -> dict:
+        result = {}
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                result[path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                result[path] = None
+        return result
+
+    def _wait(self, seconds: float) -> None:
+        if self._fd is None:
+            time.sleep(seconds)
+            return
+        readable, _, _ = select.select([self._fd], [], [], seconds)
+        if readable:
+            # events only wake the loop up, the signatures decide what changed
+            while True:
+                try:
+                    if not os.read(self._fd, 65536):
+                        break
+                except BlockingIOError:
+                    break
+            # let the editor finish writing before the file is read
+            time.sleep(0.1)
+
+    def wait_for_change(self, timeout_seconds: float = None) -> list[str]:
+        deadline = None if timeout_seconds is None else time.time() + timeout_seconds
+        while True:
+            wait_seconds = self.poll_seconds if deadline is None else \
+                max(min(self.poll_seconds, deadline - time.time()), 0)
+            self._wait(wait_seconds)
+            signatures = self._get_signatures()
+            changed = [path for path in self.paths if signatures[path] != self._signatures[path]]
+            self._signatures = signatures
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return []
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
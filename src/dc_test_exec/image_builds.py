@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os.path
+from pathlib import Path
+
+from dc_test_exec.one_shot_cache import hash_paths
+
+SUPPORTED_BUILD_KEYS = ['context', 'dockerfile', 'args', 'target']
+
+
+def get_build_spec(service: dict) -> dict | None:
+    build = service.get('build')
+    if build is None:
+        return None
+    if isinstance(build, str):
+        build = {'context': build}
+    context = str(build.get('context', '.'))
+    if '://' in context or context.startswith('git@'):
+        # remote contexts are fetched by the daemon, there is nothing local to hash or mount
+        return None
+    # anything else the build section asks for is left to compose instead of being dropped
+    if any(key not in SUPPORTED_BUILD_KEYS for key in build):
+        return None
+    dockerfile = build.get('dockerfile', 'Dockerfile')
+    # only the context is mounted and hashed, a dockerfile outside of it would be neither
+    if os.path.isabs(dockerfile) or os.path.normpath(dockerfile).split(os.sep)[0] == '..':
+        return None
+    args = build.get('args') or {}
+    if isinstance(args, list):
+        args = dict(arg.split('=', 1) if '=' in arg else (arg, '') for arg in args)
+    return {
+        'context': context,
+        'dockerfile': dockerfile,
+        'args': {key: str(value) for key, value in args.items()},
+        'target': build.get('target'),
+        # compose tags the image it builds with the service image name, the built image keeps that name too
+        'image': service.get('image')
+    }
+
+
+def get_build_tag(service_name: str, build_spec: dict, context_path: Path) -> str:
+    digest = hashlib.sha256()
+    digest.update(hash_paths([context_path]).encode('utf-8'))
+    digest.update(json.dumps({key: value for key, value in build_spec.items() if key != 'context'},
+                             sort_keys=True).encode('utf-8'))
+    return f'dc-test-exec-build/{service_name.lower()}:{digest.hexdigest()[:16]}'
+
+
+def get_build_command(tag: str, build_spec: dict) -> list[str]:
+    command = ['build', '--tag', tag, '--file', f'/build/{build_spec["dockerfile"]}']
+    for key, value in build_spec['args'].items():
+        command.extend(['--build-arg', f'{key}={value}'])
+    if build_spec['target']:
+        command.extend(['--target', build_spec['target']])
+    if build_spec['image']:
+        command.extend(['--tag', build_spec['image']])
+    command.append('/build')
+    return command
@@ -0,0 +1,81 @@
+import threading
+from collections import deque
+
+from docker.errors import DockerException
+
+
+class LogRingBuffer:
+
+    def __init__(self, max_lines: int, max_line_bytes: int = 4096):
+        self.max_line_bytes = max_line_bytes
+        self._lines = deque(maxlen=max_lines)
+        self._partial = b''
+        self._lock = threading.Lock()
+
+    def write(self, chunk: bytes) -> None:
+        with self._lock:
+            lines = (self._partial + chunk).split(b'\n')
+            # an unterminated line is kept truncated too, so a service that never prints a newline stays bounded
+            self._partial = lines.pop()[:self.max_line_bytes]
+            for line in lines:
+                self._lines.append(line[:self.max_line_bytes])
+
+    def tail(self, lines: int = None) -> list[str]:
+        with self._lock:
+            result = list(self._lines) + ([self._partial] if self._partial else [])
+        if lines is not None:
+            result = result[-lines:] if lines > 0 else []
+        return [line.decode('utf-8', errors='replace') for line in result]
+
+
+class LogCapture:
+
+    def __init__(self, max_lines: int):
+        self.max_lines = max_lines
+        self._buffers = {}
+        self._followed = {}
+        self._replicas = {}
+        self._lock = threading.Lock()
+
+    def _get_buffer(self, service_name: str) -> LogRingBuffer:
+        with self._lock:
+            if service_name not in self._buffers:
+                self._buffers[service_name] = LogRingBuffer(self.max_lines)
+            return self._buffers[service_name]
+
+    def write(self, service_name: str, chunk: bytes) -> None:
+        self._get_buffer(service_name).write(chunk)
+
+    def follow(self, service_name: str, container, replica_name: str = None) -> None:
+        # each replica gets its own buffer, lines of two streams written to one buffer would be spliced together
+        key = replica_name or service_name
+        with self._lock:
+            if replica_name and replica_name not in self._replicas.setdefault(service_name, []):
+                self._replicas[service_name].append(replica_name)
+            if self._followed.get(key) == container.id:
+                return
+            self._followed[key] = container.id
+            self._buffers[key] = LogRingBuffer(self.max_lines)
+            buffer = self._buffers[key]
+        threading.Thread(target=self._pump, args=(container, buffer), daemon=True).start()
+
+    @staticmethod
+    def _pump(container, buffer: LogRingBuffer) -> None:
+        try:
+            for chunk in container.logs(stream=True, follow=True):
+                buffer.write(chunk)
+        except (DockerException, OSError):
+            pass
+
+    def tail(self, service_name: str, lines: int = None) -> list[str]:
+        with self._lock:
+            replica_names = list(self._replicas.get(service_name, []))
+            buffer = self._buffers.get(service_name)
+            replica_buffers = [(replica_name, self._buffers[replica_name]) for replica_name in replica_names]
+        if not replica_names:
+            return buffer.tail(lines) if buffer else []
+        result = [f'{replica_name} | {line}' for replica_name, replica_buffer in replica_buffers
+                  for line in replica_buffer.tail(lines)]
+        if lines is not None:
+            result = result[-lines:] if lines > 0 else []
+        return result
@@ -1,10 +1,17 @@
+import json
 import os
+import sys
+from os.path import abspath
+from pathlib import Path
 
 import click
-from os.path import abspath
 
 from click import ClickException
-from dc_test_exec.docker_compose_test_executor import TestContainer
+from dc_test_exec.docker_compose_test_executor import TestContainer, Services, BaseContainerService
+from dc_test_exec.docker_client import create_docker_client
+from dc_test_exec.one_shot_cache import default_cache_path
+from dc_test_exec.reaper import reap as reap_resources
+from dc_test_exec.timing_history import default_history_path
 
 
 @click.group()
@@ -16,31 +23,100 @@ def __print(line: str):
     click.echo(str)
 
 
+def _parse_collect(_context, _param, value) -> list:
+    result = []
+    for spec in value:
+        container_path, separator, host_dir = spec.partition(':')
+        if not separator or not container_path or not host_dir:
+            raise click.BadParameter(f'{spec} is not in format <CONTAINER_PATH>:<HOST_DIR>')
+        result.append((container_path, host_dir))
+    return result
+
+
 # TODO restart, mostrar resultado execucao container
 @click.command(name="status")
 @click.option('--file', '-f', metavar='<DOCKER_COMPOSE_FILE>', required=True,
               type=click.types.Path(file_okay=True, dir_okay=False), help="docker compose file",
               default=lambda: os.environ.get('DC_FILE', ''), show_default="env variable DC_FILE")
-def status(file):
+@click.option('--output', '-o', type=click.Choice(['terminal', 'jsonl']), default='terminal', show_default=True,
+              help="status output format: terminal redraws changed lines, jsonl emits one event per status change")
+def status(file, output):
     """show services status and dependencies"""
-    TestContainer(abspath(file), {}, False, click.echo).status()
+    TestContainer(abspath(file), {}, None, False, click.echo, output=output).status()
 
 
 @click.command(name="start")
 @click.option('--file', '-f', metavar='<DOCKER_COMPOSE_FILE>', required=True,
               type=click.types.Path(file_okay=True, dir_okay=False), help="docker compose file",
               default=lambda: os.environ.get('DC_FILE', ''), show_default="env variable DC_FILE")
-@click.option('--until', '-u', metavar='<SERVICE_NAME>',
-              help="stop starting services when <SERVICE_NAME> is started")
+@click.option('--until', '-u', metavar='<SERVICE_NAME>', multiple=True,
+              help="start only <SERVICE_NAME> and its dependencies, can be given more than once")
 @click.option('--silent', '-s', is_flag=True)
 @click.option('--environment', '-e', metavar='<ENV_VAR_NAME> <ENV_VAR_VALUE>', type=(str, str), multiple=True,
               help="sets a environment variables in format <ENV_VAR_NAME> <ENV_VAR_VALUE>.")
 @click.option('--env-file', '-ef', metavar='<ENVIRONMENT_FILE', type=click.types.Path(file_okay=True, dir_okay=False),
               help="sets a environment file variables in format.")
-def start(file, until, silent, environment, env_file):
+@click.option('--output', '-o', type=click.Choice(['terminal', 'jsonl']), default='terminal', show_default=True,
+              help="status output format: terminal redraws changed lines, jsonl emits one event per status change")
+@click.option('--from-snapshot', is_flag=True,
+              help="restore named volumes from a snapshot and skip one-shot services")
+@click.option('--snapshot-dir', metavar='<SNAPSHOT_DIR>', type=click.types.Path(file_okay=False, dir_okay=True),
+              default='.dc-test-exec/snapshots', show_default=True, help="directory holding volume snapshots")
+@click.option('--liveness-recheck', metavar='<SECONDS>', type=float,
+              help="re-probe services already ready every <SECONDS> instead of never")
+@click.option('--ips-env-file', metavar='<FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="keep <FILE> updated with the <SERVICE>_IP variables of the running services")
+@click.option('--ips-hosts-file', metavar='<FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="keep <FILE> updated with a hosts file entry for each running service")
+@click.option('--max-starting', metavar='<WEIGHT>', type=float,
+              help="limit the summed x-start-weight (or deploy cpus, default 1) of services starting at once")
+@click.option('--history-db', metavar='<SQLITE_FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              default=default_history_path, show_default="~/.cache/dc_test_exec/timings.db",
+              help="startup timings of previous runs, used to schedule readiness probes and print an ETA")
+@click.option('--no-history', is_flag=True, help="do not read or record startup timings")
+@click.option('--one-shot-cache', is_flag=True,
+              help="skip one-shot services whose image, command, environment and inputs match a previous "
+                   "successful run on the same volumes")
+@click.option('--capture-logs', metavar='<LINES>', type=click.IntRange(min=1),
+              help="keep only the last <LINES> log lines of each service in memory and print them when it fails")
+@click.option('--ready-timeout', metavar='<SECONDS>', type=float,
+              help="fail, printing the captured logs of the services not ready, after <SECONDS>")
+@click.option('--watch', is_flag=True,
+              help="keep running and recreate the services whose definition changes, and their dependents")
+@click.option('--tmpfs-data', is_flag=True,
+              help="mount the data volumes of every service as tmpfs, x-ephemeral-volumes: false opts a service out")
+@click.option('--tmpfs-size', metavar='<SIZE>', default='256m', show_default=True,
+              help="size limit of tmpfs data volumes without an explicit size")
+@click.option('--max-parallel-builds', metavar='<BUILDS>', type=click.IntRange(min=1), default=4, show_default=True,
+              help="build images of services with a build section before starting, <BUILDS> at a time")
+@click.option('--run-id', metavar='<RUN_ID>', default=lambda: os.environ.get('DC_RUN_ID', None),
+              show_default="env variable DC_RUN_ID, or derived from the compose file",
+              help="label every container and network of the run with <RUN_ID> so reap can find them")
+def start(file, until, silent, environment, env_file, output, from_snapshot, snapshot_dir, liveness_recheck,
+          ips_env_file, ips_hosts_file, max_starting, history_db, no_history, one_shot_cache, capture_logs,
+          ready_timeout, watch, tmpfs_data, tmpfs_size,
+          max_parallel_builds, run_id):
     """start services without running exec-container"""
     env = {**dict(os.environ), **dict(environment)}
-    TestContainer(abspath(file), env, env_file, silent, click.echo).start(100, 1000, False, until)
+    test_container = TestContainer(abspath(file), env, env_file, silent, click.echo, output=output,
+                                   liveness_recheck_seconds=liveness_recheck, ips_env_file=ips_env_file,
+                                   ips_hosts_file=ips_hosts_file, max_starting=max_starting,
+                                   history_db=None if no_history else history_db,
+                                   one_shot_cache=default_cache_path() if one_shot_cache else None,
+                                   capture_logs=capture_logs, ready_timeout=ready_timeout,
+                                   tmpfs_data=tmpfs_data, tmpfs_size=tmpfs_size,
+                                   max_parallel_builds=max_parallel_builds, run_id=run_id)
+    unknown = test_container.services.get_unknown_services(list(until))
+    if unknown:
+        raise click.ClickException(f'unknown services for --until : {", ".join(unknown)}')
+    if from_snapshot:
+        test_container.restore_snapshot(snapshot_dir)
+    test_container.start(100, 1000, False, list(until) or None)
+    if watch:
+        try:
+            test_container.watch(100, 1000)
+        except KeyboardInterrupt:
+            pass
 
 
 @click.command(name="run")
@@ -52,10 +128,63 @@ def start(file, until, silent, environment, env_file):
               help="stop starting services when <SERVICE_NAME> is started")
 @click.option('--env-file', '-ef', metavar='<ENVIRONMENT_FILE', type=click.types.Path(file_okay=True, dir_okay=False),
               help="sets a environment file variables in format.")
-def run(file, silent, environment, env_file):
+@click.option('--output', '-o', type=click.Choice(['terminal', 'jsonl']), default='terminal', show_default=True,
+              help="status output format: terminal redraws changed lines, jsonl emits one event per status change")
+@click.option('--from-snapshot', is_flag=True,
+              help="restore named volumes from a snapshot and skip one-shot services")
+@click.option('--snapshot-dir', metavar='<SNAPSHOT_DIR>', type=click.types.Path(file_okay=False, dir_okay=True),
+              default='.dc-test-exec/snapshots', show_default=True, help="directory holding volume snapshots")
+@click.option('--liveness-recheck', metavar='<SECONDS>', type=float,
+              help="re-probe services already ready every <SECONDS> instead of never")
+@click.option('--ips-env-file', metavar='<FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="keep <FILE> updated with the <SERVICE>_IP variables of the running services")
+@click.option('--ips-hosts-file', metavar='<FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="keep <FILE> updated with a hosts file entry for each running service")
+@click.option('--collect', '-c', metavar='<CONTAINER_PATH>:<HOST_DIR>', multiple=True, callback=_parse_collect,
+              help="copy <CONTAINER_PATH> to <HOST_DIR> once the container exits")
+@click.option('--max-starting', metavar='<WEIGHT>', type=float,
+              help="limit the summed x-start-weight (or deploy cpus, default 1) of services starting at once")
+@click.option('--history-db', metavar='<SQLITE_FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              default=default_history_path, show_default="~/.cache/dc_test_exec/timings.db",
+              help="startup timings of previous runs, used to schedule readiness probes and print an ETA")
+@click.option('--no-history', is_flag=True, help="do not read or record startup timings")
+@click.option('--one-shot-cache', is_flag=True,
+              help="skip one-shot services whose image, command, environment and inputs match a previous "
+                   "successful run on the same volumes")
+@click.option('--capture-logs', metavar='<LINES>', type=click.IntRange(min=1),
+              help="keep only the last <LINES> log lines of each service in memory and print them when it fails")
+@click.option('--ready-timeout', metavar='<SECONDS>', type=float,
+              help="fail, printing the captured logs of the services not ready, after <SECONDS>")
+@click.option('--stats-file', metavar='<JSON_FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="sample cpu, memory, network and block io of every service while the exec container runs "
+                   "and write the peak and average figures to <JSON_FILE>")
+@click.option('--tmpfs-data', is_flag=True,
+              help="mount the data volumes of every service as tmpfs, x-ephemeral-volumes: false opts a service out")
+@click.option('--tmpfs-size', metavar='<SIZE>', default='256m', show_default=True,
+              help="size limit of tmpfs data volumes without an explicit size")
+@click.option('--max-parallel-builds', metavar='<BUILDS>', type=click.IntRange(min=1), default=4, show_default=True,
+              help="build images of services with a build section before starting, <BUILDS> at a time")
+@click.option('--run-id', metavar='<RUN_ID>', default=lambda: os.environ.get('DC_RUN_ID', None),
+              show_default="env variable DC_RUN_ID, or derived from the compose file",
+              help="label every container and network of the run with <RUN_ID> so reap can find them")
+def run(file, silent, environment, env_file, output, from_snapshot, snapshot_dir, liveness_recheck,
+        ips_env_file, ips_hosts_file, collect, max_starting, history_db, no_history, one_shot_cache, capture_logs,
+        ready_timeout, stats_file, tmpfs_data, tmpfs_size,
+        max_parallel_builds, run_id):
     """start services and run exec container"""
     env = {**dict(os.environ), **dict(environment)}
-    TestContainer(abspath(file), env, env_file, silent, click.echo).start(100, 1000, True)
+    test_container = TestContainer(abspath(file), env, env_file, silent, click.echo, output=output,
+                                   liveness_recheck_seconds=liveness_recheck, ips_env_file=ips_env_file,
+                                   ips_hosts_file=ips_hosts_file, collect=collect, max_starting=max_starting,
+                                   stats_file=stats_file,
+                                   history_db=None if no_history else history_db,
+                                   one_shot_cache=default_cache_path() if one_shot_cache else None,
+                                   capture_logs=capture_logs, ready_timeout=ready_timeout,
+                                   tmpfs_data=tmpfs_data, tmpfs_size=tmpfs_size,
+                                   max_parallel_builds=max_parallel_builds, run_id=run_id)
+    if from_snapshot:
+        test_container.restore_snapshot(snapshot_dir)
+    test_container.start(100, 1000, True)
 
 
 @click.command(name="restart")
@@ -67,10 +196,12 @@ def run(file, silent, environment, env_file):
               help="stop starting services when <SERVICE_NAME> is started")
 @click.option('--env-file', '-ef', metavar='<ENVIRONMENT_FILE', type=click.types.Path(file_okay=True, dir_okay=False),
               help="sets a environment file variables in format.")
-def restart(file, service, environment, env_file):
+@click.option('--cascade', is_flag=True,
+              help="also recreate the services that depend on <SERVICE_NAME>, in dependency order")
+def restart(file, service, environment, env_file, cascade):
     """restart a specific service"""
     env = {**dict(os.environ), **dict(environment)}
-    TestContainer(abspath(file), env, env_file, False, click.echo).restart(service)
+    TestContainer(abspath(file), env, env_file, False, click.echo).restart(service, cascade)
 
 
 @click.command(name="exec-container")
@@ -82,10 +213,20 @@ def restart(file, service, environment, env_file):
 @click.option('--silent', '-s', is_flag=True)
 @click.option('--env-file', '-ef', metavar='<ENVIRONMENT_FILE', type=click.types.Path(file_okay=True, dir_okay=False),
               help="sets a environment file variables in format.")
-def run_exec_container(file, environment, silent, env_file):
+@click.option('--output', '-o', type=click.Choice(['terminal', 'jsonl']), default='terminal', show_default=True,
+              help="status output format: terminal redraws changed lines, jsonl emits one event per status change")
+@click.option('--collect', '-c', metavar='<CONTAINER_PATH>:<HOST_DIR>', multiple=True, callback=_parse_collect,
+              help="copy <CONTAINER_PATH> to <HOST_DIR> once the container exits")
+@click.option('--capture-logs', metavar='<LINES>', type=click.IntRange(min=1),
+              help="keep only the last <LINES> log lines of each service in memory and print them when it fails")
+@click.option('--stats-file', metavar='<JSON_FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="sample cpu, memory, network and block io of every service while the exec container runs "
+                   "and write the peak and average figures to <JSON_FILE>")
+def run_exec_container(file, environment, silent, env_file, output, collect, capture_logs, stats_file):
     """run exec container"""
     env = {**dict(os.environ), **dict(environment)}
-    TestContainer(abspath(file), env, env_file, silent, click.echo).run_exec_container()
+    TestContainer(abspath(file), env, env_file, silent, click.echo, output=output,
+                  collect=collect, capture_logs=capture_logs, stats_file=stats_file).run_exec_container()
 
 
 @click.command(name="one-shot")
@@ -94,15 +235,27 @@ def run_exec_container(file, environment, silent, env_file):
               default=lambda: os.environ.get('DC_FILE', ''), show_default="env variable DC_FILE")
 @click.option('--environment', '-e', metavar='<ENV_VAR_NAME> <ENV_VAR_VALUE>', type=(str, str), multiple=True,
               help="stop starting services when <SERVICE_NAME> is started")
-@click.option('--service', '-s', metavar='<SERVICE_NAME>', required=True,
-              type=click.types.Path(file_okay=True, dir_okay=False), help="docker compose file")
+@click.option('--service', '-s', metavar='<SERVICE_NAME>', required=True, multiple=True,
+              type=str, help="one shot service, independent services given more than once run at the same time")
 @click.option('--silent', '-s', is_flag=True)
 @click.option('--env-file', '-ef', metavar='<ENVIRONMENT_FILE', type=click.types.Path(file_okay=True, dir_okay=False),
               help="sets a environment file variables in format.")
-def run_one_shot_service(file, environment, service, silent, env_file):
+@click.option('--output', '-o', type=click.Choice(['terminal', 'jsonl']), default='terminal', show_default=True,
+              help="status output format: terminal redraws changed lines, jsonl emits one event per status change")
+@click.option('--collect', '-c', metavar='<CONTAINER_PATH>:<HOST_DIR>', multiple=True, callback=_parse_collect,
+              help="copy <CONTAINER_PATH> to <HOST_DIR> once the container exits")
+@click.option('--one-shot-cache', is_flag=True,
+              help="skip one-shot services whose image, command, environment and inputs match a previous "
+                   "successful run on the same volumes")
+@click.option('--capture-logs', metavar='<LINES>', type=click.IntRange(min=1),
+              help="keep only the last <LINES> log lines of each service in memory and print them when it fails")
+def run_one_shot_service(file, environment, service, silent, env_file, output, collect, one_shot_cache,
+                         capture_logs):
     """run one shot service"""
     env = {**dict(os.environ), **dict(environment)}
-    TestContainer(abspath(file), env, env_file, silent, click.echo).run_one_shot_service(service)
+    TestContainer(abspath(file), env, env_file, silent, click.echo, output=output, collect=collect,
+                  one_shot_cache=default_cache_path() if one_shot_cache else None,
+                  capture_logs=capture_logs).run_one_shot_services(service)
 
 
 @click.command(name="clear")
@@ -118,7 +271,76 @@ def clear(file, service, unless, silent):
     """run one shot service"""
     if len(unless) > 0 and len(service) > 0:
         raise ClickException('option service and unless are mutually exclusive')
-    TestContainer(abspath(file), {}, silent, click.echo).clear(service, unless)
+    TestContainer(abspath(file), {}, None, silent, click.echo).clear(service, unless)
+
+
+@click.command(name="snapshot")
+@click.option('--file', '-f', metavar='<DOCKER_COMPOSE_FILE>', required=True,
+              type=click.types.Path(file_okay=True, dir_okay=False), help="docker compose file",
+              default=lambda: os.environ.get('DC_FILE', ''), show_default="env variable DC_FILE")
+@click.option('--environment', '-e', metavar='<ENV_VAR_NAME> <ENV_VAR_VALUE>', type=(str, str), multiple=True,
+              help="sets a environment variables in format <ENV_VAR_NAME> <ENV_VAR_VALUE>.")
+@click.option('--env-file', '-ef', metavar='<ENVIRONMENT_FILE', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="sets a environment file variables in format.")
+@click.option('--snapshot-dir', metavar='<SNAPSHOT_DIR>', type=click.types.Path(file_okay=False, dir_okay=True),
+              default='.dc-test-exec/snapshots', show_default=True, help="directory holding volume snapshots")
+@click.option('--image', is_flag=True, help="commit the snapshot to a local image instead of tar archives")
+def snapshot(file, environment, env_file, snapshot_dir, image):
+    """capture the named volumes of a seeded stack"""
+    env = {**dict(os.environ), **dict(environment)}
+    TestContainer(abspath(file), env, env_file, False, click.echo).snapshot(snapshot_dir, image)
+
+
+@click.command(name="plan")
+@click.option('--file', '-f', metavar='<DOCKER_COMPOSE_FILE>', required=True,
+              type=click.types.Path(file_okay=True, dir_okay=False), help="docker compose file",
+              default=lambda: os.environ.get('DC_FILE', ''), show_default="env variable DC_FILE")
+@click.option('--output', '-o', type=click.Choice(['terminal', 'json']), default='terminal', show_default=True,
+              help="plan output format")
+@click.option('--dot', metavar='<DOT_FILE>', type=click.types.Path(file_okay=True, dir_okay=False),
+              help="write the dependency graph to <DOT_FILE> in Graphviz format")
+@click.option('--max-depth', metavar='<WAVES>', type=click.IntRange(min=1),
+              help="fail when startup needs more than <WAVES> waves")
+def plan(file, output, dot, max_depth):
+    """show startup waves without contacting docker"""
+    services = Services(Path(abspath(file)), BaseContainerService())
+    startup_plan = services.get_plan()
+    if output == 'json':
+        click.echo(json.dumps(startup_plan))
+    else:
+        for line in Services.transform_plan_to_log(startup_plan):
+            click.echo(line)
+    if dot:
+        Path(dot).write_text(services.to_dot(), encoding='utf-8')
+    if max_depth is not None and startup_plan['depth'] > max_depth:
+        click.echo(f'startup needs {startup_plan["depth"]} waves, more than {max_depth}', err=True)
+        sys.exit(1)
+
+
+@click.command(name="reap")
+@click.option('--ttl', metavar='<SECONDS>', type=click.FloatRange(min=0), default=3600, show_default=True,
+              help="remove only containers and networks created more than <SECONDS> ago")
+@click.option('--run-id', metavar='<RUN_ID>', help="remove only what the run labeled <RUN_ID> created")
+@click.option('--force', is_flag=True,
+              help="also remove runs that still have running containers, by default they are left alone")
+@click.option('--output', '-o', type=click.Choice(['terminal', 'json']), default='terminal', show_default=True,
+              help="output format")
+def reap(ttl, run_id, force, output):
+    """remove containers and networks left behind by earlier runs"""
+    docker_client = create_docker_client()
+    try:
+        removed = reap_resources(docker_client, ttl, run_id, force=force)
+    finally:
+        docker_client.close()
+    if output == 'json':
+        click.echo(json.dumps(removed))
+        return
+    for container_name in removed['containers']:
+        click.echo(f'removed container {container_name}')
+    for network_name in removed['networks']:
+        click.echo(f'removed network {network_name}')
+    for active_run_id in removed['active_runs']:
+        click.echo(f'skipped run {active_run_id}, it still has running containers')
 
 
 cli.add_command(status)
@@ -128,6 +350,9 @@ cli.add_command(run)
 cli.add_command(run_exec_container)
 cli.add_command(run_one_shot_service)
 cli.add_command(clear)
+cli.add_command(snapshot)
+cli.add_command(plan)
+cli.add_command(reap)
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,40 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def default_cache_path() -> str:
+    return os.path.join(Path.home(), '.cache', 'dc_test_exec', 'one-shot-cache.json')
+
+
+def hash_paths(paths: list[Path]) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        files = sorted(file for file in Path(path).rglob('*') if file.is_file()) if Path(path).is_dir() else [path]
+        for file in files:
+            digest.update(str(file).encode('utf-8'))
+            with open(file, 'rb') as content:
+                chunk = content.read(65536)
+                while chunk:
+                    digest.update(chunk)
+                    chunk = content.read(65536)
+    return digest.hexdigest()
+
+
+class OneShotCache:
+
+    def __init__(self, cache_path: str):
+        self.cache_path = Path(cache_path)
+        if self.cache_path.exists():
+            self._entries = json.loads(self.cache_path.read_text(encoding='utf-8'))
+        else:
+            self._entries = {}
+
+    def get(self, cache_name: str) -> dict | None:
+        return self._entries.get(cache_name)
+
+    def put(self, cache_name: str, key: str, volumes: dict) -> None:
+        self._entries[cache_name] = {'key': key, 'volumes': volumes}
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_path.write_text(json.dumps(self._entries, indent=2), encoding='utf-8')
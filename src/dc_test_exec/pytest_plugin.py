@@ -0,0 +1,150 @@
+import json
+import os
+from contextlib import contextmanager
+from os.path import abspath
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from dc_test_exec.docker_compose_test_executor import TestContainer
+
+# the plugin is loaded by every pytest session once installed, so it must import on windows too
+try:
+    import fcntl
+    msvcrt = None  # pylint: disable=invalid-name
+except ImportError:
+    fcntl = None
+    import msvcrt  # pylint: disable=import-error
+
+STATE_FILE_NAME = 'dc-test-exec-stack.json'
+LOCK_FILE_NAME = 'dc-test-exec-stack.lock'
+
+
+class Stack:
+
+    def __init__(self, compose_file_path: str, ips: dict):
+        self.compose_file_path = compose_file_path
+        self.ips = ips
+
+    def get_ip(self, service_name: str) -> str | None:
+        return self.ips.get(service_name.upper() + '_IP')
+
+
+class SharedStack:
+
+    def __init__(self, state_dir: Path):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.state_file_path = self.state_dir / STATE_FILE_NAME
+
+    @staticmethod
+    def _lock(lock_file) -> None:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                # LK_LOCK gives up after 10 seconds
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+
+    @staticmethod
+    def _unlock(lock_file) -> None:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextmanager
+    def _locked(self):
+        # both locks are released by the system if the holder dies, so a crashed worker cannot leave the others waiting
+        with open(self.state_dir / LOCK_FILE_NAME, 'w', encoding='utf-8') as lock_file:
+            self._lock(lock_file)
+            try:
+                yield
+            finally:
+                self._unlock(lock_file)
+
+    def _read_state(self) -> dict | None:
+        if not self.state_file_path.exists():
+            return None
+        return json.loads(self.state_file_path.read_text(encoding='utf-8'))
+
+    # pylint: disable=broad-exception-raised
+    def acquire(self, start: Callable[[], dict]) -> dict:
+        with self._locked():
+            state = self._read_state()
+            if state is None:
+                try:
+                    state = {'ips': start()}
+                # a failed start is recorded so the other workers fail at once instead of starting again
+                except SystemExit as error:
+                    state = {'error': f'stack not started, exit code {error.code}'}
+                except Exception as error:  # pylint: disable=broad-exception-caught
+                    state = {'error': f'stack not started, {error}'}
+                self.state_file_path.write_text(json.dumps(state), encoding='utf-8')
+        if 'error' in state:
+            raise Exception(state['error'])
+        return state['ips']
+
+    def release(self, stop: Callable[[], None]) -> bool:
+        with self._locked():
+            if self._read_state() is None:
+                return False
+            # a stack that failed to start may still have some services running
+            stop()
+            self.state_file_path.unlink()
+            return True
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('dc-test-exec')
+    group.addoption('--dc-file', metavar='DOCKER_COMPOSE_FILE', default=os.environ.get('DC_FILE', None),
+                    help="docker compose file of the stack shared by the session, default env variable DC_FILE")
+    group.addoption('--dc-env-file', metavar='ENVIRONMENT_FILE', default=None,
+                    help="environment file of the shared stack")
+    group.addoption('--dc-ready-timeout', metavar='SECONDS', type=float, default=None,
+                    help="fail the tests using the shared stack when it is not ready after SECONDS")
+    group.addoption('--dc-keep-stack', action='store_true', default=False,
+                    help="leave the shared stack running at the end of the session, the next session reuses it")
+
+
+def _get_state_dir(base_temp: Path) -> Path:
+    # xdist gives each worker a directory below the controller's, the controller's is shared by all of them
+    if os.environ.get('PYTEST_XDIST_WORKER'):
+        return base_temp.parent
+    return base_temp
+
+
+def _create_test_container(config) -> TestContainer:
+    return TestContainer(abspath(config.getoption('dc_file')), dict(os.environ), config.getoption('dc_env_file'),
+                         True, print, ready_timeout=config.getoption('dc_ready_timeout'))
+
+
+def _start_stack(config) -> dict:
+    test_container = _create_test_container(config)
+    test_container.start(100, 1000, False)
+    return test_container.services.container_service.get_services_ips()
+
+
+@pytest.fixture(scope='session')
+def dc_stack(request, tmp_path_factory) -> Stack:
+    config = request.config
+    if not config.getoption('dc_file'):
+        pytest.fail('dc_stack needs a docker compose file, set --dc-file or DC_FILE')
+    shared_stack = SharedStack(_get_state_dir(tmp_path_factory.getbasetemp()))
+    return Stack(abspath(config.getoption('dc_file')), shared_stack.acquire(lambda: _start_stack(config)))
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    # xdist workers finish one by one, only the controller knows that none of them uses the stack any more
+    if hasattr(config, 'workerinput') or not config.getoption('dc_file') or config.getoption('dc_keep_stack'):
+        return
+    state_dir = _get_state_dir(config._tmp_path_factory.getbasetemp())  # pylint: disable=protected-access
+    if (state_dir / STATE_FILE_NAME).exists():
+        SharedStack(state_dir).release(lambda: _create_test_container(config).clear_all())
@@ -0,0 +1,98 @@
+import hashlib
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from docker.errors import APIError
+
+LABEL_RUN_ID = 'dc-test-exec.run-id'
+
+
+def get_default_run_id(compose_file_path: str, project_name: str) -> str:
+    # stable across the commands of one stack: a label that changes would make compose recreate the containers
+    return hashlib.sha256(f'{project_name}:{compose_file_path}'.encode('utf-8')).hexdigest()[:12]
+
+
+def get_run_labels(run_id: str) -> dict:
+    return {LABEL_RUN_ID: run_id}
+
+
+def _merge_labels(labels, run_labels: dict):
+    if isinstance(labels, list):
+        return labels + [f'{key}={value}' for key, value in run_labels.items()]
+    return {**(labels or {}), **run_labels}
+
+
+def apply_run_labels(compose_file: dict, run_labels: dict) -> None:
+    for service in compose_file['services'].values():
+        service['labels'] = _merge_labels(service.get('labels'), run_labels)
+    networks = compose_file.get('networks') or {}
+    # compose creates the default network even when the file does not declare it
+    networks.setdefault('default', None)
+    for network_name, network in networks.items():
+        network = network or {}
+        if not network.get('external'):
+            network['labels'] = _merge_labels(network.get('labels'), run_labels)
+        networks[network_name] = network
+    compose_file['networks'] = networks
+
+
+def get_created_seconds(created) -> float:
+    if isinstance(created, (int, float)):
+        return float(created)
+    # networks report an RFC 3339 time with nanoseconds, fromisoformat takes at most microseconds
+    created = re.sub(r'(\.\d{6})\d+', r'\1', created).replace('Z', '+00:00')
+    return datetime.fromisoformat(created).timestamp()
+
+
+def _remove_container(container) -> bool:
+    try:
+        container.remove(force=True)
+        return True
+    except APIError:
+        # gone already or removed by a concurrent reaper
+        return False
+
+
+def _remove_network(network) -> bool:
+    try:
+        network.remove()
+        return True
+    except APIError:
+        # gone already, removed by a concurrent reaper or still used by a container outside the run
+        return False
+
+
+def _get_run_id(resource) -> str | None:
+    return (resource.attrs.get('Labels') or {}).get(LABEL_RUN_ID)
+
+
+def _get_active_run_ids(containers: list) -> set:
+    return {_get_run_id(container) for container in containers if container.attrs.get('State') == 'running'}
+
+
+def _is_expired(resource, now: float, ttl_seconds: float, active_run_ids: set) -> bool:
+    return (_get_run_id(resource) not in active_run_ids and
+            now - get_created_seconds(resource.attrs['Created']) >= ttl_seconds)
+
+
+def reap(docker_client, ttl_seconds: float, run_id: str = None, max_workers: int = 8, force: bool = False) -> dict:
+    filters = {'label': [f'{LABEL_RUN_ID}={run_id}' if run_id else LABEL_RUN_ID]}
+    now = time.time()
+    # sparse listing is a single call, a full listing inspects every container
+    all_containers = docker_client.containers.list(all=True, sparse=True, filters=filters)
+    # run ids are stable per stack, so age alone would also take a stack some job is still using
+    active_run_ids = set() if force else _get_active_run_ids(all_containers)
+    containers = [container for container in all_containers
+                  if _is_expired(container, now, ttl_seconds, active_run_ids)]
+    networks = [network for network in docker_client.networks.list(filters=filters)
+                if _is_expired(network, now, ttl_seconds, active_run_ids)]
+    result = {'containers': [], 'networks': [], 'active_runs': sorted(active_run_ids)}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # networks can only go once the containers attached to them are gone
+        result['containers'] = [container.attrs['Names'][0].lstrip('/') for container, removed
+                                in zip(containers, executor.map(_remove_container, containers)) if removed]
+        result['networks'] = [network.attrs['Name'] for network, removed
+                              in zip(networks, executor.map(_remove_network, networks)) if removed]
+    return result
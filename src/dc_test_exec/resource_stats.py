@@ -0,0 +1,139 @@
+import threading
+import time
+
+from docker.errors import DockerException
+
+METRICS = ['cpu_percent', 'memory_bytes', 'network_bytes_per_second', 'block_io_bytes_per_second']
+
+
+def get_cpu_percent(stats: dict) -> float:
+    cpu_stats = stats.get('cpu_stats') or {}
+    precpu_stats = stats.get('precpu_stats') or {}
+    cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - \
+        precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or [1])
+    return cpu_delta / system_delta * online_cpus * 100
+
+
+def get_memory_bytes(stats: dict) -> int:
+    memory_stats = stats.get('memory_stats') or {}
+    # same as docker stats: page cache can be reclaimed, so it is not counted as used
+    cache = memory_stats.get('stats', {}).get('inactive_file', memory_stats.get('stats', {}).get('cache', 0))
+    return max(memory_stats.get('usage', 0) - cache, 0)
+
+
+def get_network_bytes(stats: dict) -> int:
+    return sum(network.get('rx_bytes', 0) + network.get('tx_bytes', 0)
+               for network in (stats.get('networks') or {}).values())
+
+
+def get_block_io_bytes(stats: dict) -> int:
+    entries = (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+    return sum(entry.get('value', 0) for entry in entries if entry.get('op', '').lower() in ['read', 'write'])
+
+
+class ServiceResourceStats:
+
+    def __init__(self):
+        self.samples = 0
+        self.peak = {metric: 0.0 for metric in METRICS}
+        self.total = {metric: 0.0 for metric in METRICS}
+        self._last_counters = None
+
+    def add(self, stats: dict, received_at: float) -> None:
+        values = {
+            'cpu_percent': get_cpu_percent(stats),
+            'memory_bytes': get_memory_bytes(stats)
+        }
+        counters = (received_at, get_network_bytes(stats), get_block_io_bytes(stats))
+        if self._last_counters is not None and counters[0] > self._last_counters[0]:
+            elapsed = counters[0] - self._last_counters[0]
+            values['network_bytes_per_second'] = max(counters[1] - self._last_counters[1], 0) / elapsed
+            values['block_io_bytes_per_second'] = max(counters[2] - self._last_counters[2], 0) / elapsed
+        self._last_counters = counters
+        self.samples += 1
+        for metric, value in values.items():
+            self.peak[metric] = max(self.peak[metric], value)
+            self.total[metric] += value
+
+    def summary(self) -> dict:
+        result = {'samples': self.samples}
+        for metric in METRICS:
+            # rates need two samples, so they have one sample less to average over
+            samples = self.samples if metric in ['cpu_percent', 'memory_bytes'] else self.samples - 1
+            result[metric] = {'peak': round(self.peak[metric], 2),
+                              'avg': round(self.total[metric] / samples, 2) if samples > 0 else 0.0}
+        return result
+
+
+class ResourceSampler:
+
+    def __init__(self):
+        self.stats = {}
+        self._stop = threading.Event()
+        self._threads = []
+        self._streams = []
+
+    def sample(self, service_name: str, container) -> None:
+        self.stats[service_name] = ServiceResourceStats()
+        try:
+            stream = container.stats(stream=True, decode=True)
+        except (DockerException, OSError):
+            return
+        self._streams.append(stream)
+        thread = threading.Thread(target=self._pump, args=(stream, self.stats[service_name]), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _pump(self, stream, service_stats: ServiceResourceStats) -> None:
+        try:
+            for stats in stream:
+                if self._stop.is_set():
+                    break
+                service_stats.add(stats, time.time())
+        except (DockerException, OSError):
+            pass
+        finally:
+            self._close(stream)
+
+    @staticmethod
+    def _close(stream) -> None:
+        try:
+            stream.close()
+        except ValueError:
+            # the pump is waiting for the next sample, it closes the stream itself once that arrives
+            pass
+
+    def stop(self, timeout_seconds: float = 2) -> dict:
+        self._stop.set()
+        # a stream left open keeps its connection of the docker client pool busy
+        for stream in self._streams:
+            self._close(stream)
+        for thread in self._threads:
+            thread.join(timeout_seconds)
+        return {service_name: service_stats.summary() for service_name, service_stats in self.stats.items()}
+
+
+def transform_resource_stats_to_log(summary: dict) -> list[str]:
+    result = ['resource usage (peak / avg) :']
+    for service_name, service_stats in summary.items():
+        result.append(f'  {service_name} : '
+                      f'cpu {service_stats["cpu_percent"]["peak"]}% / {service_stats["cpu_percent"]["avg"]}%, '
+                      f'memory {_format_bytes(service_stats["memory_bytes"]["peak"])} / '
+                      f'{_format_bytes(service_stats["memory_bytes"]["avg"])}, '
+                      f'network {_format_bytes(service_stats["network_bytes_per_second"]["peak"])}/s / '
+                      f'{_format_bytes(service_stats["network_bytes_per_second"]["avg"])}/s, '
+                      f'block io {_format_bytes(service_stats["block_io_bytes_per_second"]["peak"])}/s / '
+                      f'{_format_bytes(service_stats["block_io_bytes_per_second"]["avg"])}/s')
+    return result
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ['B', 'KiB', 'MiB']:
+        if value < 1024:
+            return f'{round(value, 1)}{unit}'
+        value /= 1024
+    return f'{round(value, 1)}GiB'
@@ -0,0 +1,163 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import yaml
+
+from dc_test_exec.docker_client import create_docker_client
+from dc_test_exec.docker_compose_test_executor import TestContainer
+
+
+def write_stack_compose_file(compose_file_path: Path, stack_dir: Path, stack_suffix: str) -> Path:
+    compose_file = yaml.safe_load(compose_file_path.read_text(encoding='utf-8'))
+    # creators run compose on /opt/docker-compose.yml, so the default project name is opt for every stack
+    compose_file['name'] = f'{compose_file.get("name", "opt")}{stack_suffix}'
+    for service_name, service in compose_file['services'].items():
+        if 'container_name' in service:
+            service['container_name'] = f'{service_name}{stack_suffix}'
+        # published host ports would collide between stacks, dependents reach services by ip
+        service.pop('ports', None)
+    # compose does not prefix explicit names with the project, so every stack would share the same volume or network.
+    # external ones are created outside of the stack and are meant to be shared
+    for section in ['volumes', 'networks']:
+        for resource in (compose_file.get(section) or {}).values():
+            if resource and 'name' in resource and not resource.get('external'):
+                resource['name'] = f'{resource["name"]}{stack_suffix}'
+    stack_dir.mkdir(parents=True, exist_ok=True)
+    stack_compose_file_path = stack_dir / 'docker-compose.yml'
+    stack_compose_file_path.write_text(yaml.safe_dump(compose_file, sort_keys=False), encoding='utf-8')
+    return stack_compose_file_path
+
+
+class StackLease:
+
+    def __init__(self, pool, index: int, test_container: TestContainer):
+        self.pool = pool
+        self.index = index
+        self.test_container = test_container
+        self.environment = test_container.services.container_service.get_services_ips()
+
+    def release(self) -> None:
+        self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+# pylint: disable=too-many-instance-attributes
+class StackPool:
+
+    def __init__(self, compose_file_path: str, size: int, work_dir: str, **kwargs):
+        self.compose_file_path = Path(compose_file_path)
+        self.size = size
+        self.work_dir = Path(work_dir)
+        self.environment = kwargs.get('environment', {})
+        self.env_file = kwargs.get('env_file', None)
+        self.reset_hook: Callable[[TestContainer], bool] | None = kwargs.get('reset_hook', None)
+        self.print_function = kwargs.get('print_function', print)
+        self.test_container_options = kwargs.get('test_container_options', {})
+        self.docker_client = kwargs.get('docker_client', None)
+        self.max_warm_attempts = kwargs.get('max_warm_attempts', 3)
+        self.stacks = {}
+        self.failures = {}
+        self.errors = {}
+        self._given_up = set()
+        self._ready = queue.Queue()
+        self._leased = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size)
+
+    def _get_docker_client(self):
+        with self._lock:
+            if self.docker_client is None:
+                service_count = len(yaml.safe_load(self.compose_file_path.read_text(encoding='utf-8'))['services'])
+                self.docker_client = create_docker_client(service_count * self.size)
+            return self.docker_client
+
+    def _create_stack(self, index: int) -> TestContainer:
+        stack_suffix = f'-stack{index}'
+        stack_compose_file_path = write_stack_compose_file(self.compose_file_path,
+                                                           self.work_dir / f'stack{index}', stack_suffix)
+        return TestContainer(str(stack_compose_file_path), self.environment, self.env_file, True,
+                             self.print_function, stack_suffix=stack_suffix, docker_client=self._get_docker_client(),
+                             **self.test_container_options)
+
+    def start(self) -> None:
+        for index in range(self.size):
+            self._executor.submit(self._warm, index)
+
+    def _warm(self, index: int, attempt: int = 1) -> None:
+        try:
+            if index not in self.stacks:
+                self.stacks[index] = self._create_stack(index)
+            self.stacks[index].start(100, 1000, False)
+        # raised in an executor thread, an error nobody catches here is lost in a future no one waits on
+        except (Exception, SystemExit) as error:  # pylint: disable=broad-exception-caught
+            self.failures[index] = self.failures.get(index, 0) + 1
+            self.errors[index] = error
+            self._clear_stack(index)
+            if attempt < self.max_warm_attempts:
+                # a stack that did not become ready in time is replaced instead of leased
+                self._executor.submit(self._warm, index, attempt + 1)
+            else:
+                self._give_up(index)
+            return
+        self._ready.put(index)
+
+    def _clear_stack(self, index: int) -> None:
+        if index not in self.stacks:
+            return
+        try:
+            self.stacks[index].clear_all()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # the next attempt starts from whatever is left
+            pass
+
+    def _give_up(self, index: int) -> None:
+        with self._lock:
+            self._given_up.add(index)
+            all_given_up = len(self._given_up) == self.size
+        if all_given_up:
+            # wakes the lease callers up, each puts it back for the next one
+            self._ready.put(None)
+
+    # pylint: disable=broad-exception-raised
+    def lease(self, timeout_seconds: float = None) -> StackLease:
+        index = self._ready.get(timeout=timeout_seconds)
+        if index is None:
+            self._ready.put(None)
+            raise Exception('no stack of the pool could be started: ' + ', '.join(
+                f'stack{failed_index} {type(error).__name__} {error}'
+                for failed_index, error in sorted(self.errors.items())))
+        with self._lock:
+            self._leased.add(index)
+        return StackLease(self, index, self.stacks[index])
+
+    def release(self, lease: StackLease) -> None:
+        with self._lock:
+            if lease.index not in self._leased:
+                return
+            self._leased.remove(lease.index)
+        self._executor.submit(self._recycle, lease.index)
+
+    def _recycle(self, index: int) -> None:
+        if self.reset_hook and self.reset_hook(self.stacks[index]):
+            self._ready.put(index)
+            return
+        self._clear_stack(index)
+        self._warm(index)
+
+    def ready_count(self) -> int:
+        return self._ready.qsize()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for test_container in self.stacks.values():
+            test_container.clear_all()
+        if self.docker_client is not None:
+            self.docker_client.close()
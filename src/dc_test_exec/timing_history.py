@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+
+def default_history_path() -> str:
+    return os.path.join(Path.home(), '.cache', 'dc_test_exec', 'timings.db')
+
+
+class TimingHistory:
+
+    def __init__(self, db_path: str, samples: int = 5):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.samples = samples
+        self.connection.execute('CREATE TABLE IF NOT EXISTS service_timings ('
+                                'service TEXT NOT NULL, '
+                                'image_digest TEXT NOT NULL, '
+                                'to_running REAL NOT NULL, '
+                                'to_ready REAL NOT NULL, '
+                                'recorded_at REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS service_timings_key '
+                                'ON service_timings (service, image_digest, recorded_at)')
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record(self, service_name: str, image_digest: str, to_running: float, to_ready: float) -> None:
+        self.connection.execute('INSERT INTO service_timings VALUES (?, ?, ?, ?, ?)',
+                                (service_name, image_digest, to_running, to_ready, time.time()))
+        self.connection.commit()
+
+    def get_expected(self, service_name: str, image_digest: str) -> dict | None:
+        row = self.connection.execute('SELECT AVG(to_running), AVG(to_ready), COUNT(*) FROM ('
+                                      'SELECT to_running, to_ready FROM service_timings '
+                                      'WHERE service = ? AND image_digest = ? '
+                                      'ORDER BY recorded_at DESC LIMIT ?)',
+                                      (service_name, image_digest, self.samples)).fetchone()
+        if row[2] == 0:
+            return None
+        return {'to_running': row[0], 'to_ready': row[1]}
@@ -1,20 +1,53 @@
+import copy
+import importlib.util
+import io
+import json
 import os.path
+import queue
+import sys
+import tarfile
+import tempfile
 import threading
 import unittest
 import time
+import types
+import unittest.mock
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
 
+import click
 import yaml
-
-from dc_test_exec.docker_compose_test_executor import ServiceStatus, BaseContainerService, ContainerService, \
+from docker.errors import APIError, NotFound
+
+from dc_test_exec.docker_client import get_pool_size
+from dc_test_exec.ephemeral_volumes import apply_ephemeral_volumes, parse_df_output
+from dc_test_exec.file_watcher import FileWatcher
+from dc_test_exec.image_builds import get_build_spec, get_build_tag, get_build_command
+from dc_test_exec.docker_compose_test_executor import ServiceStatus, BaseContainerService, BaseReadinessCheck, \
+    ContainerService, \
     check, \
-    HttpReadinessCheck, Services
+    HttpReadinessCheck, HealthReadinessCheck, read_env_file, Services, TerminalStatusPresenter, \
+    JsonLinesStatusPresenter, ServiceIpRegistry, \
+    extract_archive
+from dc_test_exec.log_capture import LogRingBuffer, LogCapture
+from dc_test_exec.one_shot_cache import OneShotCache, hash_paths
+from dc_test_exec.pytest_plugin import SharedStack, Stack
+from dc_test_exec.reaper import apply_run_labels, get_run_labels, get_default_run_id, get_created_seconds, \
+    reap, LABEL_RUN_ID
+from dc_test_exec.stack_pool import StackPool, write_stack_compose_file
+from dc_test_exec.resource_stats import ServiceResourceStats, ResourceSampler
+from dc_test_exec.timing_history import TimingHistory
 
 docker_compose_test_exec_container_path = \
     Path(os.path.join(Path(__file__).parent, 'resources/docker_compose_test_exec_container.yml'))
 docker_compose_test_exec_container_script_path = \
     Path(os.path.join(Path(__file__).parent, 'resources/docker_compose_test_exec_script.yml'))
+docker_compose_graph_path = \
+    Path(os.path.join(Path(__file__).parent, 'resources/docker_compose_graph.yml'))
+docker_compose_one_shot_path = \
+    Path(os.path.join(Path(__file__).parent, 'resources/docker_compose_one_shot.yml'))
+docker_compose_conditions_path = \
+    Path(os.path.join(Path(__file__).parent, 'resources/docker_compose_conditions.yml'))
 
 if 'HOST_PROJECT_HOME' in os.environ:
     docker_compose_test_exec_container_path_host = \
@@ -32,13 +65,100 @@ class MockContainerService(BaseContainerService):
 
     def __init__(self, status: dict):
         self.status = status
+        self.started = []
 
     def get_service_status(self, service_name) -> ServiceStatus:
         return self.status[service_name]
 
     def start_service(self, service_name: str) -> None:
+        self.started.append(service_name)
         self.status[service_name] = ServiceStatus.NOT_READY
 
+    def restore_snapshot(self, snapshot_dir: Path) -> bool:
+        return snapshot_dir.name == 'existing'
+
+    def get_image_digest(self, service_name: str) -> str | None:
+        return f'sha256:{service_name}'
+
+
+class RecordingContainerService(MockContainerService):
+
+    def __init__(self, status: dict):
+        super().__init__(status)
+        self.cleared = []
+
+    def start_service(self, service_name: str) -> None:
+        self.started.append(service_name)
+        self.status[service_name] = ServiceStatus.READY
+
+    def clear(self, service_name: str) -> None:
+        self.cleared.append(service_name)
+        self.status[service_name] = ServiceStatus.NOT_STARTED
+
+
+class CountingContainerService(MockContainerService):
+
+    def __init__(self, status: dict):
+        super().__init__(status)
+        self.calls = {}
+
+    def get_service_status(self, service_name) -> ServiceStatus:
+        self.calls[service_name] = self.calls.get(service_name, 0) + 1
+        return super().get_service_status(service_name)
+
+
+class PullingContainerService(MockContainerService):
+
+    def __init__(self, status: dict):
+        super().__init__(status)
+        self.digests = {}
+
+    def get_image_digest(self, service_name: str) -> str | None:
+        return self.digests.get(service_name)
+
+
+class OneShotContainerService(MockContainerService):
+
+    def __init__(self, status: dict, exit_codes: dict = None, cached: list = None):
+        super().__init__(status)
+        self.exit_codes = exit_codes or {}
+        self.cached = cached or []
+        self.runs = []
+        self.buffered_logs = []
+        self.lock = threading.Lock()
+
+    def start_service(self, service_name: str) -> None:
+        self.started.append(service_name)
+        self.status[service_name] = ServiceStatus.READY
+
+    def run_one_shot_service(self, one_shot_service_name, collect=None, buffer_logs=False):
+        with self.lock:
+            self.runs.append(one_shot_service_name)
+            self.buffered_logs.append(buffer_logs)
+        return self.exit_codes.get(one_shot_service_name, 0)
+
+    def is_one_shot_cached(self, service_name: str) -> bool:
+        return service_name in self.cached
+
+    def cache_one_shot(self, service_name: str) -> None:
+        self.cached.append(service_name)
+
+
+class FlakyContainerService(MockContainerService):
+
+    def __init__(self, status: dict):
+        super().__init__(status)
+        self.retried = []
+
+    def start_service(self, service_name: str) -> None:
+        self.started.append(service_name)
+
+    def get_failed_starts(self) -> set[str]:
+        return set(self.started)
+
+    def retry_service(self, service_name: str) -> None:
+        self.retried.append(service_name)
+
 
 class ServicesTestCase(unittest.TestCase):
 
@@ -304,6 +424,153 @@ class ServicesTestCase(unittest.TestCase):
 
         self.assertFalse(services.start_all_available_services('service-a'))
 
+    def test_start_ready_timeout(self):
+        status = {
+            'db': ServiceStatus.NOT_READY,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        services = Services(docker_compose_graph_path, MockContainerService(status), ready_timeout=0.05)
+
+        self.assertFalse(services.start(10, 1000, lambda _: None))
+        self.assertEqual(['db'], services.get_failed_services())
+
+    def test_start_all_available_services_retries_failed_start(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.READY
+        }
+        container_service = FlakyContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+
+        for _ in range(4):
+            services.start_all_available_services()
+
+        self.assertEqual(['cache'], container_service.started)
+        self.assertEqual(['cache', 'cache'], container_service.retried)
+        self.assertEqual(['cache'], services.get_failed_services())
+
+    def test_start_all_available_services_does_not_retry_without_policy(self):
+        status = {
+            'db': ServiceStatus.NOT_STARTED,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        container_service = FlakyContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+
+        services.start_all_available_services()
+        services.start_all_available_services()
+
+        self.assertEqual(['db'], container_service.started)
+        self.assertEqual([], container_service.retried)
+        self.assertEqual({'db'}, services.given_up_services)
+
+    def test_start_ends_when_retries_run_out(self):
+        status = {
+            'db': ServiceStatus.NOT_STARTED,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        container_service = FlakyContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+        result = []
+        starter = threading.Thread(target=lambda: result.append(services.start(1, 1000, lambda _: None)),
+                                   daemon=True)
+
+        starter.start()
+        starter.join(2)
+
+        self.assertFalse(starter.is_alive())
+        self.assertEqual([False], result)
+        self.assertEqual(['db'], services.get_failed_services())
+
+    def test_start_retries_failed_start_with_max_starting(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.READY
+        }
+        container_service = FlakyContainerService(status)
+        services = Services(docker_compose_graph_path, container_service, max_starting=2, ready_timeout=2)
+
+        self.assertFalse(services.start(1, 1000, lambda _: None))
+        self.assertEqual(['cache', 'cache'], container_service.retried)
+        self.assertEqual({'cache'}, services.given_up_services)
+
+    def test_get_plan(self):
+        services = Services(docker_compose_conditions_path, BaseContainerService())
+
+        self.assertEqual({
+            'waves': [['db'], ['migration', 'proxy'], ['api']],
+            'depth': 3,
+            'max_parallelism': 2,
+            'one_shot_services': ['migration'],
+            'exec_services': ['exec-container']
+        }, services.get_plan())
+
+    def test_get_startup_waves_dependency_cycle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({'services': {'a': {'depends_on': ['b']},
+                                                                      'b': {'depends_on': ['a']}}}))
+            services = Services(compose_file_path, BaseContainerService())
+
+            with self.assertRaises(click.ClickException) as context:
+                services.get_startup_waves()
+            self.assertEqual('dependency cycle : a -> b -> a', context.exception.message)
+
+    def test_to_dot(self):
+        dot = Services(docker_compose_conditions_path, BaseContainerService()).to_dot()
+
+        self.assertIn('"migration" [shape=box];', dot)
+        self.assertIn('"exec-container" [shape=doublecircle];', dot)
+        self.assertIn('"migration" -> "api" [label="service_completed_successfully"];', dot)
+
+    def test_start_all_available_services_until_starts_only_dependency_closure(self):
+        status = {
+            'db': ServiceStatus.NOT_STARTED,
+            'cache': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        container_service = RecordingContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+
+        self.assertTrue(services.start(1, 1000, lambda _: None, ['worker']))
+        self.assertEqual(['db', 'worker'], container_service.started)
+        self.assertIsNone(services.scheduled_services)
+
+    def test_start_unknown_until_service(self):
+        services = Services(docker_compose_test_exec_container_path, RecordingContainerService({}))
+
+        with self.assertRaisesRegex(Exception, 'unknown services to start until : missing, exec-container'):
+            services.start(1, 1000, lambda _: None, ['missing', 'exec-container'])
+
+    def test_start_all_available_services_until_several_targets(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.READY
+        }
+        services = Services(docker_compose_graph_path, MockContainerService(status))
+        services.scheduled_services = services.get_dependencies_closure(['worker', 'api'])
+
+        self.assertTrue(services.start_all_available_services(['worker', 'api']))
+        self.assertEqual(['cache'], services.container_service.started)
+
+    def test_get_dependencies_closure(self):
+        services = Services(docker_compose_graph_path, MockContainerService({}))
+
+        self.assertEqual(['api', 'worker', 'db', 'cache'], services.get_dependencies_closure(['api', 'worker']))
+
     def test_transform_status_to_log(self):
         status = {
             'service-a': {
@@ -323,6 +590,649 @@ class ServicesTestCase(unittest.TestCase):
             '    -> service-a : READY'
         ], Services.transform_status_to_log(status))
 
+    def test_get_critical_path_report(self):
+        services = Services(docker_compose_graph_path, MockContainerService({}))
+        services.start_time = 100
+        services.timeline = {
+            'db': {'started': 100, 'running': 101, 'ready': 105},
+            'cache': {'started': 100, 'running': 101, 'ready': 102},
+            'api': {'started': 105, 'running': 106, 'ready': 109},
+            'worker': {'started': 105, 'running': 105.5, 'ready': 106}
+        }
+
+        self.assertEqual({
+            'total_seconds': 9,
+            'critical_path': [
+                {'service': 'db', 'time_to_running': 1, 'time_to_ready': 5},
+                {'service': 'api', 'time_to_running': 1, 'time_to_ready': 4}
+            ],
+            'slack': {'cache': 3, 'worker': 3},
+            'waited_on_sibling': [{'service': 'cache', 'dependent': 'api', 'waited_for': 'db', 'seconds': 3}]
+        }, services.get_critical_path_report())
+
+    def test_restore_snapshot_skips_one_shot_services(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'seed': ServiceStatus.NOT_STARTED,
+            'seed-search': ServiceStatus.NOT_STARTED,
+            'verify': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED
+        }
+        services = Services(docker_compose_one_shot_path, MockContainerService(status))
+
+        self.assertTrue(services.restore_snapshot(Path('existing')))
+        self.assertEqual(['api'], services.get_services_ready_to_start())
+
+    def test_restore_snapshot_missing(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'seed': ServiceStatus.NOT_STARTED,
+            'seed-search': ServiceStatus.NOT_STARTED,
+            'verify': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED
+        }
+        services = Services(docker_compose_one_shot_path, MockContainerService(status))
+
+        self.assertFalse(services.restore_snapshot(Path('missing')))
+        self.assertEqual(['seed', 'seed-search'], services.get_services_ready_to_start())
+
+    def test_start_all_available_services_checks_each_service_once(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        container_service = CountingContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+
+        self.assertTrue(services.start_all_available_services())
+        self.assertEqual({'db': 1, 'cache': 1, 'api': 1, 'worker': 1}, container_service.calls)
+
+    def test_get_start_weight(self):
+        services = Services(docker_compose_graph_path, MockContainerService({}))
+
+        self.assertEqual([2.0, 1.0, 0.5], [services.get_start_weight(service_name)
+                                           for service_name in ['db', 'cache', 'worker']])
+
+    def test_start_all_available_services_max_starting(self):
+        status = {
+            'db': ServiceStatus.NOT_STARTED,
+            'cache': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        container_service = MockContainerService(status)
+        services = Services(docker_compose_graph_path, container_service, max_starting=2)
+
+        self.assertTrue(services.start_all_available_services())
+        self.assertEqual(['db'], container_service.started)
+
+        self.assertTrue(services.start_all_available_services())
+        self.assertEqual(['db'], container_service.started)
+
+        status['db'] = ServiceStatus.READY
+        self.assertTrue(services.start_all_available_services())
+        self.assertEqual(['db', 'cache', 'worker'], container_service.started)
+
+    def test_get_start_priorities(self):
+        services = Services(docker_compose_conditions_path, MockContainerService({}))
+
+        self.assertEqual({'db': 3.0, 'migration': 2.0, 'proxy': 2.0, 'api': 1.0}, services.get_start_priorities())
+
+    def test_get_start_priorities_computed_once(self):
+        services = Services(docker_compose_conditions_path, MockContainerService({}))
+        priorities = services.get_start_priorities()
+        services.get_expected_start_seconds = lambda service_name: 10.0
+
+        self.assertIs(priorities, services.get_start_priorities())
+
+    def test_get_start_priorities_dependency_cycle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({'services': {'a': {'depends_on': ['b']},
+                                                                      'b': {'depends_on': ['a']}}}))
+            services = Services(compose_file_path, BaseContainerService())
+
+            with self.assertRaisesRegex(click.ClickException, 'dependency cycle : a -> b -> a'):
+                services.get_start_priorities()
+
+    def test_get_services_ready_to_start_longest_chain_first(self):
+        status = {
+            'db': ServiceStatus.NOT_STARTED,
+            'cache': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED,
+            'worker': ServiceStatus.NOT_STARTED
+        }
+        services = Services(docker_compose_graph_path, MockContainerService(status))
+        self.assertEqual(['db', 'cache'], services.get_services_ready_to_start())
+
+        compose_file = copy.deepcopy(services.compose_file)
+        compose_file['services']['cache']['x-expected-start-seconds'] = 5
+        services.reload(compose_file)
+        self.assertEqual(['cache', 'db'], services.get_services_ready_to_start())
+
+    def test_get_dependency_conditions(self):
+        services = Services(docker_compose_conditions_path, MockContainerService({}))
+
+        self.assertEqual({'service-a': None},
+                         Services(docker_compose_test_exec_container_path,
+                                  MockContainerService({})).get_dependency_conditions('service-b'))
+        self.assertEqual({'migration': 'service_completed_successfully', 'proxy': 'service_started'},
+                         services.get_dependency_conditions('api'))
+
+    def test_get_services_ready_to_start_honors_conditions(self):
+        status = {
+            'db': ServiceStatus.NOT_READY,
+            'migration': ServiceStatus.NOT_STARTED,
+            'proxy': ServiceStatus.NOT_STARTED,
+            'api': ServiceStatus.NOT_STARTED
+        }
+        services = Services(docker_compose_conditions_path, MockContainerService(status))
+
+        self.assertEqual(['proxy'], services.get_services_ready_to_start())
+
+        status.update({'db': ServiceStatus.READY, 'migration': ServiceStatus.EXECUTED_ERROR,
+                       'proxy': ServiceStatus.NOT_READY})
+        self.assertEqual([], services.get_services_ready_to_start())
+
+        status['migration'] = ServiceStatus.EXECUTED_SUCCESSFULLY
+        self.assertEqual(['api'], services.get_services_ready_to_start())
+
+    def test_get_dependents_closure(self):
+        services = Services(docker_compose_graph_path, MockContainerService({}))
+
+        self.assertEqual(['db', 'api', 'worker'], services.get_dependents_closure('db'))
+        self.assertEqual(['cache', 'api'], services.get_dependents_closure('cache'))
+
+    def test_restart_cascade(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.READY,
+            'worker': ServiceStatus.READY
+        }
+        container_service = RecordingContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+
+        self.assertIsNone(services.restart_cascade('db', 0, 0, lambda status: None))
+        self.assertEqual(['api', 'db', 'worker'], sorted(container_service.cleared))
+        self.assertEqual('db', container_service.started[0])
+        self.assertEqual(['api', 'db', 'worker'], sorted(container_service.started))
+        self.assertIsNone(services.scheduled_services)
+
+    def test_recreate_changed_services(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.READY,
+            'worker': ServiceStatus.READY
+        }
+        container_service = RecordingContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+        compose_file = yaml.safe_load(docker_compose_graph_path.read_text())
+        compose_file['services']['cache']['image'] = 'redis:7.2'
+        compose_file['services']['worker']['environment'] = {'DB_URL': '${DB_URL}'}
+
+        self.assertEqual(['cache', 'worker'], services.get_changed_services(compose_file))
+        services.reload(compose_file)
+        self.assertEqual(['worker'], services.get_services_using_variables(['DB_URL']))
+        self.assertEqual([], services.get_services_using_variables(['DB']))
+
+        self.assertEqual(['cache', 'api'], services.recreate(['cache'], 0, 0, lambda status: None))
+        self.assertEqual(['api', 'cache'], sorted(container_service.cleared))
+        self.assertIsNone(services.scheduled_services)
+
+    def test_apply_compose_file_recreates_dependents(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'cache': ServiceStatus.READY,
+            'api': ServiceStatus.READY,
+            'worker': ServiceStatus.READY
+        }
+        container_service = RecordingContainerService(status)
+        services = Services(docker_compose_graph_path, container_service)
+        compose_file = yaml.safe_load(docker_compose_graph_path.read_text())
+        compose_file['services']['db']['image'] = 'postgres:16'
+
+        recreated, removed = services.apply_compose_file(compose_file, [], 0, 0, lambda status: None)
+        self.assertEqual(['db', 'api', 'worker'], recreated)
+        self.assertEqual([], removed)
+
+    def test_apply_compose_file_recreates_dependents_of_removed_service(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file = {'services': {'db': {'image': 'postgres:15'},
+                                         'proxy': {'image': 'nginx:latest', 'depends_on': ['db']},
+                                         'web': {'image': 'nginx:latest', 'depends_on': ['proxy']}}}
+            compose_file_path.write_text(yaml.safe_dump(compose_file), encoding='utf-8')
+            container_service = RecordingContainerService({service_name: ServiceStatus.READY
+                                                           for service_name in compose_file['services']})
+            services = Services(compose_file_path, container_service)
+            reloaded = copy.deepcopy(compose_file)
+            del reloaded['services']['db']
+            reloaded['services']['proxy'].pop('depends_on')
+
+            recreated, removed = services.apply_compose_file(reloaded, [], 0, 0, lambda status: None)
+            self.assertEqual(['proxy', 'web'], recreated)
+            self.assertEqual(['db'], removed)
+            self.assertEqual(['db', 'proxy', 'web'], sorted(container_service.cleared))
+
+    def test_reload_twice_compares_with_previous_definition(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file = {'services': {'db': {'image': 'postgres:15'},
+                                         'api': {'image': 'nginx:latest', 'depends_on': ['db']}}}
+            compose_file_path.write_text(yaml.safe_dump(compose_file), encoding='utf-8')
+            services = Services(compose_file_path, ContainerService(
+                compose_file_path, docker_client=MockDockerClient('healthy'), tmpfs_data=True))
+
+            for image in ['postgres:16', 'postgres:17']:
+                compose_file = yaml.safe_load(compose_file_path.read_text(encoding='utf-8'))
+                compose_file['services']['db']['image'] = image
+                compose_file_path.write_text(yaml.safe_dump(compose_file), encoding='utf-8')
+                changed = yaml.safe_load(compose_file_path.read_text(encoding='utf-8'))
+                self.assertEqual(['db'], services.get_changed_services(changed))
+                services.reload(changed)
+
+    one_shot_status = {
+        'db': ServiceStatus.READY,
+        'seed': ServiceStatus.NOT_STARTED,
+        'seed-search': ServiceStatus.NOT_STARTED,
+        'verify': ServiceStatus.NOT_STARTED,
+        'api': ServiceStatus.NOT_STARTED
+    }
+
+    def test_run_one_shot_services_in_waves(self):
+        container_service = OneShotContainerService(dict(self.one_shot_status))
+        services = Services(docker_compose_one_shot_path, container_service)
+
+        self.assertEqual({'seed': 0, 'seed-search': 0, 'verify': 0},
+                         services.run_one_shot_services(['verify', 'seed', 'seed-search']))
+        self.assertEqual(['seed', 'seed-search'], sorted(container_service.runs[:2]))
+        self.assertEqual('verify', container_service.runs[2])
+        self.assertEqual([True, True, False], container_service.buffered_logs)
+        self.assertEqual([], container_service.started)
+
+    def test_run_one_shot_services_starts_dependencies_first(self):
+        status = {**self.one_shot_status, 'db': ServiceStatus.NOT_STARTED}
+        container_service = OneShotContainerService(status, cached=['seed'])
+        services = Services(docker_compose_one_shot_path, container_service)
+
+        self.assertEqual({'verify': 0}, services.run_one_shot_services(['verify']))
+        self.assertEqual(['db'], container_service.started)
+        self.assertEqual(['verify'], container_service.runs)
+
+    def test_run_one_shot_services_names_dependencies_not_started(self):
+        status = {**self.one_shot_status, 'db': ServiceStatus.NOT_STARTED}
+        container_service = FlakyContainerService(status)
+        services = Services(docker_compose_one_shot_path, container_service)
+
+        with self.assertRaises(Exception) as context:
+            services.run_one_shot_services(['seed'])
+        self.assertEqual('dependencies of the one-shot services not started: db', str(context.exception))
+
+    def test_run_one_shot_services_dependency_cycle(self):
+        container_service = OneShotContainerService(dict(self.one_shot_status))
+        services = Services(docker_compose_one_shot_path, container_service)
+        services.compose_file['services']['seed']['depends_on'] = ['verify']
+
+        with self.assertRaises(Exception) as context:
+            services.run_one_shot_services(['verify', 'seed'])
+        self.assertEqual('dependency cycle between one-shot services verify, seed', str(context.exception))
+        self.assertEqual([], container_service.runs)
+
+    def test_run_one_shot_services_stops_after_failure(self):
+        container_service = OneShotContainerService(dict(self.one_shot_status), exit_codes={'seed': 3})
+        services = Services(docker_compose_one_shot_path, container_service)
+
+        self.assertEqual({'seed': 3, 'seed-search': 0},
+                         services.run_one_shot_services(['verify', 'seed', 'seed-search']))
+
+    def test_one_shot_cache(self):
+        status = {
+            'db': ServiceStatus.READY,
+            'seed': ServiceStatus.NOT_STARTED,
+            'seed-search': ServiceStatus.EXECUTED_SUCCESSFULLY,
+            'verify': ServiceStatus.EXECUTED_ERROR,
+            'api': ServiceStatus.NOT_STARTED
+        }
+        container_service = OneShotContainerService(status, cached=['seed'])
+        services = Services(docker_compose_one_shot_path, container_service)
+
+        self.assertEqual(['seed'], services.apply_one_shot_cache())
+        self.assertEqual(['api'], services.get_services_ready_to_start())
+
+        services.store_one_shot_cache()
+        self.assertEqual(['seed', 'seed-search'], container_service.cached)
+
+    def test_record_status_timeline(self):
+        status = {
+            'service-a': ServiceStatus.NOT_STARTED,
+            'service-b': ServiceStatus.NOT_STARTED
+        }
+        services = Services(docker_compose_test_exec_container_path, MockContainerService(status))
+
+        services.start_all_available_services()
+        self.assertEqual(['started'], list(services.timeline['service-a']))
+
+        status['service-a'] = ServiceStatus.READY
+        services.get_services_status()
+        self.assertEqual(['started', 'running', 'ready'], list(services.timeline['service-a']))
+        self.assertNotIn('service-b', services.timeline)
+
+
+class TerminalStatusPresenterTestCase(unittest.TestCase):
+
+    def test_present_redraws_only_changed_lines(self):
+        lines = []
+        presenter = TerminalStatusPresenter(lines.append)
+
+        presenter.present({'service-a': {'status': ServiceStatus.NOT_READY},
+                           'service-b': {'status': ServiceStatus.NOT_STARTED}})
+        self.assertEqual(['service-a : NOT_READY', 'service-b : NOT_STARTED'], lines)
+
+        lines.clear()
+        presenter.present({'service-a': {'status': ServiceStatus.NOT_READY},
+                           'service-b': {'status': ServiceStatus.NOT_STARTED}})
+        self.assertEqual([], lines)
+
+        presenter.present({'service-a': {'status': ServiceStatus.READY},
+                           'service-b': {'status': ServiceStatus.NOT_STARTED}})
+        self.assertEqual(['\033[2A\r\033[2Kservice-a : READY      \033[1B'], lines)
+
+
+class JsonLinesStatusPresenterTestCase(unittest.TestCase):
+
+    def test_present_emits_only_transitions(self):
+        lines = []
+        presenter = JsonLinesStatusPresenter(lines.append)
+
+        presenter.present({'service-a': {'status': ServiceStatus.NOT_READY, 'error': '/ready: refused'}})
+        presenter.present({'service-a': {'status': ServiceStatus.NOT_READY, 'error': '/ready: refused'}})
+        presenter.present({'service-a': {'status': ServiceStatus.READY}})
+
+        events = [json.loads(line) for line in lines]
+        self.assertEqual(2, len(events))
+        self.assertEqual(('service-a', None, 'NOT_READY', '/ready: refused'),
+                         (events[0]['service'], events[0]['old_status'], events[0]['new_status'], events[0]['error']))
+        self.assertEqual(('NOT_READY', 'READY', None),
+                         (events[1]['old_status'], events[1]['new_status'], events[1]['error']))
+        self.assertIn('timestamp', events[1])
+
+
+class ServiceIpRegistryTestCase(unittest.TestCase):
+
+    def test_register_and_remove(self):
+        registry = ServiceIpRegistry()
+
+        registry.register('service-a', '10.0.0.2')
+        registry.register('service-b', '10.0.0.3')
+        self.assertEqual({'SERVICE-A_IP': '10.0.0.2', 'SERVICE-B_IP': '10.0.0.3'}, registry.get_environment())
+        self.assertEqual('SERVICE-A_IP=10.0.0.2 SERVICE-B_IP=10.0.0.3 ', registry.get_args())
+
+        registry.remove('service-a')
+        self.assertEqual('SERVICE-B_IP=10.0.0.3 ', registry.get_args())
+
+    def test_writes_env_and_hosts_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env_file_path = os.path.join(directory, 'ips.env')
+            hosts_file_path = os.path.join(directory, 'hosts')
+            registry = ServiceIpRegistry(env_file_path, hosts_file_path)
+
+            registry.register('service-a', '10.0.0.2')
+
+            self.assertEqual('SERVICE-A_IP=10.0.0.2\n', Path(env_file_path).read_text(encoding='utf-8'))
+            self.assertEqual('10.0.0.2 service-a\n', Path(hosts_file_path).read_text(encoding='utf-8'))
+
+    def test_register_replicas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            hosts_file_path = os.path.join(directory, 'hosts')
+            registry = ServiceIpRegistry(hosts_file_path=hosts_file_path)
+
+            registry.register('db', '10.0.0.2')
+            registry.register_replicas('worker', ['10.0.0.3', '10.0.0.4'])
+
+            self.assertEqual({'DB_IP': '10.0.0.2', 'WORKER_IP': '10.0.0.3', 'WORKER_IPS': '10.0.0.3,10.0.0.4'},
+                             registry.get_environment())
+            self.assertEqual('10.0.0.3', registry.get_ip('worker'))
+            self.assertEqual('10.0.0.2 db\n10.0.0.3 worker\n10.0.0.4 worker\n',
+                             Path(hosts_file_path).read_text(encoding='utf-8'))
+
+            registry.remove('worker')
+            self.assertEqual({'DB_IP': '10.0.0.2'}, registry.get_environment())
+
+
+def create_archive(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for name, content in files.items():
+            if content is None:
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.DIRTYPE
+                archive.addfile(info)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class TimingHistoryTestCase(unittest.TestCase):
+
+    def test_get_expected_averages_last_samples(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = TimingHistory(os.path.join(directory, 'history', 'timings.db'), samples=2)
+            history.record('db', 'sha256:1', 10, 30)
+            history.record('db', 'sha256:1', 2, 4)
+            history.record('db', 'sha256:1', 4, 8)
+            history.record('db', 'sha256:2', 100, 100)
+
+            self.assertEqual({'to_running': 3, 'to_ready': 6}, history.get_expected('db', 'sha256:1'))
+            self.assertIsNone(history.get_expected('cache', 'sha256:1'))
+            history.close()
+
+    def test_no_eta_without_history(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = TimingHistory(os.path.join(directory, 'timings.db'))
+            status = {
+                'db': ServiceStatus.NOT_STARTED,
+                'cache': ServiceStatus.NOT_STARTED,
+                'api': ServiceStatus.NOT_STARTED,
+                'worker': ServiceStatus.NOT_STARTED
+            }
+            services = Services(docker_compose_graph_path, MockContainerService(status), timing_history=history)
+
+            self.assertIsNone(services.get_startup_eta())
+            history.close()
+
+    def test_services_use_history(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = TimingHistory(os.path.join(directory, 'timings.db'))
+            history.record('db', 'sha256:db', 1, 20)
+            status = {
+                'db': ServiceStatus.NOT_STARTED,
+                'cache': ServiceStatus.NOT_STARTED,
+                'api': ServiceStatus.NOT_STARTED,
+                'worker': ServiceStatus.NOT_STARTED
+            }
+            services = Services(docker_compose_graph_path, MockContainerService(status), timing_history=history)
+
+            self.assertEqual(20, services.get_expected_start_seconds('db'))
+            self.assertEqual(21, services.get_startup_eta())
+
+            services.start_time = 0
+            services.timeline = {'cache': {'started': 0, 'running': 1, 'ready': 3}}
+            services.record_timings()
+            self.assertEqual({'to_running': 1, 'to_ready': 3}, history.get_expected('cache', 'sha256:cache'))
+            history.close()
+
+    def test_record_timings_of_image_pulled_during_start(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = TimingHistory(os.path.join(directory, 'timings.db'))
+            container_service = PullingContainerService({'db': ServiceStatus.NOT_STARTED})
+            services = Services(docker_compose_graph_path, container_service, timing_history=history)
+
+            self.assertIsNone(services.get_expected_timings('db'))
+            container_service.digests['db'] = 'sha256:pulled'
+            services.start_time = 0
+            services.timeline = {'db': {'started': 0, 'running': 2, 'ready': 4}}
+            services.record_timings()
+            self.assertEqual({'to_running': 2, 'to_ready': 4}, history.get_expected('db', 'sha256:pulled'))
+            history.close()
+
+
+class OneShotCacheTestCase(unittest.TestCase):
+
+    def test_put_and_get(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, 'cache', 'one-shot-cache.json')
+            OneShotCache(cache_path).put('seed', 'key', {'db-data': '2024-01-01'})
+
+            self.assertEqual({'key': 'key', 'volumes': {'db-data': '2024-01-01'}}, OneShotCache(cache_path).get('seed'))
+            self.assertIsNone(OneShotCache(cache_path).get('verify'))
+
+    def test_hash_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'inputs').mkdir()
+            Path(directory, 'inputs', 'seed.sql').write_text('insert', encoding='utf-8')
+            before = hash_paths([Path(directory, 'inputs')])
+
+            self.assertEqual(before, hash_paths([Path(directory, 'inputs')]))
+            Path(directory, 'inputs', 'seed.sql').write_text('update', encoding='utf-8')
+            self.assertNotEqual(before, hash_paths([Path(directory, 'inputs')]))
+
+
+class LogCaptureTestCase(unittest.TestCase):
+
+    def test_ring_buffer_keeps_last_lines(self):
+        buffer = LogRingBuffer(3)
+        for index in range(10):
+            buffer.write(f'line {index}\n'.encode('utf-8'))
+
+        self.assertEqual(['line 7', 'line 8', 'line 9'], buffer.tail())
+        self.assertEqual(['line 9'], buffer.tail(1))
+
+    def test_ring_buffer_joins_lines_split_across_chunks(self):
+        buffer = LogRingBuffer(10)
+        buffer.write(b'sta')
+        buffer.write(b'rted\nlisten')
+
+        self.assertEqual(['started', 'listen'], buffer.tail())
+
+    def test_ring_buffer_truncates_long_lines(self):
+        buffer = LogRingBuffer(10, max_line_bytes=4)
+        buffer.write(b'x' * 100)
+        buffer.write(b'x' * 100 + b'\nok\n')
+
+        self.assertEqual(['xxxx', 'ok'], buffer.tail())
+
+    def test_capture_per_service(self):
+        capture = LogCapture(2)
+        capture.write('db', b'ready\n')
+        capture.write('api', b'boot\nfailed\n')
+
+        self.assertEqual(['ready'], capture.tail('db'))
+        self.assertEqual(['boot', 'failed'], capture.tail('api'))
+        self.assertEqual([], capture.tail('cache'))
+
+
+def create_stats(total_usage: int, system_usage: int, memory: int, network: int, block_io: int) -> dict:
+    return {
+        'cpu_stats': {'cpu_usage': {'total_usage': total_usage}, 'system_cpu_usage': system_usage,
+                      'online_cpus': 2},
+        'precpu_stats': {'cpu_usage': {'total_usage': 0}, 'system_cpu_usage': 0},
+        'memory_stats': {'usage': memory + 100, 'stats': {'inactive_file': 100}},
+        'networks': {'eth0': {'rx_bytes': network, 'tx_bytes': 0}},
+        'blkio_stats': {'io_service_bytes_recursive': [{'op': 'read', 'value': block_io},
+                                                       {'op': 'total', 'value': block_io}]}
+    }
+
+
+class StatsContainer:
+
+    def __init__(self, samples: list[dict]):
+        self.samples = samples
+
+    def stats(self, stream: bool, decode: bool):
+        return (sample for sample in self.samples)
+
+
+class EndlessStatsContainer:
+
+    def __init__(self):
+        self.closed = False
+
+    def stats(self, stream: bool, decode: bool):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        time.sleep(0.01)
+        return create_stats(10, 100, 1000, 0, 0)
+
+    def close(self):
+        self.closed = True
+
+
+class ResourceStatsTestCase(unittest.TestCase):
+
+    def test_peak_and_average(self):
+        service_stats = ServiceResourceStats()
+        service_stats.add(create_stats(10, 100, 1000, 0, 0), 1.0)
+        service_stats.add(create_stats(30, 100, 3000, 2048, 512), 2.0)
+        service_stats.add(create_stats(20, 100, 2000, 2048, 1024), 3.0)
+
+        summary = service_stats.summary()
+
+        self.assertEqual(3, summary['samples'])
+        self.assertEqual({'peak': 60.0, 'avg': 40.0}, summary['cpu_percent'])
+        self.assertEqual({'peak': 3000, 'avg': 2000.0}, summary['memory_bytes'])
+        self.assertEqual({'peak': 2048.0, 'avg': 1024.0}, summary['network_bytes_per_second'])
+        self.assertEqual({'peak': 512.0, 'avg': 512.0}, summary['block_io_bytes_per_second'])
+
+    def test_sampler(self):
+        sampler = ResourceSampler()
+        sampler.sample('db', StatsContainer([create_stats(10, 100, 1000, 0, 0)]))
+        sampler.sample('api', StatsContainer([]))
+
+        summary = sampler.stop()
+
+        self.assertEqual(1, summary['db']['samples'])
+        self.assertEqual(0, summary['api']['samples'])
+        self.assertEqual({'peak': 0.0, 'avg': 0.0}, summary['api']['cpu_percent'])
+
+    def test_sampler_closes_streams(self):
+        sampler = ResourceSampler()
+        container = EndlessStatsContainer()
+        sampler.sample('db', container)
+
+        sampler.stop()
+
+        self.assertTrue(container.closed)
+
+
+class ExtractArchiveTestCase(unittest.TestCase):
+
+    def test_extract_directory_from_chunks(self):
+        data = create_archive({'reports': None, 'reports/junit.xml': b'<testsuite/>', 'reports/cov': None,
+                               'reports/cov/coverage.xml': b'<coverage/>'})
+        chunks = [data[index:index + 100] for index in range(0, len(data), 100)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            extract_archive(iter(chunks), directory)
+
+            self.assertEqual('<testsuite/>', Path(directory, 'junit.xml').read_text(encoding='utf-8'))
+            self.assertEqual('<coverage/>', Path(directory, 'cov', 'coverage.xml').read_text(encoding='utf-8'))
+
+    def test_extract_single_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            extract_archive([create_archive({'junit.xml': b'<testsuite/>'})], os.path.join(directory, 'out'))
+
+            self.assertEqual('<testsuite/>', Path(directory, 'out', 'junit.xml').read_text(encoding='utf-8'))
+
 
 class ContainerServiceTestCase(unittest.TestCase):
 
@@ -537,12 +1447,13 @@ class HttpServerForReadinessTest(unittest.TestCase):
 
 class MockCheck:
 
-    def __init__(self):
+    def __init__(self, result=(True, None)):
         self.configs = []
+        self.result = result
 
     def check(self, config):
         self.configs.append(config)
-        return (True, None)
+        return self.result
 
 
 class HttpReadinessCheckTest(unittest.TestCase):
@@ -572,6 +1483,806 @@ class HttpReadinessCheckTest(unittest.TestCase):
             }
         ], mock_check.configs)
 
+    def test_is_ready_per_replica_ip(self):
+        mock_check = MockCheck()
+        compose_file = yaml.safe_load(docker_compose_test_exec_container_path.read_text())
+        http_readiness_check = HttpReadinessCheck(compose_file, mock_check.check)
+
+        http_readiness_check.is_ready('service-a', '10.0.0.2', 'opt-service-a-1')
+        http_readiness_check.is_ready('service-a', '10.0.0.3', 'opt-service-a-2')
+
+        self.assertEqual(['10.0.0.2', '10.0.0.2', '10.0.0.3', '10.0.0.3'],
+                         [config['service-ip'] for config in mock_check.configs])
+        self.assertNotIn('service-ip', compose_file['services']['service-a']['x-http-readiness-checks'][0])
+
+    def test_not_ready_cause(self):
+        mock_check = MockCheck((False, 'different status'))
+        compose_file = yaml.safe_load(docker_compose_test_exec_container_path.read_text())
+        http_readiness_check = HttpReadinessCheck(compose_file, mock_check.check)
+
+        self.assertFalse(http_readiness_check.is_ready('service-a', 'ip'))
+        self.assertEqual('/ready1.json: different status', http_readiness_check.get_not_ready_cause('service-a'))
+
+    def test_not_ready_cause_kept_when_other_replica_ready(self):
+        mock_check = MockCheck((False, 'different status'))
+        compose_file = yaml.safe_load(docker_compose_test_exec_container_path.read_text())
+        http_readiness_check = HttpReadinessCheck(compose_file, mock_check.check)
+
+        self.assertFalse(http_readiness_check.is_ready('service-a', '10.0.0.2', 'opt-service-a-1'))
+        mock_check.result = (True, None)
+        self.assertTrue(http_readiness_check.is_ready('service-a', '10.0.0.3', 'opt-service-a-2'))
+        self.assertEqual('/ready1.json: different status', http_readiness_check.get_not_ready_cause('service-a'))
+
+        self.assertTrue(http_readiness_check.is_ready('service-a', '10.0.0.2', 'opt-service-a-1'))
+        self.assertIsNone(http_readiness_check.get_not_ready_cause('service-a'))
+
+
+class MockApiClient:
+
+    def __init__(self, health_status: str):
+        self.health_status = health_status
+        self.inspected = []
+
+    def inspect_container(self, container_name: str) -> dict:
+        self.inspected.append(container_name)
+        return {'State': {'Health': {'Status': self.health_status}}}
+
+
+class MockDockerClient:
+
+    def __init__(self, health_status: str):
+        self.api = MockApiClient(health_status)
+
+
+class HealthReadinessCheckTest(unittest.TestCase):
+
+    def test_uses_shared_client(self):
+        docker_client = MockDockerClient('starting')
+        compose_file = {'services': {'db': {'x-container-readiness-check': None}}}
+        health_readiness_check = HealthReadinessCheck(docker_client, compose_file)
+
+        self.assertFalse(health_readiness_check.is_ready('db', '10.0.0.2'))
+        self.assertFalse(health_readiness_check.is_ready('db', '10.0.0.3', 'opt-db-2'))
+        self.assertEqual(['db', 'opt-db-2'], docker_client.api.inspected)
+        self.assertEqual('health status starting', health_readiness_check.get_not_ready_cause('db'))
+
+
+class FileWatcherTestCase(unittest.TestCase):
+
+    def assert_detects_change(self, use_inotify: bool):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = os.path.join(directory, 'docker-compose.yml')
+            Path(compose_file_path).write_text('services: {}', encoding='utf-8')
+            watcher = FileWatcher([compose_file_path, os.path.join(directory, 'env')], 0.05, use_inotify)
+            try:
+                self.assertEqual([], watcher.wait_for_change(0.1))
+                Path(compose_file_path).write_text('services: {db: {}}', encoding='utf-8')
+                self.assertEqual([compose_file_path], watcher.wait_for_change(5))
+            finally:
+                watcher.close()
+
+    def test_polling(self):
+        self.assert_detects_change(False)
+
+    def test_inotify(self):
+        self.assert_detects_change(True)
+
+    def test_read_env_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env_file_path = os.path.join(directory, 'env')
+            Path(env_file_path).write_text('# comment\nDB_URL=postgres://db\n\nTOKEN = a=b\n', encoding='utf-8')
+
+            self.assertEqual({'DB_URL': 'postgres://db', 'TOKEN': 'a=b'}, read_env_file(env_file_path))
+            self.assertEqual({}, read_env_file(None))
+
+
+class FakeIpContainerService(BaseContainerService):
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def get_services_ips(self) -> dict:
+        return {'DB_IP': f'10.0.{self.index}.2'}
+
+
+class FakeServices:
+
+    def __init__(self, index: int):
+        self.container_service = FakeIpContainerService(index)
+
+
+class FakeStack:
+
+    def __init__(self, index: int):
+        self.services = FakeServices(index)
+        self.starts = 0
+        self.clears = 0
+
+    def start(self, verification_step_millis, presentation_step_millis, run_exec_container):
+        self.starts += 1
+
+    def clear_all(self):
+        self.clears += 1
+
+
+class FakeStackPool(StackPool):
+
+    def _create_stack(self, index: int):
+        return FakeStack(index)
+
+
+class FailingStack(FakeStack):
+
+    def start(self, verification_step_millis, presentation_step_millis, run_exec_container):
+        self.starts += 1
+        raise APIError('daemon unavailable')
+
+
+class FailingStackPool(StackPool):
+
+    def _create_stack(self, index: int):
+        return FailingStack(index)
+
+
+class StackPoolTestCase(unittest.TestCase):
+
+    def test_write_stack_compose_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stack_compose_file_path = write_stack_compose_file(docker_compose_graph_path, Path(directory, 'stack1'),
+                                                               '-stack1')
+            compose_file = yaml.safe_load(stack_compose_file_path.read_text(encoding='utf-8'))
+
+            self.assertEqual('opt-stack1', compose_file['name'])
+            self.assertEqual('db-stack1', compose_file['services']['db']['container_name'])
+            self.assertEqual(['db', 'cache'], compose_file['services']['api']['depends_on'])
+
+    def test_write_stack_compose_file_named_volumes_and_networks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({
+                'services': {'db': {'image': 'postgres:15', 'volumes': ['data:/var/lib/postgresql/data']}},
+                'volumes': {'data': {'name': 'db-data'}, 'cache': None, 'shared': {'name': 'shared', 'external': True}},
+                'networks': {'back': {'name': 'backend'}}
+            }), encoding='utf-8')
+            compose_file = yaml.safe_load(write_stack_compose_file(compose_file_path, Path(directory, 'stack1'),
+                                                                   '-stack1').read_text(encoding='utf-8'))
+
+            self.assertEqual({'data': {'name': 'db-data-stack1'}, 'cache': None,
+                              'shared': {'name': 'shared', 'external': True}}, compose_file['volumes'])
+            self.assertEqual({'back': {'name': 'backend-stack1'}}, compose_file['networks'])
+
+    def test_lease_and_recycle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pool = FakeStackPool(str(docker_compose_graph_path), 2, directory, reset_hook=lambda stack: True)
+            pool.start()
+
+            with pool.lease(5) as first, pool.lease(5) as second:
+                self.assertEqual({first.index, second.index}, {0, 1})
+                self.assertEqual(f'10.0.{first.index}.2', first.environment['DB_IP'])
+                self.assertRaises(queue.Empty, pool.lease, 0.01)
+
+            pool.lease(5)
+            pool.lease(5)
+            self.assertEqual([1, 1], [stack.starts for stack in pool.stacks.values()])
+            self.assertEqual([0, 0], [stack.clears for stack in pool.stacks.values()])
+            pool.close()
+            self.assertEqual([1, 1], [stack.clears for stack in pool.stacks.values()])
+
+    def test_lease_fails_when_stacks_cannot_start(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pool = FailingStackPool(str(docker_compose_graph_path), 2, directory, max_warm_attempts=2)
+            pool.start()
+
+            for _ in range(2):
+                with self.assertRaises(Exception) as context:
+                    pool.lease(5)
+                self.assertIn('stack0 APIError daemon unavailable', str(context.exception))
+            self.assertEqual({0: 2, 1: 2}, pool.failures)
+            self.assertEqual([2, 2], [stack.starts for stack in pool.stacks.values()])
+            pool.close()
+
+    def test_recycle_without_reset_hook_restarts_stack(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pool = FakeStackPool(str(docker_compose_graph_path), 1, directory)
+            pool.start()
+
+            pool.lease(5).release()
+            pool.lease(5).release()
+            pool.lease(5)
+            pool.close()
+            self.assertEqual(3, pool.stacks[0].starts)
+
+
+class EphemeralVolumesTestCase(unittest.TestCase):
+
+    @staticmethod
+    def create_compose_file() -> dict:
+        return {
+            'services': {
+                'db': {'volumes': ['db-data:/var/lib/postgresql/data', './init:/docker-entrypoint-initdb.d']},
+                'search': {'volumes': [{'type': 'volume', 'source': 'search-data', 'target': '/data'}, '/tmp/work'],
+                           'x-ephemeral-volumes': {'/data': '1g'}},
+                'cache': {'volumes': ['cache-data:/data'], 'x-ephemeral-volumes': False}
+            },
+            'volumes': {'db-data': None, 'search-data': None, 'cache-data': None}
+        }
+
+    def test_extension_key(self):
+        compose_file = self.create_compose_file()
+
+        self.assertEqual({'search': ['/data']}, apply_ephemeral_volumes(compose_file, False, '256m'))
+        self.assertEqual([{'type': 'tmpfs', 'target': '/data', 'tmpfs': {'size': '1g'}}, '/tmp/work'],
+                         compose_file['services']['search']['volumes'])
+        self.assertEqual(['db-data:/var/lib/postgresql/data', './init:/docker-entrypoint-initdb.d'],
+                         compose_file['services']['db']['volumes'])
+
+    def test_all_data_volumes(self):
+        compose_file = self.create_compose_file()
+
+        self.assertEqual({'db': ['/var/lib/postgresql/data'], 'search': ['/data']},
+                         apply_ephemeral_volumes(compose_file, True, '256m'))
+        self.assertEqual([{'type': 'tmpfs', 'target': '/var/lib/postgresql/data', 'tmpfs': {'size': '256m'}},
+                          './init:/docker-entrypoint-initdb.d'], compose_file['services']['db']['volumes'])
+        self.assertEqual(['cache-data:/data'], compose_file['services']['cache']['volumes'])
+
+    def test_parse_df_output(self):
+        output = 'Filesystem     1K-blocks  Used Available Use% Mounted on\n' \
+                 'tmpfs             262144 10240    251904   4% /var/lib/postgresql/data\n'
+
+        self.assertEqual({'size_bytes': 268435456, 'used_bytes': 10485760}, parse_df_output(output))
+        self.assertIsNone(parse_df_output('df: /data: No such file or directory'))
+
+
+class ImageBuildsTestCase(unittest.TestCase):
+
+    def test_get_build_spec(self):
+        self.assertEqual({'context': './app', 'dockerfile': 'Dockerfile', 'args': {}, 'target': None, 'image': None},
+                         get_build_spec({'build': './app'}))
+        self.assertEqual({'context': '.', 'dockerfile': 'test.Dockerfile', 'args': {'VERSION': '1'}, 'target': 'test',
+                          'image': 'org/api:dev'},
+                         get_build_spec({'build': {'dockerfile': 'test.Dockerfile', 'args': ['VERSION=1'],
+                                                   'target': 'test'}, 'image': 'org/api:dev'}))
+        self.assertIsNone(get_build_spec({'build': 'https://github.com/org/app.git'}))
+        self.assertIsNone(get_build_spec({'image': 'postgres:15'}))
+
+    def test_get_build_spec_left_to_compose(self):
+        self.assertIsNone(get_build_spec({'build': {'context': '.', 'secrets': ['token']}}))
+        self.assertIsNone(get_build_spec({'build': {'context': '.', 'platform': 'linux/arm64'}}))
+        self.assertIsNone(get_build_spec({'build': {'context': 'app', 'dockerfile': '../Dockerfile'}}))
+        self.assertIsNone(get_build_spec({'build': {'context': 'app', 'dockerfile': '/etc/Dockerfile'}}))
+        self.assertIsNotNone(get_build_spec({'build': {'context': 'app', 'dockerfile': 'docker/../Dockerfile'}}))
+
+    def test_get_build_tag_follows_context_content(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'Dockerfile').write_text('FROM busybox', encoding='utf-8')
+            build_spec = get_build_spec({'build': directory})
+            tag = get_build_tag('API', build_spec, Path(directory))
+
+            self.assertTrue(tag.startswith('dc-test-exec-build/api:'))
+            self.assertEqual(tag, get_build_tag('API', build_spec, Path(directory)))
+            self.assertNotEqual(tag, get_build_tag('API', {**build_spec, 'target': 'test'}, Path(directory)))
+            Path(directory, 'Dockerfile').write_text('FROM alpine', encoding='utf-8')
+            self.assertNotEqual(tag, get_build_tag('API', build_spec, Path(directory)))
+
+    def test_get_build_command(self):
+        self.assertEqual(['build', '--tag', 'api:1', '--file', '/build/Dockerfile', '--build-arg', 'VERSION=1',
+                          '--target', 'test', '/build'],
+                         get_build_command('api:1', {'context': '.', 'dockerfile': 'Dockerfile',
+                                                     'args': {'VERSION': '1'}, 'target': 'test', 'image': None}))
+        self.assertEqual(['build', '--tag', 'api:1', '--file', '/build/Dockerfile', '--tag', 'org/api:dev', '/build'],
+                         get_build_command('api:1', {'context': '.', 'dockerfile': 'Dockerfile', 'args': {},
+                                                     'target': None, 'image': 'org/api:dev'}))
+
+
+class DockerClientTestCase(unittest.TestCase):
+
+    def test_pool_size(self):
+        self.assertEqual(10, get_pool_size(2))
+        self.assertEqual(44, get_pool_size(20))
+
+
+class FakeVolume:
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeVolumes:
+
+    def get(self, name: str):
+        return FakeVolume(name)
+
+
+class RecordingContainers:
+
+    def __init__(self):
+        self.runs = []
+
+    def run(self, image: str, command: str, **_kwargs):
+        self.runs.append((image, command))
+
+
+class SnapshotImageDockerClient(MockDockerClient):
+
+    def __init__(self):
+        super().__init__('healthy')
+        self.images = FakeImages(None)
+        self.volumes = FakeVolumes()
+        self.containers = RecordingContainers()
+
+
+class RestoreSnapshotTestCase(unittest.TestCase):
+
+    def test_image_restore_runs_cp_in_shell(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({
+                'services': {'db': {'image': 'postgres:15', 'volumes': ['data:/var/lib/postgresql/data']}},
+                'volumes': {'data': None}
+            }), encoding='utf-8')
+            docker_client = SnapshotImageDockerClient()
+            container_service = ContainerService(compose_file_path, docker_client=docker_client)
+
+            self.assertTrue(container_service.restore_snapshot(Path(directory, 'snapshots')))
+            self.assertEqual([(f'dc-test-exec-snapshot:{container_service.get_snapshot_fingerprint()}',
+                               'sh -c "cp -a /snapshot/data/. /volume/"')], docker_client.containers.runs)
+
+
+class SnapshotFingerprintTestCase(unittest.TestCase):
+
+    def test_ignores_run_labels_and_tmpfs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({
+                'services': {
+                    'db': {'image': 'postgres:15', 'volumes': ['data:/var/lib/postgresql/data']},
+                    'seed': {'image': 'busybox:latest', 'x-one-shot': None, 'depends_on': ['db']}
+                },
+                'volumes': {'data': None}
+            }), encoding='utf-8')
+            fingerprints = {ContainerService(compose_file_path, docker_client=MockDockerClient('healthy'),
+                                             **kwargs).get_snapshot_fingerprint()
+                            for kwargs in [{'run_id': 'a'}, {'run_id': 'b'}, {'run_id': 'a', 'tmpfs_data': True}]}
+            self.assertEqual(1, len(fingerprints))
+
+
+class GeneratedComposeFileTestCase(unittest.TestCase):
+
+    def test_written_only_when_launching(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({'services': {'db': {'image': 'postgres:15'}}}),
+                                         encoding='utf-8')
+            generated_dir = Path(directory, '.dc-test-exec')
+
+            ContainerService(compose_file_path, docker_client=MockDockerClient('healthy'))
+            self.assertFalse(generated_dir.exists())
+
+            first = ContainerService(compose_file_path, docker_client=MockDockerClient('healthy'), run_id='a')
+            generated_path = first._get_launch_compose_file_path_host()
+            self.assertEqual('a', yaml.safe_load(generated_path.read_text(encoding='utf-8'))
+                             ['services']['db']['labels'][LABEL_RUN_ID])
+            self.assertEqual(generated_path, first._get_launch_compose_file_path_host())
+
+            second = ContainerService(compose_file_path, docker_client=MockDockerClient('healthy'), run_id='b',
+                                      tmpfs_data=True)
+            self.assertNotEqual(generated_path, second._get_launch_compose_file_path_host())
+            self.assertEqual('a', yaml.safe_load(generated_path.read_text(encoding='utf-8'))
+                             ['services']['db']['labels'][LABEL_RUN_ID])
+            self.assertEqual(['*'], (generated_dir / '.gitignore').read_text(encoding='utf-8').split())
+
+
+class FakeContainer:
+
+    def __init__(self, name: str, ip_address: str = '10.0.0.2', labels: dict = None, status: str = 'running'):
+        self.name = name
+        self.id = name
+        self.status = status
+        self.labels = labels or {}
+        self.attrs = {'Names': [f'/{name}'], 'State': {'StartedAt': '2024-01-01T00:00:00Z', 'ExitCode': 0},
+                      'NetworkSettings': {'IPAddress': ip_address, 'Networks': {}}}
+
+    def logs(self, **_kwargs):
+        return iter([f'{self.name} started\n'.encode('utf-8')])
+
+    def restart(self, started_at: str) -> None:
+        self.attrs['State']['StartedAt'] = started_at
+
+
+class FakeContainers:
+
+    def __init__(self, containers: list):
+        # attach_network looks up the container running the tests when inside docker
+        self.containers = containers + [FakeContainer(os.uname().nodename)]
+
+    def get(self, name: str):
+        for container in self.containers:
+            if container.name == name:
+                return container
+        raise NotFound(name)
+
+    def list(self, **kwargs):
+        filters = kwargs.get('filters') or {}
+        labels = filters.get('label', [])
+        return [container for container in self.containers
+                if all(container.labels.get(label.split('=', 1)[0]) == label.split('=', 1)[1] for label in labels) and
+                filters.get('name', '') in container.name and
+                filters.get('status', container.status) == container.status]
+
+
+class FakeContainersDockerClient(MockDockerClient):
+
+    def __init__(self, containers: list):
+        super().__init__('healthy')
+        self.containers = FakeContainers(containers)
+
+
+class CountingReadinessCheck(BaseReadinessCheck):
+
+    def __init__(self, ready: bool = True, ready_containers: list = None):
+        self.ready = ready
+        self.ready_containers = ready_containers
+        self.checked = []
+
+    def is_ready(self, service_name: str, service_ip: str, container_name: str = None) -> bool:
+        self.checked.append(container_name)
+        if self.ready_containers is not None:
+            return container_name in self.ready_containers
+        return self.ready
+
+
+def create_container_service(directory: str, compose_file: dict, containers: list, **kwargs) -> ContainerService:
+    compose_file_path = Path(directory, 'docker-compose.yml')
+    compose_file_path.write_text(yaml.safe_dump(compose_file), encoding='utf-8')
+    return ContainerService(compose_file_path, docker_client=FakeContainersDockerClient(containers), **kwargs)
+
+
+class ContainerServiceStatusTestCase(unittest.TestCase):
+
+    def test_deferred_probe_registers_ip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            readiness_check = CountingReadinessCheck()
+            container_service = create_container_service(
+                directory, {'services': {'db': {'image': 'postgres:15'}}}, [FakeContainer('db', '10.0.0.7')],
+                readiness_check=readiness_check)
+            container_service.defer_readiness_check('db', time.time() + 60)
+
+            self.assertEqual(ServiceStatus.NOT_READY, container_service.get_service_status('db'))
+            self.assertEqual([], readiness_check.checked)
+            self.assertEqual({'DB_IP': '10.0.0.7'}, container_service.ip_registry.get_environment())
+
+
+    def test_failed_starts_from_exited_creators(self):
+        with tempfile.TemporaryDirectory() as directory:
+            container_service = create_container_service(
+                directory, {'services': {'db': {'image': 'postgres:15'}, 'cache': {'image': 'redis:7'}}},
+                [FakeContainer('db_creator', status='exited'), FakeContainer('cache_creator'),
+                 FakeContainer('other_creator', status='exited')])
+
+            self.assertEqual({'db'}, container_service.get_failed_starts())
+
+
+class MissingPathContainer(FakeContainer):
+
+    def get_archive(self, path: str):
+        raise NotFound(path)
+
+
+class CollectTestCase(unittest.TestCase):
+
+    def test_collect_missing_path(self):
+        with tempfile.TemporaryDirectory() as directory:
+            printed = []
+            container_service = create_container_service(directory, {'services': {'tests': {'image': 'busybox'}}},
+                                                         [], print_function=printed.append)
+
+            container_service.collect(MissingPathContainer('tests'), [('/reports', directory)])
+            self.assertEqual(['nothing collected from tests:/reports, path not found'], printed)
+
+
+class ReadinessMemoTestCase(unittest.TestCase):
+
+    compose_file = {'services': {'db': {'image': 'postgres:15'}}}
+
+    def test_ready_service_not_probed_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            readiness_check = CountingReadinessCheck()
+            container_service = create_container_service(directory, self.compose_file, [FakeContainer('db')],
+                                                         readiness_check=readiness_check)
+
+            self.assertEqual(ServiceStatus.READY, container_service.get_service_status('db'))
+            self.assertEqual(ServiceStatus.READY, container_service.get_service_status('db'))
+            self.assertEqual(['db'], readiness_check.checked)
+
+    def test_restarted_service_probed_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            readiness_check = CountingReadinessCheck()
+            container = FakeContainer('db')
+            container_service = create_container_service(directory, self.compose_file, [container],
+                                                         readiness_check=readiness_check)
+            self.assertEqual(ServiceStatus.READY, container_service.get_service_status('db'))
+
+            container.restart('2024-01-01T00:05:00Z')
+            readiness_check.ready = False
+            self.assertEqual(ServiceStatus.NOT_READY, container_service.get_service_status('db'))
+            self.assertEqual(['db', 'db'], readiness_check.checked)
+
+    def test_liveness_recheck(self):
+        with tempfile.TemporaryDirectory() as directory:
+            readiness_check = CountingReadinessCheck()
+            container_service = create_container_service(directory, self.compose_file, [FakeContainer('db')],
+                                                         readiness_check=readiness_check,
+                                                         liveness_recheck_seconds=0.05)
+            self.assertEqual(ServiceStatus.READY, container_service.get_service_status('db'))
+            self.assertEqual(ServiceStatus.READY, container_service.get_service_status('db'))
+            self.assertEqual(['db'], readiness_check.checked)
+
+            time.sleep(0.06)
+            readiness_check.ready = False
+            self.assertEqual(ServiceStatus.NOT_READY, container_service.get_service_status('db'))
+            self.assertEqual(['db', 'db'], readiness_check.checked)
+
+
+class ReplicatedServiceStatusTestCase(unittest.TestCase):
+
+    compose_file = {'services': {'web': {'image': 'nginx:latest', 'deploy': {'replicas': 3},
+                                         'x-ready-replicas': 2}}}
+
+    @staticmethod
+    def create_replicas() -> list:
+        return [FakeContainer(f'{project}-web-{index}', f'10.0.{project_index}.{index}',
+                              {'com.docker.compose.project': project, 'com.docker.compose.service': 'web'})
+                for project_index, project in enumerate(['opt', 'other']) for index in range(1, 4)]
+
+    def test_ready_when_enough_replicas_ready(self):
+        with tempfile.TemporaryDirectory() as directory:
+            readiness_check = CountingReadinessCheck(ready_containers=['opt-web-1'])
+            container_service = create_container_service(directory, self.compose_file, self.create_replicas(),
+                                                         readiness_check=readiness_check)
+
+            self.assertEqual(ServiceStatus.NOT_READY, container_service.get_service_status('web'))
+            self.assertEqual(['opt-web-1', 'opt-web-2', 'opt-web-3'], sorted(readiness_check.checked))
+
+            readiness_check.ready_containers.append('opt-web-3')
+            self.assertEqual(ServiceStatus.READY, container_service.get_service_status('web'))
+
+    def test_replicas_by_number(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replicas = [FakeContainer(f'opt-web-{index}', f'10.0.0.{index}',
+                                      {'com.docker.compose.project': 'opt', 'com.docker.compose.service': 'web',
+                                       'com.docker.compose.container-number': str(index)}) for index in [10, 2, 1]]
+            container_service = create_container_service(directory, self.compose_file, replicas)
+
+            self.assertEqual({'WEB_IP': '10.0.0.1', 'WEB_IPS': '10.0.0.1,10.0.0.2,10.0.0.10'},
+                             container_service.get_services_ips())
+
+    def test_ips_only_from_own_project(self):
+        with tempfile.TemporaryDirectory() as directory:
+            container_service = create_container_service(directory, self.compose_file, self.create_replicas())
+
+            self.assertEqual({'WEB_IP': '10.0.0.1', 'WEB_IPS': '10.0.0.1,10.0.0.2,10.0.0.3'},
+                             container_service.get_services_ips())
+
+    def test_replica_logs_under_service(self):
+        with tempfile.TemporaryDirectory() as directory:
+            container_service = create_container_service(directory, self.compose_file, self.create_replicas(),
+                                                         readiness_check=CountingReadinessCheck(), capture_logs=10)
+            container_service.get_service_status('web')
+
+            for _ in range(100):
+                if len(container_service.get_captured_logs('web')) == 3:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(['opt-web-1 | opt-web-1 started', 'opt-web-2 | opt-web-2 started',
+                              'opt-web-3 | opt-web-3 started'], container_service.get_captured_logs('web'))
+
+
+class FakeImages:
+
+    def __init__(self, tags: list[str]):
+        self.tags = tags
+
+    def get(self, tag: str):
+        if self.tags is not None and tag not in self.tags:
+            raise NotFound(tag)
+        return tag
+
+
+class BuiltImagesDockerClient(MockDockerClient):
+
+    def __init__(self, tags: list[str]):
+        super().__init__('healthy')
+        self.images = FakeImages(tags)
+
+
+class BuiltImagesTestCase(unittest.TestCase):
+
+    def test_launch_uses_image_built_by_start(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'api').mkdir()
+            Path(directory, 'api', 'Dockerfile').write_text('FROM busybox\n', encoding='utf-8')
+            compose_file_path = Path(directory, 'docker-compose.yml')
+            compose_file_path.write_text(yaml.safe_dump({'services': {
+                'api': {'build': 'api'},
+                'worker': {'build': 'api'},
+                'db': {'image': 'postgres:15'}
+            }}), encoding='utf-8')
+            build_spec = get_build_spec({'build': 'api'})
+            tag = get_build_tag('api', build_spec, Path(directory, 'api'))
+
+            container_service = ContainerService(compose_file_path, docker_client=BuiltImagesDockerClient([tag]))
+            generated = yaml.safe_load(
+                container_service._get_launch_compose_file_path_host().read_text(encoding='utf-8'))
+
+            self.assertEqual({'image': tag}, {key: value for key, value in generated['services']['api'].items()
+                                              if key in ['build', 'image']})
+            self.assertIn('build', generated['services']['worker'])
+            self.assertEqual({'api': tag}, container_service.built_images)
+
+
+class FakeReapedResource:
+
+    def __init__(self, attrs: dict, fail: bool = False):
+        self.attrs = attrs
+        self.fail = fail
+        self.removed = False
+
+    def remove(self, **_kwargs):
+        if self.fail:
+            raise APIError('in use')
+        self.removed = True
+
+
+class FakeReapedCollection:
+
+    def __init__(self, resources: list):
+        self.resources = resources
+        self.filters = None
+
+    def list(self, **kwargs):
+        self.filters = kwargs['filters']
+        return self.resources
+
+
+class FakeReapedDockerClient:
+
+    def __init__(self, containers: list, networks: list):
+        self.containers = FakeReapedCollection(containers)
+        self.networks = FakeReapedCollection(networks)
+
+
+class ReaperTestCase(unittest.TestCase):
+
+    def test_apply_run_labels(self):
+        compose_file = {
+            'services': {
+                'a': {'image': 'a', 'labels': {'team': 'x'}},
+                'b': {'image': 'b', 'labels': ['team=y']},
+                'c': {'image': 'c'}
+            },
+            'networks': {'back': None, 'outside': {'external': True}}
+        }
+        apply_run_labels(compose_file, get_run_labels('abc'))
+        self.assertEqual({'team': 'x', LABEL_RUN_ID: 'abc'}, compose_file['services']['a']['labels'])
+        self.assertEqual(['team=y', f'{LABEL_RUN_ID}=abc'], compose_file['services']['b']['labels'])
+        self.assertEqual({LABEL_RUN_ID: 'abc'}, compose_file['services']['c']['labels'])
+        self.assertEqual({LABEL_RUN_ID: 'abc'}, compose_file['networks']['back']['labels'])
+        self.assertEqual({LABEL_RUN_ID: 'abc'}, compose_file['networks']['default']['labels'])
+        self.assertNotIn('labels', compose_file['networks']['outside'])
+
+    def test_default_run_id_is_stable(self):
+        self.assertEqual(get_default_run_id('/a/dc.yml', 'opt'), get_default_run_id('/a/dc.yml', 'opt'))
+        self.assertNotEqual(get_default_run_id('/a/dc.yml', 'opt'), get_default_run_id('/b/dc.yml', 'opt'))
+
+    def test_created_seconds(self):
+        self.assertEqual(100.0, get_created_seconds(100))
+        self.assertEqual(86400.5, get_created_seconds('1970-01-02T00:00:00.500000123Z'))
+
+    def test_reap_only_expired(self):
+        now = int(time.time())
+        old = FakeReapedResource({'Names': ['/old'], 'Created': now - 7200})
+        new = FakeReapedResource({'Names': ['/new'], 'Created': now})
+        gone = FakeReapedResource({'Names': ['/gone'], 'Created': now - 7200}, fail=True)
+        network = FakeReapedResource({'Name': 'opt_default', 'Created': '2000-01-01T00:00:00.000000000Z'})
+        docker_client = FakeReapedDockerClient([old, new, gone], [network])
+        removed = reap(docker_client, 3600, 'abc')
+        self.assertEqual({'containers': ['old'], 'networks': ['opt_default'], 'active_runs': []}, removed)
+        self.assertFalse(new.removed)
+        self.assertEqual({'label': [f'{LABEL_RUN_ID}=abc']}, docker_client.containers.filters)
+
+    def test_reap_all_runs(self):
+        docker_client = FakeReapedDockerClient([], [])
+        self.assertEqual({'containers': [], 'networks': [], 'active_runs': []}, reap(docker_client, 0))
+        self.assertEqual({'label': [LABEL_RUN_ID]}, docker_client.networks.filters)
+
+    def test_reap_skips_runs_with_running_containers(self):
+        old = int(time.time()) - 7200
+        running = FakeReapedResource({'Names': ['/db'], 'Created': old, 'State': 'running',
+                                      'Labels': {LABEL_RUN_ID: 'live'}})
+        creator = FakeReapedResource({'Names': ['/db-creator'], 'Created': old, 'State': 'exited',
+                                      'Labels': {LABEL_RUN_ID: 'live'}})
+        stale = FakeReapedResource({'Names': ['/web'], 'Created': old, 'State': 'exited',
+                                    'Labels': {LABEL_RUN_ID: 'dead'}})
+        live_network = FakeReapedResource({'Name': 'live_default', 'Created': old, 'Labels': {LABEL_RUN_ID: 'live'}})
+        docker_client = FakeReapedDockerClient([running, creator, stale], [live_network])
+        removed = reap(docker_client, 3600)
+        self.assertEqual({'containers': ['web'], 'networks': [], 'active_runs': ['live']}, removed)
+        self.assertFalse(running.removed)
+        self.assertFalse(creator.removed)
+        self.assertFalse(live_network.removed)
+
+    def test_reap_forced_removes_running_containers(self):
+        running = FakeReapedResource({'Names': ['/db'], 'Created': int(time.time()) - 7200, 'State': 'running',
+                                      'Labels': {LABEL_RUN_ID: 'live'}})
+        docker_client = FakeReapedDockerClient([running], [])
+        self.assertEqual({'containers': ['db'], 'networks': [], 'active_runs': []},
+                         reap(docker_client, 3600, force=True))
+
+
+class SharedStackTestCase(unittest.TestCase):
+
+    def test_started_once_across_workers(self):
+        started = []
+
+        def start():
+            started.append(threading.current_thread().name)
+            time.sleep(0.1)
+            return {'DB_IP': '172.18.0.2'}
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            results = []
+            workers = [threading.Thread(target=lambda: results.append(SharedStack(Path(state_dir)).acquire(start)))
+                       for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual(1, len(started))
+            self.assertEqual([{'DB_IP': '172.18.0.2'}] * 4, results)
+
+    def test_failed_start_recorded(self):
+        started = []
+
+        def start():
+            started.append(True)
+            raise SystemExit(1)
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            for _ in range(2):
+                with self.assertRaises(Exception) as context:
+                    SharedStack(Path(state_dir)).acquire(start)
+                self.assertEqual('stack not started, exit code 1', str(context.exception))
+            self.assertEqual(1, len(started))
+
+    def test_stopped_once(self):
+        stopped = []
+        with tempfile.TemporaryDirectory() as state_dir:
+            self.assertFalse(SharedStack(Path(state_dir)).release(lambda: stopped.append(True)))
+            SharedStack(Path(state_dir)).acquire(lambda: {})
+            self.assertTrue(SharedStack(Path(state_dir)).release(lambda: stopped.append(True)))
+            self.assertFalse(SharedStack(Path(state_dir)).release(lambda: stopped.append(True)))
+            self.assertEqual(1, len(stopped))
+
+    def test_imports_without_fcntl(self):
+        locks = []
+        fake_msvcrt = types.ModuleType('msvcrt')
+        fake_msvcrt.LK_LOCK = 1
+        fake_msvcrt.LK_UNLCK = 0
+        fake_msvcrt.locking = lambda fd, mode, size: locks.append(mode)
+        with unittest.mock.patch.dict(sys.modules, {'fcntl': None, 'msvcrt': fake_msvcrt}):
+            spec = importlib.util.find_spec('dc_test_exec.pytest_plugin')
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+            with tempfile.TemporaryDirectory() as state_dir:
+                self.assertEqual({'DB_IP': '172.18.0.2'},
+                                 plugin.SharedStack(Path(state_dir)).acquire(lambda: {'DB_IP': '172.18.0.2'}))
+        self.assertEqual([1, 0], locks)
+
+    def test_stack_ip(self):
+        stack = Stack('/a/dc.yml', {'DB_IP': '172.18.0.2'})
+        self.assertEqual('172.18.0.2', stack.get_ip('db'))
+        self.assertIsNone(stack.get_ip('cache'))
+
 
 if __name__ == '__main__':
     unittest.main()